@@ -0,0 +1,102 @@
+"""Per-request database connection overhead for each DB_CONNECTION_MODE.
+
+Runs against the Postgres configured in settings (start a local one first)::
+
+    python benchmarks/db_connection_overhead.py --requests 500
+
+Each mode is measured in its own subprocess because the mode is read when
+settings are imported. Requests go through Django's test client, which fires
+the same request_started/request_finished signals that open and recycle
+connections under a real server, so the difference between modes is the
+connection setup cost a request pays.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from wsgiref.util import setup_testing_defaults
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+MODES = ('none', 'persistent', 'pool')
+
+
+def measure(requests, path):
+    import logging
+
+    import django
+
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'business_management_app.settings')
+    django.setup()
+    logging.disable(logging.CRITICAL)
+
+    from django.core.handlers.wsgi import WSGIHandler
+
+    from management.db_metrics import connection_stats
+
+    handler = WSGIHandler()
+    path_info, _, query_string = path.partition('?')
+
+    def get():
+        environ = {}
+        setup_testing_defaults(environ)
+        environ.update({'PATH_INFO': path_info, 'QUERY_STRING': query_string, 'HTTP_HOST': 'localhost'})
+        statuses = []
+        response = handler(environ, lambda status, headers: statuses.append(status))
+        b''.join(response)
+        response.close()  # fires request_finished, which recycles the connection
+        assert statuses[0].startswith('200'), statuses[0]
+
+    get()  # warm-up: imports, URL resolver, pool start-up
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        get()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'p50_ms': round(timings[len(timings) // 2], 3),
+        'p99_ms': round(timings[int(len(timings) * 0.99) - 1], 3),
+        'stats': connection_stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--path', default='/api/invoices/?limit=1')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(measure(args.requests, args.path)))
+        return
+
+    results = {}
+    for mode in MODES:
+        completed = subprocess.run(
+            [sys.executable, __file__, '--mode', mode, '--requests', str(args.requests), '--path', args.path],
+            env={**os.environ, 'DB_CONNECTION_MODE': mode},
+            capture_output=True, text=True, check=True,
+        )
+        results[mode] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    baseline = results['none']['mean_ms']
+    for mode, result in results.items():
+        saved = baseline - result['mean_ms']
+        print(f"{mode:10} mean={result['mean_ms']:.3f}ms p50={result['p50_ms']:.3f}ms "
+              f"p99={result['p99_ms']:.3f}ms saved/request={saved:+.3f}ms "
+              f"connections_opened={result['stats']['connections_opened']}")
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Local load test: async read API under ASGI vs the same URLs under WSGI.
+
+Start the two servers against the same database, e.g.::
+
+    gunicorn business_management_app.wsgi -w 4 -b 127.0.0.1:8001
+    uvicorn business_management_app.asgi:application --workers 4 --port 8002
+
+then run::
+
+    python benchmarks/load_test_api.py --wsgi http://127.0.0.1:8001 \\
+        --asgi http://127.0.0.1:8002 --path /api/invoices/ --path /invoices/
+
+For every target and concurrency level the script keeps ``concurrency``
+connections busy for ``--duration`` seconds and reports throughput, p50/p99
+latency and the error rate. The "capacity" of a server is the highest
+concurrency level whose p99 stays under ``--slo-ms`` with under 1% errors.
+Only the standard library is used, so it runs wherever the project does.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+async def _fetch(host, port, path, timeout):
+    """Issue one ``GET`` on a fresh connection and return the status code."""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(
+            f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n"
+            f"Accept: application/json\r\n\r\n".encode()
+        )
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        await asyncio.wait_for(reader.read(), timeout)
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def _worker(base, path, deadline, timeout, latencies, errors):
+    parts = urlsplit(base)
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            status = await _fetch(parts.hostname, parts.port or 80, path, timeout)
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+            status = None
+        if status is None or status >= 500:
+            errors.append(status)
+        else:
+            latencies.append((time.perf_counter() - started) * 1000)
+
+
+async def run_level(base, path, concurrency, duration, timeout):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(
+        _worker(base, path, deadline, timeout, latencies, errors) for _ in range(concurrency)
+    ))
+    total = len(latencies) + len(errors)
+    ordered = sorted(latencies)
+    return {
+        'concurrency': concurrency,
+        'requests': total,
+        'throughput_rps': round(total / duration, 1),
+        'p50_ms': round(statistics.median(ordered), 2) if ordered else None,
+        'p99_ms': round(ordered[int(len(ordered) * 0.99) - 1], 2) if ordered else None,
+        'error_rate': round(len(errors) / total, 4) if total else 1.0,
+    }
+
+
+def capacity(levels, slo_ms):
+    """Highest concurrency that met the latency SLO with under 1% errors."""
+    passing = [
+        level['concurrency'] for level in levels
+        if level['p99_ms'] is not None and level['p99_ms'] <= slo_ms and level['error_rate'] < 0.01
+    ]
+    return max(passing, default=0)
+
+
+async def main(args):
+    report = {}
+    for label, base in (('wsgi', args.wsgi), ('asgi', args.asgi)):
+        if not base:
+            continue
+        for path in args.path:
+            levels = []
+            for concurrency in args.concurrency:
+                level = await run_level(base, path, concurrency, args.duration, args.timeout)
+                levels.append(level)
+                print(f"{label:4} {path:24} c={concurrency:<5} {level['throughput_rps']:>8} rps "
+                      f"p50={level['p50_ms']}ms p99={level['p99_ms']}ms errors={level['error_rate']:.2%}")
+            report[f"{label} {path}"] = {'levels': levels, 'capacity': capacity(levels, args.slo_ms)}
+
+    print()
+    for key, result in report.items():
+        print(f"capacity {key}: {result['capacity']} concurrent connections (p99 <= {args.slo_ms}ms)")
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--wsgi', help='Base URL of the WSGI server, e.g. http://127.0.0.1:8001')
+    parser.add_argument('--asgi', help='Base URL of the ASGI server, e.g. http://127.0.0.1:8002')
+    parser.add_argument('--path', action='append', default=None, help='URL path to load (repeatable)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 100, 250, 500])
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per concurrency level')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Per-request timeout in seconds')
+    parser.add_argument('--slo-ms', type=float, default=500.0, help='p99 latency budget used for capacity')
+    parser.add_argument('--output', help='Write the full report as JSON to this file')
+    args = parser.parse_args()
+    args.path = args.path or ['/api/invoices/']
+    asyncio.run(main(args))
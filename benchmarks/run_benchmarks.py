@@ -0,0 +1,384 @@
+"""Benchmark suite for model save paths and list/admin page rendering.
+
+Runs against a throwaway test database created from the configured Postgres
+server (``test_<NAME>``), so it never touches real data::
+
+    python benchmarks/run_benchmarks.py                       # full run
+    python benchmarks/run_benchmarks.py --quick               # small sizes
+    python benchmarks/run_benchmarks.py --save-baseline       # record baseline
+    python benchmarks/run_benchmarks.py --compare benchmarks/baseline.json
+
+Every run writes its timings as JSON (``--output``, default
+``benchmarks/results/<timestamp>.json``). With ``--compare`` each case's
+median is checked against the baseline and the script exits with status 1 if
+any case got slower than ``--threshold`` (default 20%). Baselines are machine
+specific, so record one on the machine that runs the comparison.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = BASE_DIR / 'benchmarks' / 'results'
+DEFAULT_BASELINE = BASE_DIR / 'benchmarks' / 'baseline.json'
+
+
+def setup_django():
+    import django
+
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'business_management_app.settings')
+    django.setup()
+    logging.disable(logging.CRITICAL)
+
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment(debug=False)
+
+
+def timed(func, repeat):
+    """Run ``func(iteration)`` ``repeat`` times and return wall times in ms."""
+    timings = []
+    for iteration in range(repeat):
+        started = time.perf_counter()
+        func(iteration)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def new_quotation(label):
+    from management.models import Quotation
+
+    quotation = Quotation(
+        client_name=f"Benchmark {label}",
+        client_email="bench@example.com",
+        client_address="1 Bench Street",
+        client_phone_number="0700000000",
+        tax_rate=Decimal('16.00'),
+    )
+    quotation.save()
+    return quotation
+
+
+def bench_quote_creation(item_count, repeat):
+    from management.models import QuotationItem
+
+    def run(iteration):
+        quotation = new_quotation(f"quote-{item_count}-{iteration}")
+        for n in range(item_count):
+            QuotationItem(quotation=quotation, description=f"Item {n}", quantity=2,
+                          unit_price=Decimal('125.50')).save()
+
+    return timed(run, repeat)
+
+
+def bench_quote_to_invoice(item_count, repeat):
+    from management.models import Invoice, QuotationItem
+
+    quotations = []
+    for iteration in range(repeat):
+        quotation = new_quotation(f"convert-{iteration}")
+        QuotationItem.objects.bulk_create([
+            QuotationItem(quotation=quotation, description=f"Item {n}", quantity=1, unit_price=Decimal('10.00'))
+            for n in range(item_count)
+        ])
+        quotation.save()
+        quotations.append(quotation)
+
+    return timed(lambda iteration: Invoice(quotation=quotations[iteration]).save(), repeat)
+
+
+def bench_receipt_posting(existing_receipts, repeat):
+    from management.models import Invoice, Receipt
+
+    invoice = Invoice(client_name="Benchmark receipts", client_email="bench@example.com",
+                      subtotal=Decimal('1000000.00'))
+    invoice.save()
+    Receipt.objects.bulk_create([
+        Receipt(invoice=invoice, receipt_number=f"BENCH-{n}", amount_paid=Decimal('1.00'))
+        for n in range(existing_receipts)
+    ])
+
+    return timed(lambda iteration: Receipt(invoice=invoice, amount_paid=Decimal('1.00')).save(), repeat)
+
+
+def seed_rows(rows):
+    """Bulk insert ``rows`` quotations and invoices (bypassing save())."""
+    from management.models import Invoice, Quotation
+
+    Invoice.objects.all().delete()
+    Quotation.objects.all().delete()
+    batch = 5000
+    for start in range(0, rows, batch):
+        count = min(batch, rows - start)
+        Quotation.objects.bulk_create([
+            Quotation(quote_number=f"QUOTE-BENCH-{start + n}", client_name=f"Client {start + n}",
+                      client_email="bench@example.com", client_address="1 Bench Street",
+                      client_phone_number="0700000000", subtotal=Decimal('100.00'),
+                      labour_cost=Decimal('30.00'), grand_total=Decimal('130.00'))
+            for n in range(count)
+        ])
+        Invoice.objects.bulk_create([
+            Invoice(invoice_number=f"INV-BENCH-{start + n}", client_name=f"Client {start + n}",
+                    client_email="bench@example.com", subtotal=Decimal('100.00'),
+                    grand_total=Decimal('100.00'), status='Unpaid')
+            for n in range(count)
+        ])
+
+
+def bench_pages(rows, repeat):
+    from django.contrib.auth import get_user_model
+    from django.test import Client
+    from django.urls import reverse
+
+    seed_rows(rows)
+    user, _ = get_user_model().objects.get_or_create(
+        username='benchmark', defaults={'is_staff': True, 'is_superuser': True})
+    client = Client()
+    client.force_login(user)
+
+    pages = {
+        'quotation_list': reverse('quotation_list'),
+        'invoice_list': reverse('invoice_list'),
+        'admin_quotation_changelist': reverse('admin:management_quotation_changelist'),
+        'admin_invoice_changelist': reverse('admin:management_invoice_changelist'),
+    }
+    results = {}
+    for name, url in pages.items():
+        def run(iteration):
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+        results[f"{name}_{rows}_rows"] = timed(run, repeat)
+    return results
+
+
+def bench_row_cache(rows, repeat):
+    """Render the list templates for ``rows`` documents with a cold and a warm row cache.
+
+    Only template rendering is timed (the rows are loaded once), so the
+    difference is what the per-row ``{% cache %}`` fragments save.
+    """
+    from django.core.cache import caches
+    from django.template.loader import render_to_string
+    from django.test import RequestFactory
+
+    from management.models import Invoice, Quotation
+
+    seed_rows(rows)
+    request = RequestFactory().get('/')
+    fragments = caches['template_fragments']
+    pages = {
+        'invoice_list': ('invoices/invoice_list.html', {'invoices': list(Invoice.objects.order_by('pk'))}),
+        'quotation_list': ('management/quotation_list.html', {'quotations': list(Quotation.objects.order_by('pk'))}),
+    }
+    results = {}
+    for name, (template, context) in pages.items():
+        def render(iteration, template=template, context=context):
+            render_to_string(template, context, request=request)
+
+        cold = []
+        for iteration in range(repeat):
+            fragments.clear()
+            cold += timed(render, 1)
+        render(0)  # Fill the cache
+        results[f"{name}_render_{rows}_rows_cold"] = cold
+        results[f"{name}_render_{rows}_rows_warm"] = timed(render, repeat)
+    return results
+
+
+def bench_catalog_autocomplete(entries, repeat):
+    """Autocomplete requests against a catalog of ``entries`` items (target: under 10 ms)."""
+    from django.test import Client
+    from django.urls import reverse
+
+    from management import catalog
+    from management.models import CatalogItem
+
+    words = ['cable', 'camera', 'solar', 'panel', 'inverter', 'service', 'repair', 'install', 'pump', 'door']
+    CatalogItem.objects.all().delete()
+    CatalogItem.objects.bulk_create([
+        CatalogItem(name=f"{words[n % 10].title()} {words[(n // 10) % 10]} {n}", unit_price=Decimal('100.00'))
+        for n in range(entries)
+    ])
+    catalog.invalidate_index(CatalogItem)
+    client, url = Client(), reverse('catalog_autocomplete')
+    client.get(url, {'q': 'ca'})  # Build the index once, as the first keystroke would
+
+    def run(iteration):
+        response = client.get(url, {'q': words[iteration % 10][:2 + iteration % 3]})
+        assert response.status_code == 200
+
+    return timed(run, max(repeat, 20))
+
+
+def bench_bulk_api(batch_size, repeat, items_per_document=5):
+    """Batch create, update and fetch of ``batch_size`` quotations through the JSON batch API."""
+    from django.contrib.auth import get_user_model
+    from django.test import Client
+    from django.urls import reverse
+
+    user, _ = get_user_model().objects.get_or_create(
+        username='benchmark', defaults={'is_staff': True, 'is_superuser': True})
+    client, url = Client(), reverse('api_quotation_batch')
+    client.force_login(user)
+    contact = {'client_email': 'bench@example.com', 'client_address': '1 Bench Street',
+               'client_phone_number': '0700000000', 'tax_rate': '16.00'}
+    items = [{'description': f"Item {n}", 'quantity': n + 1, 'unit_price': '12.50'} for n in range(items_per_document)]
+    created = []
+
+    def post(documents):
+        response = client.post(url, json.dumps({'documents': documents}), content_type='application/json')
+        assert response.status_code == 200, response.content[:500]
+        return response.json()['results']
+
+    def create(iteration):
+        created[:] = post([{'client_name': f"Batch {iteration} {n}", **contact, 'items': items}
+                           for n in range(batch_size)])
+
+    def update(iteration):
+        created[:] = post([{'id': doc['id'], 'version': doc['version'], 'client_name': f"Updated {iteration}",
+                            'items': [{**item, 'quantity': item['quantity'] + 1} for item in doc['items']]}
+                           for doc in created])
+
+    def fetch(iteration):
+        response = client.get(url, {'ids': ','.join(str(doc['id']) for doc in created)})
+        assert response.status_code == 200
+
+    return {
+        f"bulk_api_create_{batch_size}_docs": timed(create, repeat),
+        f"bulk_api_update_{batch_size}_docs": timed(update, repeat),
+        f"bulk_api_fetch_{batch_size}_docs": timed(fetch, repeat),
+    }
+
+
+def bench_recurring_invoices(contracts, repeat, items_per_contract=3):
+    """One scheduler run invoicing a period of ``contracts`` recurring invoices."""
+    from datetime import date
+
+    from management.models import Client, Invoice, RecurringInvoice, RecurringInvoiceItem
+    from management.services.recurring_service import generate_due_invoices
+
+    Invoice.objects.filter(recurring__isnull=False).delete()
+    RecurringInvoice.objects.all().delete()
+    clients = Client.objects.bulk_create(
+        Client(name=f"Contract {n}", email=f"contract{n}@example.com") for n in range(contracts))
+    schedule = RecurringInvoice.objects.bulk_create(
+        RecurringInvoice(client=client, start_date=date(2026, 1, 1), next_period=date(2026, 1, 1),
+                         tax_rate=Decimal('16.00')) for client in clients)
+    RecurringInvoiceItem.objects.bulk_create(
+        RecurringInvoiceItem(recurring=contract, description=f"Service {n}", quantity=1, unit_price=Decimal('250.00'))
+        for contract in schedule for n in range(items_per_contract))
+
+    def run(iteration):
+        # Each iteration invoices the next month
+        result = generate_due_invoices(date(2026, iteration + 1, 1))
+        assert result.invoices == contracts, result
+
+    return timed(run, min(repeat, 12))
+
+
+def run_suite(args):
+    cases, documents = {}, {}
+    for item_count in args.items:
+        cases[f"quote_create_{item_count}_items"] = bench_quote_creation(item_count, args.repeat)
+    cases['quote_to_invoice_100_items'] = bench_quote_to_invoice(100, args.repeat)
+    cases[f"receipt_posting_{args.receipts}_receipts"] = bench_receipt_posting(args.receipts, args.repeat)
+    cases['catalog_autocomplete_500_entries'] = bench_catalog_autocomplete(500, args.repeat)
+    cases.update(bench_row_cache(500, args.repeat))
+    cases[f"recurring_invoices_{args.contracts}_contracts"] = bench_recurring_invoices(args.contracts, args.repeat)
+    documents[f"recurring_invoices_{args.contracts}_contracts"] = args.contracts
+    for batch_size in args.batch_sizes:
+        batch = bench_bulk_api(batch_size, args.repeat)
+        cases.update(batch)
+        documents.update(dict.fromkeys(batch, batch_size))
+    for rows in args.rows:
+        cases.update(bench_pages(rows, args.repeat))
+
+    results = {
+        name: {
+            'median_ms': round(statistics.median(timings), 3),
+            'min_ms': round(min(timings), 3),
+            'runs_ms': [round(t, 3) for t in timings],
+        }
+        for name, timings in cases.items()
+    }
+    for name, count in documents.items():  # Throughput of the batch cases, in documents per second
+        results[name]['docs_per_s'] = round(count * 1000 / results[name]['median_ms'], 1)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return the names of cases that regressed by more than ``threshold``."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['median_ms'], result['median_ms']
+        change = (after - before) / before if before else 0.0
+        flag = 'REGRESSION' if change > threshold else 'ok'
+        print(f"{name:45} {before:>10.2f}ms -> {after:>10.2f}ms {change:+7.1%} {flag}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--receipts', type=int, default=1000, help='Existing receipts on the invoice')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[10, 100, 500],
+                        help='Documents per batch API request')
+    parser.add_argument('--contracts', type=int, default=5000, help='Recurring invoices per scheduler run')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--quick', action='store_true', help='Small sizes for a fast smoke run')
+    parser.add_argument('--output', help='Where to write the results JSON')
+    parser.add_argument('--compare', help='Baseline JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.20, help='Allowed slowdown, e.g. 0.2 = 20%%')
+    parser.add_argument('--save-baseline', action='store_true', help=f'Also write results to {DEFAULT_BASELINE}')
+    args = parser.parse_args()
+    if args.quick:
+        args.items, args.rows, args.receipts, args.batch_sizes, args.contracts = [10, 100], [1000], 100, [10, 100], 500
+
+    setup_django()
+    from django.db import connection
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        results = run_suite(args)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'args': {k: v for k, v in vars(args).items() if k in ('items', 'rows', 'receipts', 'batch_sizes', 'contracts', 'repeat')},
+        'results': results,
+    }
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.write_text(json.dumps(report, indent=2))
+    for name, result in results.items():
+        throughput = f" {result['docs_per_s']:>8.1f} docs/s" if 'docs_per_s' in result else ''
+        print(f"{name:45} median={result['median_ms']:>10.2f}ms min={result['min_ms']:>10.2f}ms{throughput}")
+    print(f"Results written to {output}")
+    if args.save_baseline:
+        DEFAULT_BASELINE.write_text(json.dumps(report, indent=2))
+        print(f"Baseline written to {DEFAULT_BASELINE}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} case(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
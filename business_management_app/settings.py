@@ -45,10 +45,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'management.middleware.QueryBudgetMiddleware',
+    'management.db_router.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'management.middleware.ProfilingMiddleware',
+    'management.middleware.ConcurrentUpdateMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -73,6 +77,15 @@ TEMPLATES = [
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
+# Views without their own @query_budget are flagged above this many queries.
+QUERY_BUDGET_DEFAULT = 50
+
+# Request profiling: staff can add ?profile=1 (cProfile) or ?profile=sampling to
+# any URL; additionally a random PROFILE_SAMPLE_RATE fraction of requests is
+# profiled. Profiles are written to PROFILE_DIR.
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+
 
 WSGI_APPLICATION = 'business_management_app.wsgi.application'
 
@@ -91,6 +104,44 @@ DATABASES = {
     }
 }
 
+# Database connection handling, selected with the DB_CONNECTION_MODE env var:
+#   'none'       - open a new connection for every request (Django default)
+#   'persistent' - keep one connection per worker thread for DB_CONN_MAX_AGE
+#                  seconds, checking it is still alive before reuse
+#   'pool'       - share a psycopg_pool connection pool between the worker's
+#                  threads (needs psycopg[pool])
+DB_CONNECTION_MODE = os.environ.get('DB_CONNECTION_MODE', 'none')
+
+if DB_CONNECTION_MODE == 'persistent':
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', '600'))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+elif DB_CONNECTION_MODE == 'pool':
+    # Health checks make the pool validate a connection before lending it out.
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '10')),
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', '10')),
+        },
+    }
+
+# Read replica for list pages, reports and the read API (see management/db_router.py).
+# DB_REPLICA_HOST points the 'replica' alias at a streaming replica and turns routing
+# on. Without it the alias is a second connection to the primary; tests use it as a
+# stand-in replica of the test database (TEST MIRROR) and enable REPLICA_READS themselves.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'HOST': os.environ.get('DB_REPLICA_HOST', DATABASES['default']['HOST']),
+    'PORT': os.environ.get('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+    'TEST': {'MIRROR': 'default'},
+}
+DATABASE_ROUTERS = ['management.db_router.ReplicaRouter']
+REPLICA_DATABASE = 'replica'
+REPLICA_READS = bool(os.environ.get('DB_REPLICA_HOST'))
+# How long a user's reads stay on the primary after they write (above the replica's lag)
+REPLICA_STICKY_SECONDS = int(os.environ.get('DB_REPLICA_STICKY_SECONDS', '15'))
+
 
 
 # Password validation
@@ -133,6 +184,48 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Media is served by management.media.serve_media after a permission check.
+# Set to 'nginx' (X-Accel-Redirect to MEDIA_ACCEL_PREFIX, an internal location
+# aliased to MEDIA_ROOT) or 'apache' (X-Sendfile) to let the front server send
+# the bytes; leave empty to stream them from Django.
+MEDIA_ACCEL = os.environ.get('MEDIA_ACCEL', '')
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
+# Read-only segment files written by the archive_closed_years command.
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive'))
+
+# Uploads above this size are spooled to a temporary file instead of memory;
+# the scan store (management/storage.py) then hashes and moves them in chunks.
+FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024
+
+# Thumbnails and previews of scans are rendered in a pool of this many
+# processes (management/derivatives.py); set DERIVATIVES_ASYNC=0 to render
+# inline instead.
+DERIVATIVE_WORKERS = int(os.environ.get('DERIVATIVE_WORKERS', 2))
+DERIVATIVES_ASYNC = os.environ.get('DERIVATIVES_ASYNC', '1') != '0'
+
+# 'default' holds the catalog index version (management/catalog.py) and the
+# clients' cached statement months with their generation tokens
+# (management/services/statement_service.py); 'template_fragments' holds list
+# rows rendered by {% cache %}, keyed by id and version. Both are per-process memory unless CACHE_BACKEND/CACHE_LOCATION
+# name a shared backend (e.g. django.core.cache.backends.redis.RedisCache and
+# redis://localhost:6379), which every worker should use in production.
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'default'),
+    },
+    'template_fragments': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'template-fragments'),
+        'KEY_PREFIX': 'fragments',
+    },
+}
+if CACHE_BACKEND.endswith('LocMemCache'):
+    # Room for a few full list pages; the memory backend culls beyond this.
+    CACHES['template_fragments']['OPTIONS'] = {'MAX_ENTRIES': 50000}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -150,6 +243,10 @@ LOGGING = {
             'level': 'DEBUG',
             'handlers': ['console'],
         },
+        'management': {
+            'level': 'INFO',
+            'handlers': ['console'],
+        },
     },
 }
 
@@ -1,22 +1,107 @@
 from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import get_object_or_404, redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.html import format_html
+from .forms import PaymentAllocationForm, VersionedModelForm
 from .models import (Quotation, QuotationItem, Invoice, 
                      InvoiceItem, ScannedInvoice, Footnote,
-                     Receipt)
+                     Receipt, Client, CatalogItem, RecurringInvoice, RecurringInvoiceItem)
+from .services.payment_service import allocate_payment
+from .services.report_service import client_balance
+from .services.statement_service import client_statement
+from .services.revision_service import compare_revisions, record_revision
 
 class QuotationItemInline(admin.TabularInline):
     model = QuotationItem
     extra = 1  # Display one empty form for adding items
-    fields = ('description', 'quantity', 'unit_price', 'line_total')
+    fields = ('catalog_item', 'description', 'quantity', 'unit_price', 'line_total')
     readonly_fields = ('line_total',)
+    autocomplete_fields = ('catalog_item',)
     can_delete = True
 
-    # Optional: display the line total as a calculated field
-    def line_total(self, obj):
-        return obj.total_price()
-    line_total.short_description = 'Line Total'  # Custom header for readability
+@admin.register(CatalogItem)
+class CatalogItemAdmin(admin.ModelAdmin):
+    list_display = ('name', 'unit_price', 'is_active', 'date_updated')
+    list_editable = ('unit_price', 'is_active')
+    list_filter = ('is_active',)
+    search_fields = ('name',)
+
+
+@admin.register(Client)
+class ClientAdmin(admin.ModelAdmin):
+    list_display = ('name', 'email', 'phone_number', 'date_created')
+    search_fields = ('name', 'email', 'phone_number')
+    ordering = ('name',)
+    readonly_fields = ('balance',)
+
+    @admin.display(description='Balance')
+    def balance(self, obj):
+        if not obj.pk:
+            return '-'
+        totals = client_balance(obj.pk)
+        url = reverse('admin:management_client_statement', args=[obj.pk])
+        payment_url = reverse('admin:management_client_payment', args=[obj.pk])
+        return format_html('Invoiced {}, paid {}, outstanding {} - <a href="{}">statement</a>'
+                           ' | <a href="{}">record a payment</a>',
+                           totals['invoiced'], totals['paid'], totals['outstanding'], url, payment_url)
+
+    def get_urls(self):
+        return [
+            path('<int:object_id>/statement/', self.admin_site.admin_view(self.statement_view),
+                 name='management_client_statement'),
+            path('<int:object_id>/payment/', self.admin_site.admin_view(self.payment_view),
+                 name='management_client_payment'),
+        ] + super().get_urls()
+
+    def statement_view(self, request, object_id):
+        """The client's statement of account: invoices, receipts and the running balance."""
+        client = get_object_or_404(Client, pk=object_id)
+        if not self.has_view_or_change_permission(request, client):
+            raise PermissionDenied
+        return TemplateResponse(request, 'admin/management/client/statement.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': f'Statement of account for {client.name}',
+            'client': client,
+            'statement': client_statement(client.pk),
+        })
+
+    def payment_view(self, request, object_id):
+        """Record one payment covering several of the client's invoices."""
+        client = get_object_or_404(Client, pk=object_id)
+        if not request.user.has_perm('management.add_receipt'):
+            raise PermissionDenied
+        form = PaymentAllocationForm(request.POST or None, client_id=client.pk)
+        if form.is_valid():
+            chosen = form.cleaned_data['invoices']
+            try:
+                receipts = allocate_payment(
+                    client.pk, form.cleaned_data['amount'],
+                    invoice_ids=[invoice.pk for invoice in chosen] if chosen else None,
+                    payment_date=form.cleaned_data['payment_date'],
+                    payment_method=form.cleaned_data['payment_method'] or None,
+                    notes=form.cleaned_data['notes'] or None,
+                )
+            except ValueError as error:
+                form.add_error(None, str(error))
+            else:
+                self.message_user(request, f"Recorded {len(receipts)} receipt{'' if len(receipts) == 1 else 's'}: "
+                                           f"{', '.join(receipt.receipt_number for receipt in receipts)}.")
+                return redirect('admin:management_client_statement', client.pk)
+        return TemplateResponse(request, 'admin/management/client/payment.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': f'Record a payment from {client.name}',
+            'client': client,
+            'form': form,
+        })
+
 
 @admin.register(Quotation)
 class QuotationAdmin(admin.ModelAdmin):
+    form = VersionedModelForm
     list_display = (
         'quote_number',
         'client_name',
@@ -31,13 +116,61 @@ class QuotationAdmin(admin.ModelAdmin):
         'date_created'
     )
     search_fields = ('client_name', 'client_email', 'quote_number')
+    autocomplete_fields = ('client',)
     list_filter = ('status',)
     ordering = ('-date_created',)
-    readonly_fields = ('quote_number', 'subtotal', 'total_tax', 'labour_cost', 'grand_total')
+    readonly_fields = ('quote_number', 'subtotal', 'total_tax', 'labour_cost', 'grand_total', 'revision_history')
 
     # Integrate QuotationItemInline to allow editing items on the same page
     inlines = [QuotationItemInline]
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        record_revision(form.instance, request.user)
+
+    @admin.display(description='Revisions')
+    def revision_history(self, obj):
+        if not obj.pk:
+            return '-'
+        count = obj.revisions.count()
+        if not count:
+            return 'No revisions recorded'
+        url = reverse('admin:management_quotation_revisions', args=[obj.pk])
+        return format_html('<a href="{}">{} revision{} - compare</a>', url, count, '' if count == 1 else 's')
+
+    def get_urls(self):
+        return [
+            path('<int:object_id>/revisions/', self.admin_site.admin_view(self.revisions_view),
+                 name='management_quotation_revisions'),
+        ] + super().get_urls()
+
+    def revisions_view(self, request, object_id):
+        """List a quotation's revisions and compare any two of them."""
+        quotation = get_object_or_404(Quotation, pk=object_id)
+        if not self.has_view_or_change_permission(request, quotation):
+            raise PermissionDenied
+        revisions = list(quotation.revisions.select_related('created_by').defer('data'))
+        numbers = [revision.number for revision in revisions]
+        comparison = first = second = None
+        if len(numbers) > 1:
+            try:
+                first = int(request.GET.get('a', numbers[-2]))
+                second = int(request.GET.get('b', numbers[-1]))
+            except ValueError:
+                first, second = numbers[-2], numbers[-1]
+            if first in numbers and second in numbers:
+                comparison = compare_revisions(quotation.pk, first, second)
+        return TemplateResponse(request, 'admin/management/quotation/revisions.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': f'Revisions of {quotation.quote_number}',
+            'quotation': quotation,
+            'revisions': revisions,
+            'first': first,
+            'second': second,
+            'comparison': comparison,
+        })
+
 
 class InvoiceItemInline(admin.TabularInline):
     model = InvoiceItem
@@ -53,6 +186,7 @@ class ReceiptInline(admin.TabularInline):
     readonly_fields = ('receipt_number',)
 @admin.register(Invoice)
 class InvoiceAdmin(admin.ModelAdmin):
+    form = VersionedModelForm
     list_display = (
         'invoice_number',
         'client_name', 
@@ -67,14 +201,24 @@ class InvoiceAdmin(admin.ModelAdmin):
         'get_balance',
     )
     search_fields = ('invoice_number', 'client_name')
+    autocomplete_fields = ('client',)
     list_filter = ('status',)
     ordering = ('-date_created',)
-    readonly_fields = ('invoice_number', 'total_tax', 'grand_total', 'labour_cost', 'get_balance')  # Display tax and grand total
+    readonly_fields = ('invoice_number', 'total_tax', 'grand_total', 'labour_cost', 'get_balance', 'stamped_preview')  # Display tax and grand total
     inlines = [InvoiceItemInline, ReceiptInline]
 
+    def get_queryset(self, request):
+        # get_balance sums receipts per row; prefetch them in one query.
+        return super().get_queryset(request).prefetch_related('receipts')
+
+    @admin.display(description='Stamped invoice preview')
+    def stamped_preview(self, obj):
+        return preview_image(obj.stamped_preview_url, obj.stamped_invoice)
+
     def save_model(self, request, obj, form, change):
         # Automatically pull billing details from the quotation if linked
         if obj.quotation:
+            obj.client = obj.quotation.client
             obj.client_name = obj.quotation.client_name
             obj.client_email = obj.quotation.client_email
             obj.client_address = obj.quotation.client_address
@@ -114,10 +258,53 @@ class ReceiptAdmin(admin.ModelAdmin):
     list_filter = ('payment_method', 'payment_date')
     readonly_fields = ('receipt_number',)
     ordering = ('-payment_date',)
+    list_select_related = ('invoice',)
+def thumbnail_link(thumbnail_url, preview_url, file):
+    """Thumbnail linking to the preview, or a plain file link while they are being made."""
+    if thumbnail_url:
+        return format_html('<a href="{}"><img src="{}" alt="" loading="lazy"></a>',
+                           preview_url or file.url, thumbnail_url)
+    if file:
+        return format_html('<a href="{}">{}</a>', file.url, file.name.rsplit('/', 1)[-1])
+    return '-'
+
+
+def preview_image(preview_url, file):
+    if preview_url:
+        return format_html('<a href="{}"><img src="{}" alt="" style="max-width: 100%"></a>', file.url, preview_url)
+    return thumbnail_link(None, None, file)
+
+
 class ScannedInvoiceAdmin(admin.ModelAdmin):
-    list_display = ['invoice', 'scanned_file', 'date_uploaded']
+    list_display = ['invoice', 'thumbnail', 'date_uploaded']
     search_fields = ['invoice__invoice_number']  # Optional: Allows searching by invoice number
+    list_select_related = ['invoice']
+    readonly_fields = ['preview']
+
+    @admin.display(description='Scan')
+    def thumbnail(self, obj):
+        return thumbnail_link(obj.thumbnail_url, obj.preview_url, obj.scanned_file)
+
+    @admin.display(description='Preview')
+    def preview(self, obj):
+        return preview_image(obj.preview_url, obj.scanned_file)
 
 admin.site.register(ScannedInvoice, ScannedInvoiceAdmin)
 
-admin.site.register(Footnote)
\ No newline at end of file
+admin.site.register(Footnote)
+
+
+class RecurringInvoiceItemInline(admin.TabularInline):
+    model = RecurringInvoiceItem
+    extra = 1
+    fields = ('catalog_item', 'description', 'quantity', 'unit_price')
+    autocomplete_fields = ('catalog_item',)
+
+
+@admin.register(RecurringInvoice)
+class RecurringInvoiceAdmin(admin.ModelAdmin):
+    list_display = ('client', 'description', 'interval_months', 'next_period', 'end_date', 'is_active')
+    list_filter = ('is_active', 'interval_months')
+    search_fields = ('client__name', 'description')
+    autocomplete_fields = ('client',)
+    inlines = [RecurringInvoiceItemInline]
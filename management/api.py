@@ -0,0 +1,136 @@
+"""Async JSON read API for invoices, quotations and receipts.
+
+These views are ``async def`` so that, when the project is served through
+``business_management_app.asgi``, a slow client only holds an event-loop task
+instead of a whole worker thread. All database access goes through Django's
+async ORM (``aget``, ``aiterator``) and list endpoints use keyset pagination
+(``?after=<id>&limit=<n>``) so deep pages stay as cheap as the first one.
+They are marked ``replica_reads`` and so read from the replica when one is
+configured (see ``management.db_router``).
+"""
+from django.http import Http404, JsonResponse
+from django.views.decorators.http import require_GET
+
+from .db_router import replica_reads
+from .models import Invoice, InvoiceItem, Quotation, QuotationItem, Receipt
+from .query_budget import query_budget
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+QUOTATION_FIELDS = (
+    'id', 'quote_number', 'original_quote_number', 'client_id', 'client_name', 'client_email',
+    'client_address', 'client_phone_number', 'date_created', 'status', 'valid_until',
+    'subtotal', 'labour_cost', 'tax_rate', 'total_tax', 'grand_total', 'version',
+)
+QUOTATION_ITEM_FIELDS = ('id', 'description', 'quantity', 'unit_price')
+INVOICE_FIELDS = (
+    'id', 'invoice_number', 'quotation_id', 'client_id', 'date_created', 'due_date', 'client_name',
+    'client_email', 'client_address', 'client_phone_number', 'subtotal', 'labour_cost',
+    'total_tax', 'grand_total', 'tax_rate', 'status', 'version',
+)
+INVOICE_ITEM_FIELDS = ('id', 'description', 'quantity', 'unit_price', 'total_price')
+RECEIPT_FIELDS = (
+    'id', 'receipt_number', 'invoice_id', 'payment_date', 'amount_paid',
+    'payment_method', 'notes',
+)
+
+
+def _page_params(request):
+    """Return ``(after, limit)`` from the query string, clamped to sane bounds."""
+    try:
+        after = int(request.GET.get('after', 0))
+        limit = int(request.GET.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return None, None
+    return max(after, 0), min(max(limit, 1), MAX_PAGE_SIZE)
+
+
+async def _paginated(request, queryset, fields):
+    after, limit = _page_params(request)
+    if limit is None:
+        return JsonResponse({'error': "'after' and 'limit' must be integers."}, status=400)
+
+    queryset = queryset.filter(pk__gt=after).order_by('pk').values(*fields)[:limit]
+    results = [row async for row in queryset.aiterator(chunk_size=limit)]
+    next_after = results[-1]['id'] if len(results) == limit else None
+    return JsonResponse({'results': results, 'next_after': next_after})
+
+
+async def _get_values(queryset, pk, fields):
+    try:
+        return await queryset.values(*fields).aget(pk=pk)
+    except queryset.model.DoesNotExist:
+        raise Http404(f"No {queryset.model._meta.verbose_name} matches the given query.")
+
+
+@replica_reads
+@query_budget(1)
+@require_GET
+async def quotation_list_api(request):
+    queryset = Quotation.objects.all()
+    if status := request.GET.get('status'):
+        queryset = queryset.filter(status=status)
+    if client_id := request.GET.get('client'):
+        if not client_id.isdigit():
+            return JsonResponse({'error': "'client' must be an integer."}, status=400)
+        queryset = queryset.filter(client_id=client_id)
+    return await _paginated(request, queryset, QUOTATION_FIELDS)
+
+
+@replica_reads
+@query_budget(2)
+@require_GET
+async def quotation_detail_api(request, pk):
+    quotation = await _get_values(Quotation.objects.all(), pk, QUOTATION_FIELDS)
+    items = QuotationItem.objects.filter(quotation_id=pk).order_by('pk').values(*QUOTATION_ITEM_FIELDS)
+    quotation['items'] = [item async for item in items.aiterator()]
+    return JsonResponse(quotation)
+
+
+@replica_reads
+@query_budget(1)
+@require_GET
+async def invoice_list_api(request):
+    queryset = Invoice.objects.all()
+    if status := request.GET.get('status'):
+        queryset = queryset.filter(status=status)
+    if client_id := request.GET.get('client'):
+        if not client_id.isdigit():
+            return JsonResponse({'error': "'client' must be an integer."}, status=400)
+        queryset = queryset.filter(client_id=client_id)
+    if client_name := request.GET.get('client_name'):
+        queryset = queryset.filter(client_name__icontains=client_name)
+    return await _paginated(request, queryset, INVOICE_FIELDS)
+
+
+@replica_reads
+@query_budget(3)
+@require_GET
+async def invoice_detail_api(request, pk):
+    invoice = await _get_values(Invoice.objects.all(), pk, INVOICE_FIELDS)
+    items = InvoiceItem.objects.filter(invoice_id=pk).order_by('pk').values(*INVOICE_ITEM_FIELDS)
+    receipts = Receipt.objects.filter(invoice_id=pk).order_by('payment_date', 'pk').values(*RECEIPT_FIELDS)
+    invoice['items'] = [item async for item in items.aiterator()]
+    invoice['receipts'] = [receipt async for receipt in receipts.aiterator()]
+    return JsonResponse(invoice)
+
+
+@replica_reads
+@query_budget(1)
+@require_GET
+async def receipt_list_api(request):
+    queryset = Receipt.objects.all()
+    if invoice_id := request.GET.get('invoice'):
+        if not invoice_id.isdigit():
+            return JsonResponse({'error': "'invoice' must be an integer."}, status=400)
+        queryset = queryset.filter(invoice_id=invoice_id)
+    return await _paginated(request, queryset, RECEIPT_FIELDS)
+
+
+@replica_reads
+@query_budget(1)
+@require_GET
+async def receipt_detail_api(request, pk):
+    receipt = await _get_values(Receipt.objects.all(), pk, RECEIPT_FIELDS)
+    return JsonResponse(receipt)
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ManagementConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'management'
+
+    def ready(self):
+        from . import db_metrics  # noqa: F401  (registers the connection_created receiver)
+        from . import catalog  # noqa: F401  (registers the index invalidation receivers)
+        from . import outbox  # noqa: F401  (registers the change event receivers)
+        from .services import statement_service  # noqa: F401  (registers the statement cache receivers)
@@ -0,0 +1,104 @@
+"""Cold archive of fully paid invoices from closed years.
+
+``archive_closed_years`` moves paid invoices, with their items and receipts,
+out of the live tables into read-only segment files under
+``settings.ARCHIVE_DIR``::
+
+    <ARCHIVE_DIR>/<year>/invoices-<first id>-<last id>.json.gz
+
+A segment is gzip-compressed JSON laid out by column - for each table a
+mapping of column name to the list of that column's values - which compresses
+far better than row-wise JSON because each column's values are similar. One
+``ArchivedInvoice`` row per document stays in the database so archived
+invoices can still be found by number, client or original id; ``load`` then
+reads the single segment that holds it.
+"""
+import gzip
+import json
+import os
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import ArchivedInvoice
+
+# Format 2 added client_id, version and catalog_item_id; format 1 segments simply lack them.
+INVOICE_COLUMNS = (
+    'id', 'invoice_number', 'quotation_id', 'client_id', 'date_created', 'due_date', 'client_name',
+    'client_email', 'client_address', 'client_phone_number', 'subtotal', 'labour_cost',
+    'total_tax', 'grand_total', 'tax_rate', 'status', 'version',
+)
+ITEM_COLUMNS = ('id', 'invoice_id', 'catalog_item_id', 'description', 'quantity', 'unit_price', 'total_price')
+RECEIPT_COLUMNS = ('id', 'invoice_id', 'receipt_number', 'payment_date', 'amount_paid', 'payment_method', 'notes')
+
+
+@dataclass
+class ArchivedDocument:
+    """An invoice read back from the archive; values are as stored (strings for money and dates)."""
+    invoice: dict
+    items: list = field(default_factory=list)
+    receipts: list = field(default_factory=list)
+    entry: ArchivedInvoice = None
+
+
+def archive_root():
+    return Path(settings.ARCHIVE_DIR)
+
+
+def to_columns(rows, columns):
+    return {column: [row[column] for row in rows] for column in columns}
+
+
+def from_columns(table):
+    columns = list(table)
+    return [dict(zip(columns, values)) for values in zip(*table.values())] if columns else []
+
+
+def write_segment(year, invoices, items, receipts):
+    """Write one read-only segment and return its path relative to ARCHIVE_DIR."""
+    relative = f"{year}/invoices-{invoices[0]['id']}-{invoices[-1]['id']}.json.gz"
+    path = archive_root() / relative
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + '.part')
+    payload = {
+        'format': 2,
+        'year': year,
+        'invoices': to_columns(invoices, INVOICE_COLUMNS),
+        'items': to_columns(items, ITEM_COLUMNS),
+        'receipts': to_columns(receipts, RECEIPT_COLUMNS),
+    }
+    with gzip.open(partial, 'wt', encoding='utf-8', compresslevel=9) as out:
+        json.dump(payload, out, cls=DjangoJSONEncoder, separators=(',', ':'))
+        out.flush()
+        os.fsync(out.fileno())
+    os.chmod(partial, 0o444)
+    os.replace(partial, path)
+    return relative
+
+
+@lru_cache(maxsize=16)
+def read_segment(relative):
+    # Segments never change once written, so caching them by name is safe.
+    with gzip.open(archive_root() / relative, 'rt', encoding='utf-8') as source:
+        return json.load(source)
+
+
+def load(entry):
+    """Read the archived document behind an ``ArchivedInvoice`` entry."""
+    segment = read_segment(entry.segment)
+    invoices = segment['invoices']
+    position = invoices['id'].index(entry.invoice_id)
+    invoice = {column: values[position] for column, values in invoices.items()}
+    items = [row for row in from_columns(segment['items']) if row['invoice_id'] == entry.invoice_id]
+    receipts = [row for row in from_columns(segment['receipts']) if row['invoice_id'] == entry.invoice_id]
+    return ArchivedDocument(invoice=invoice, items=items, receipts=receipts, entry=entry)
+
+
+def find(invoice_id=None, invoice_number=None):
+    """The archived document with this original id or number, or None."""
+    lookup = {'invoice_id': invoice_id} if invoice_id is not None else {'invoice_number': invoice_number}
+    entry = ArchivedInvoice.objects.filter(**lookup).first()
+    return load(entry) if entry is not None else None
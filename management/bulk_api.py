@@ -0,0 +1,323 @@
+"""Batch JSON API for quotations and invoices (sales tablet, accounting integration).
+
+``GET api/<kind>/batch/?ids=1,2,3&fields=id,client_name,items&item_fields=description,quantity``
+    returns up to ``MAX_BATCH`` documents with their items in two queries.
+    ``fields`` and ``item_fields`` are optional sparse fieldsets (``id`` is
+    always included); items are only sent when ``fields`` is omitted or
+    names ``items``.
+
+``POST api/<kind>/batch/`` with ``{"documents": [...]}`` creates and updates
+    many documents with nested items. A document without ``id`` is created;
+    one with an ``id`` is updated and must carry the ``version`` it was read
+    at. Fields left out keep their current values. When ``items`` is given
+    it is the complete list: items with an ``id`` are updated, the others
+    created, and the document's items not listed are deleted. Items are
+    written with bulk queries and totals recomputed once for the whole batch
+    by the set-based services. The response holds every document as ``GET``
+    returns it, in request order.
+
+A batch is one transaction. Validation errors give 400 with the index of
+each failing document; a document someone else saved since it was read
+gives 409 with its index, and nothing is written. Bodies are encoded and
+parsed with orjson when it is installed (Decimals as strings, like the read
+API), otherwise with the standard library.
+"""
+import json
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable
+from decimal import Decimal
+
+from django.core.exceptions import NON_FIELD_ERRORS
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.forms.models import model_to_dict, modelform_factory
+from django.http import HttpResponse
+from django.views.decorators.http import require_http_methods
+
+from . import outbox
+from .api import INVOICE_FIELDS, INVOICE_ITEM_FIELDS, QUOTATION_FIELDS, QUOTATION_ITEM_FIELDS
+from .db_router import replica_reads
+from .forms import CONFLICT_MESSAGE, InvoiceItemForm, QuotationItemForm, VersionedModelForm
+from .models import ConcurrentUpdateError, Invoice, InvoiceItem, Quotation, QuotationItem
+from .query_budget import query_budget, set_request_budget
+from .services.invoice_service import recalculate_invoice_totals
+from .services.payment_service import refresh_payment_status
+from .services.quotation_service import recalculate_quotation_totals
+
+try:
+    import orjson
+except ImportError:  # Optional: the standard library encoder is slower but equivalent
+    orjson = None
+
+MAX_BATCH = 500
+# Queries per document saved (header save, client lookup, numbering, change events)
+QUERIES_PER_DOCUMENT = 12
+
+
+def _recalculate_quotations(ids):
+    recalculate_quotation_totals(Quotation.objects.filter(pk__in=ids))
+
+
+def _recalculate_invoices(ids):
+    invoices = Invoice.objects.filter(pk__in=ids)
+    recalculate_invoice_totals(invoices)
+    refresh_payment_status(invoices)
+
+
+@dataclass(frozen=True)
+class Kind:
+    model: type
+    item_model: type
+    parent: str  # Item foreign key to the document
+    form: type
+    item_form: type
+    fields: tuple
+    item_fields: tuple
+    recalculate: Callable
+
+
+KINDS = {
+    'quotations': Kind(
+        Quotation, QuotationItem, 'quotation',
+        modelform_factory(Quotation, form=VersionedModelForm, fields=[
+            'client_name', 'client_email', 'client_address', 'client_phone_number',
+            'tax_rate', 'status', 'valid_until', 'version',
+        ]),
+        QuotationItemForm, QUOTATION_FIELDS, QUOTATION_ITEM_FIELDS, _recalculate_quotations,
+    ),
+    'invoices': Kind(
+        Invoice, InvoiceItem, 'invoice',
+        modelform_factory(Invoice, form=VersionedModelForm, fields=[
+            'quotation', 'client_name', 'client_email', 'client_address', 'client_phone_number',
+            'status', 'due_date', 'tax_rate', 'labour_cost', 'version',
+        ]),
+        InvoiceItemForm, INVOICE_FIELDS, INVOICE_ITEM_FIELDS, _recalculate_invoices,
+    ),
+}
+
+
+class BatchError(Exception):
+    def __init__(self, status, payload):
+        super().__init__(payload)
+        self.status = status
+        self.payload = payload
+
+
+def _encode(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serialisable")
+
+
+def json_response(data, status=200):
+    if orjson is not None:
+        body = orjson.dumps(data, default=_encode)
+    else:
+        body = json.dumps(data, cls=DjangoJSONEncoder).encode()
+    return HttpResponse(body, status=status, content_type='application/json')
+
+
+def parse_body(request):
+    try:
+        return orjson.loads(request.body) if orjson is not None else json.loads(request.body)
+    except ValueError:
+        raise BatchError(400, {'error': "The body must be JSON."})
+
+
+def _id_list(raw):
+    try:
+        ids = list(dict.fromkeys(int(value) for value in raw.split(',') if value.strip()))
+    except ValueError:
+        raise BatchError(400, {'error': "'ids' must be a comma-separated list of integers."})
+    if not ids or len(ids) > MAX_BATCH:
+        raise BatchError(400, {'error': f"Send between 1 and {MAX_BATCH} ids."})
+    return ids
+
+
+def _fieldset(raw, allowed):
+    """The requested field names, limited to what the read API sends."""
+    if raw is None:
+        return None
+    fields = tuple(dict.fromkeys(['id', *(name.strip() for name in raw.split(',') if name.strip())]))
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise BatchError(400, {'error': f"Unknown fields: {', '.join(unknown)}."})
+    return fields
+
+
+def _as_id(value):
+    """A JSON id as an int, or ``None`` when it is not one."""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
+
+
+def fetch(kind, ids, fields=None, item_fields=None, include_items=True):
+    """Documents with these ids as dicts, in the order asked for; missing ids are left out."""
+    fields, item_fields = fields or kind.fields, item_fields or kind.item_fields
+    documents = {row['id']: row for row in kind.model.objects.filter(pk__in=ids).values(*fields)}
+    if include_items:
+        parent = f'{kind.parent}_id'
+        for document in documents.values():
+            document['items'] = []
+        items = kind.item_model.objects.filter(**{f'{parent}__in': ids}).order_by('pk')
+        for item in items.values(parent, *item_fields):
+            documents[item.pop(parent)]['items'].append(item)
+    return [documents[pk] for pk in ids if pk in documents]
+
+
+def _errors(form):
+    return {field: list(messages) for field, messages in form.errors.items()}
+
+
+def _form_data(instance, form_class, payload):
+    fields = form_class._meta.fields
+    data = {name: value for name, value in model_to_dict(instance, fields).items() if value is not None}
+    data.update((name, value) for name, value in payload.items() if name in fields)
+    return data
+
+
+def prepare(kind, documents):
+    """Validate every document; returns ``[(form, item_forms, removed_item_ids)]`` or raises a 400."""
+    if not isinstance(documents, list) or not 0 < len(documents) <= MAX_BATCH:
+        raise BatchError(400, {'error': f"'documents' must be a list of 1 to {MAX_BATCH} documents."})
+    ids = [_as_id(doc.get('id')) for doc in documents if isinstance(doc, dict)]
+    existing = kind.model.objects.in_bulk([pk for pk in ids if pk is not None])
+    items = defaultdict(dict)
+    for item in kind.item_model.objects.filter(**{f'{kind.parent}_id__in': list(existing)}):
+        items[getattr(item, f'{kind.parent}_id')][item.pk] = item
+
+    prepared, errors, seen = [], [], set()
+    for index, document in enumerate(documents):
+        if not isinstance(document, dict):
+            errors.append({'index': index, 'errors': {'__all__': ["Each document must be an object."]}})
+            continue
+        document_errors = {}
+        pk = document.get('id')
+        if pk is not None and _as_id(pk) is None:
+            errors.append({'index': index, 'errors': {'id': ["'id' must be an integer."]}})
+            continue
+        pk = _as_id(pk)
+        if pk is not None and pk in seen:
+            # Both updates would be checked against the same version and silently merged.
+            errors.append({'index': index, 'errors': {'id': [f"Document {pk} appears more than once."]}})
+            continue
+        seen.add(pk)
+        instance = existing.get(pk) if pk is not None else kind.model()
+        if instance is None:
+            errors.append({'index': index, 'errors': {'id': [f"No {kind.model._meta.verbose_name} with id {pk}."]}})
+            continue
+        if pk is not None and document.get('version') is None:
+            document_errors['version'] = ["Updates must send the version they were read at."]
+        form = kind.form(_form_data(instance, kind.form, document), instance=instance)
+        if not form.is_valid():
+            if form.has_error(NON_FIELD_ERRORS, 'conflict'):
+                raise BatchError(409, {'error': CONFLICT_MESSAGE, 'index': index, 'id': pk, 'version': instance.version})
+            document_errors.update(_errors(form))
+
+        item_forms, removed = None, []
+        if 'items' in document:
+            if kind.model is Invoice and form.cleaned_data.get('quotation'):
+                document_errors['items'] = ["Invoices raised from a quotation take its items."]
+            elif not isinstance(document['items'], list):
+                document_errors['items'] = ["'items' must be a list."]
+            else:
+                current, item_forms, item_errors, seen_items = items.get(pk, {}), [], {}, set()
+                for position, payload in enumerate(document['items']):
+                    if not isinstance(payload, dict):
+                        item_errors[str(position)] = {'__all__': ["Each item must be an object."]}
+                        continue
+                    item_pk = payload.get('id')
+                    if item_pk is not None and _as_id(item_pk) is None:
+                        item_errors[str(position)] = {'id': ["'id' must be an integer."]}
+                        continue
+                    if item_pk is not None and _as_id(item_pk) in seen_items:
+                        item_errors[str(position)] = {'id': [f"Item {item_pk} appears more than once."]}
+                        continue
+                    seen_items.add(_as_id(item_pk))
+                    item = current.get(_as_id(item_pk)) if item_pk is not None else kind.item_model()
+                    if item is None:
+                        item_errors[str(position)] = {'id': [f"Item {item_pk} is not on this document."]}
+                        continue
+                    item_form = kind.item_form(_form_data(item, kind.item_form, payload), instance=item)
+                    if item_form.is_valid():
+                        item_forms.append(item_form)
+                    else:
+                        item_errors[str(position)] = _errors(item_form)
+                if item_errors:
+                    document_errors['items'] = item_errors
+                kept = {_as_id(payload.get('id')) for payload in document['items'] if isinstance(payload, dict)}
+                removed = [item_pk for item_pk in current if item_pk not in kept]
+
+        if document_errors:
+            errors.append({'index': index, 'errors': document_errors})
+        else:
+            prepared.append((form, item_forms, removed))
+    if errors:
+        raise BatchError(400, {'errors': errors})
+    return prepared
+
+
+def save(kind, prepared):
+    """Write validated documents and their items; returns the document ids in order."""
+    ids, new_items, changed_items, removed_items = [], [], [], []
+    for index, (form, item_forms, removed) in enumerate(prepared):
+        try:
+            document = form.save()
+        except ConcurrentUpdateError as error:
+            raise BatchError(409, {'error': str(error), 'index': index, 'id': error.pk, 'version': error.version})
+        ids.append(document.pk)
+        for item_form in item_forms or ():
+            item = item_form.save(commit=False)
+            setattr(item, f'{kind.parent}_id', document.pk)
+            (changed_items if item.pk else new_items).append(item)
+        removed_items += removed
+
+    item_fields = kind.item_form._meta.fields
+    # Bulk writes send no signals: record what they did.
+    outbox.delete_many(kind.item_model.objects.filter(pk__in=removed_items))
+    created = kind.item_model.objects.bulk_create(new_items)
+    kind.item_model.objects.bulk_update(changed_items, item_fields)
+    outbox.record_many(kind.item_model, [item.pk for item in created], 'created')
+    outbox.record_many(kind.item_model, [item.pk for item in changed_items])
+    kind.recalculate(ids)
+    return ids
+
+
+@replica_reads
+@query_budget(10)  # A fetch; writes get a budget sized to the batch
+@require_http_methods(['GET', 'POST'])
+def batch(request, kind):
+    kind = KINDS[kind]
+    opts = kind.model._meta
+    action = 'view' if request.method == 'GET' else 'change'
+    if not request.user.is_authenticated:
+        return json_response({'error': "Authentication required."}, status=401)
+    if not request.user.has_perms([f'{opts.app_label}.{action}_{opts.model_name}']
+                                  + ([f'{opts.app_label}.add_{opts.model_name}'] if action == 'change' else [])):
+        return json_response({'error': "Permission denied."}, status=403)
+
+    try:
+        if request.method == 'GET':
+            fields = _fieldset(request.GET.get('fields'), (*kind.fields, 'items'))
+            include_items = fields is None or 'items' in fields
+            if fields is not None:
+                fields = tuple(name for name in fields if name != 'items')
+            item_fields = _fieldset(request.GET.get('item_fields'), kind.item_fields)
+            documents = fetch(kind, _id_list(request.GET.get('ids', '')), fields, item_fields, include_items)
+            return json_response({'results': documents})
+
+        body = parse_body(request) if request.body else None
+        if not isinstance(body, dict):
+            raise BatchError(400, {'error': "The body must be an object with a 'documents' list."})
+        documents = body.get('documents')
+        if documents is not None and isinstance(documents, list):
+            set_request_budget(request, QUERIES_PER_DOCUMENT * len(documents) + 20)
+        with transaction.atomic():
+            ids = save(kind, prepare(kind, documents))
+        return json_response({'results': fetch(kind, ids)})
+    except BatchError as error:
+        return json_response(error.payload, status=error.status)
@@ -0,0 +1,102 @@
+"""In-memory prefix index over the product/service catalog.
+
+The catalog is small (hundreds of entries) and read on every keystroke of
+the quotation form, so each process keeps it in memory as a sorted list of
+``(word, entry)`` pairs and answers a prefix with two ``bisect`` calls - no
+database query at all. Saving or deleting a ``CatalogItem`` stores a new
+version token in the cache; every process compares its index's token with
+the cached one on lookup (one cache read) and rebuilds from the database
+when they differ. With a shared cache backend this invalidates all workers.
+"""
+import re
+import threading
+import uuid
+from bisect import bisect_left
+from dataclasses import dataclass
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CatalogItem
+
+VERSION_KEY = 'catalog:index-version'
+MAX_SUGGESTIONS = 10
+_WORD = re.compile(r'\w+')
+
+
+@dataclass(frozen=True)
+class Entry:
+    id: int
+    name: str
+    unit_price: str
+
+
+def words(text):
+    return _WORD.findall(text.lower())
+
+
+class PrefixIndex:
+    def __init__(self, entries):
+        self.entries = sorted(entries, key=lambda entry: entry.name.lower())
+        self.keys = sorted(
+            (word, position) for position, entry in enumerate(self.entries) for word in set(words(entry.name))
+        )
+
+    def search(self, query, limit=MAX_SUGGESTIONS):
+        """Entries with a word starting with each word of ``query``; whole-name prefixes first."""
+        terms = words(query)
+        if not terms:
+            return []
+        first, rest = terms[0], terms[1:]
+        start = bisect_left(self.keys, (first,))
+        end = bisect_left(self.keys, (first + '\uffff',))
+        positions = sorted({position for _, position in self.keys[start:end]})
+        matches = []
+        for position in positions:
+            entry = self.entries[position]
+            entry_words = words(entry.name)
+            if all(any(word.startswith(term) for word in entry_words) for term in rest):
+                matches.append(entry)
+        lowered = query.strip().lower()
+        matches.sort(key=lambda entry: not entry.name.lower().startswith(lowered))
+        return matches[:limit]
+
+
+_index = None
+_index_version = None
+_lock = threading.Lock()
+
+
+def current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Cache was cleared or never primed: start a new generation.
+        version = uuid.uuid4().hex
+        cache.add(VERSION_KEY, version, None)
+        version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def get_index():
+    global _index, _index_version
+    version = current_version()
+    if _index is None or _index_version != version:
+        with _lock:
+            if _index is None or _index_version != version:
+                rows = CatalogItem.objects.filter(is_active=True).values_list('id', 'name', 'unit_price')
+                _index = PrefixIndex(Entry(pk, name, str(price)) for pk, name, price in rows)
+                _index_version = version
+    return _index
+
+
+def suggest(query, limit=MAX_SUGGESTIONS):
+    return get_index().search(query, limit)
+
+
+@receiver(post_save, sender=CatalogItem)
+@receiver(post_delete, sender=CatalogItem)
+def invalidate_index(sender, **kwargs):
+    # After commit, so no worker can rebuild from the old rows under the new token.
+    transaction.on_commit(lambda: cache.set(VERSION_KEY, uuid.uuid4().hex, None))
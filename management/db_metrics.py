@@ -0,0 +1,66 @@
+"""Connection statistics for the configured ``DB_CONNECTION_MODE``.
+
+In ``pool`` mode the numbers come from psycopg_pool's own counters. In the
+``none`` and ``persistent`` modes there is no queue to wait in, so only the
+number of connections Django has opened is tracked; comparing that figure with
+the request count shows how often connection setup is being paid.
+"""
+import threading
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+_lock = threading.Lock()
+_connections_opened = {}
+
+
+@receiver(connection_created)
+def count_connection(sender, connection, **kwargs):
+    """Count connections handed to Django, per database alias."""
+    with _lock:
+        _connections_opened[connection.alias] = _connections_opened.get(connection.alias, 0) + 1
+
+
+def connection_stats(alias='default'):
+    """Return a flat dict of connection metrics for ``alias``."""
+    connection = connections[alias]
+    stats = {
+        'alias': alias,
+        'mode': getattr(settings, 'DB_CONNECTION_MODE', 'none'),
+        'connections_opened': _connections_opened.get(alias, 0),
+    }
+    pool = getattr(connection, 'pool', None)
+    if pool is None:
+        stats.update({
+            'in_use': int(connection.connection is not None),
+            'waiting': 0,
+            'acquire_latency_ms': None,
+            'max_age': connection.settings_dict.get('CONN_MAX_AGE'),
+            'health_checks': connection.settings_dict.get('CONN_HEALTH_CHECKS'),
+        })
+        return stats
+
+    pool_stats = pool.get_stats()
+    requests = pool_stats.get('requests_num', 0)
+    stats.update({
+        'pool_min': pool_stats.get('pool_min', 0),
+        'pool_max': pool_stats.get('pool_max', 0),
+        'pool_size': pool_stats.get('pool_size', 0),
+        'available': pool_stats.get('pool_available', 0),
+        'in_use': pool_stats.get('pool_size', 0) - pool_stats.get('pool_available', 0),
+        'waiting': pool_stats.get('requests_waiting', 0),
+        'requests': requests,
+        'requests_queued': pool_stats.get('requests_queued', 0),
+        'requests_errors': pool_stats.get('requests_errors', 0),
+        'acquire_latency_ms': round(pool_stats.get('requests_wait_ms', 0) / requests, 3) if requests else 0.0,
+        'physical_connections': pool_stats.get('connections_num', 0),
+        'connect_latency_ms': (
+            round(pool_stats.get('connections_ms', 0) / pool_stats['connections_num'], 3)
+            if pool_stats.get('connections_num') else 0.0
+        ),
+        'connections_lost': pool_stats.get('connections_lost', 0),
+        'returns_bad': pool_stats.get('returns_bad', 0),
+    })
+    return stats
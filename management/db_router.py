@@ -0,0 +1,154 @@
+"""Send the reads of read-only pages, reports and the read API to a replica.
+
+Views opt in like query budgets: the ``replica_reads`` decorator on a
+function-based view, or ``replica_reads = True`` on a class-based one.
+``ReplicaRoutingMiddleware`` then routes that request's reads to
+``settings.REPLICA_DATABASE`` through ``ReplicaRouter``. Code outside a view
+(reports, exports) uses ``with use_replica():`` instead. Writes always go to
+``default``; only this app's models are routed (sessions and users stay on
+the primary), and nothing is routed while ``settings.REPLICA_READS`` is off.
+
+A replica lags the primary a little, so once a request writes, the rest of
+it reads from the primary, and the middleware sets a cookie that keeps the
+user's next requests on the primary for ``settings.REPLICA_STICKY_SECONDS``.
+People therefore always see their own changes.
+"""
+import time
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_COOKIE = 'primary_until'
+
+_routing = ContextVar('db_routing', default=None)
+
+
+@dataclass
+class RoutingState:
+    replica: bool = False  # Reads may go to the replica
+    pinned: bool = False   # This user wrote recently: stay on the primary
+    wrote: bool = False    # Something was written during this request
+
+
+def replica_alias():
+    if not getattr(settings, 'REPLICA_READS', False):
+        return None
+    alias = getattr(settings, 'REPLICA_DATABASE', 'replica')
+    return alias if alias in settings.DATABASES else None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # Sessions and users stay on the primary: a login must be visible at once.
+        if model._meta.app_label != 'management':
+            return None
+        state = _routing.get()
+        if state is not None and state.replica and not (state.pinned or state.wrote):
+            return replica_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            state.wrote = True
+        # Explicitly, or Django would write an instance back to the database it was read from.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        replica = getattr(settings, 'REPLICA_DATABASE', 'replica')
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, replica}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == getattr(settings, 'REPLICA_DATABASE', 'replica'):
+            return False
+        return None
+
+
+class use_replica(ContextDecorator):
+    """Route reads in the block to the replica, unless the current request is pinned to the primary."""
+
+    def _recreate_cm(self):
+        return type(self)()  # A fresh token per decorated call, so threads do not share one
+
+    def __enter__(self):
+        current = _routing.get()
+        state = RoutingState(replica=True, pinned=current is not None and (current.pinned or current.wrote))
+        self._token = _routing.set(state)
+        return state
+
+    def __exit__(self, *exc_info):
+        _routing.reset(self._token)
+        return False
+
+
+def replica_reads(view_func):
+    """Mark a function-based view as read-only, so it may read from the replica."""
+    view_func.replica_reads = True
+    return view_func
+
+
+def reads_from_replica(view_func):
+    if getattr(view_func, 'replica_reads', False):
+        return True
+    return getattr(getattr(view_func, 'view_class', None), 'replica_reads', False)
+
+
+def pinned_to_primary(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReplicaRoutingMiddleware:
+    """Apply the routing rules above to each request. See ``management.db_router``.
+
+    Works in sync and async chains; the routing state is a ContextVar, which
+    sync_to_async carries into the threads async views query from.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 15)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState(pinned=pinned_to_primary(request))
+        token = _routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.pin_after_write(state, response)
+
+    async def __acall__(self, request):
+        state = RoutingState(pinned=pinned_to_primary(request))
+        token = _routing.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.pin_after_write(state, response)
+
+    def pin_after_write(self, state, response):
+        if state.wrote and replica_alias():
+            response.set_cookie(PIN_COOKIE, f"{time.time() + self.sticky_seconds:.0f}",
+                                max_age=self.sticky_seconds, httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _routing.get()
+        if state is not None and request.method in ('GET', 'HEAD') and reads_from_replica(view_func):
+            state.replica = True
+        return None
@@ -0,0 +1,149 @@
+"""Thumbnails and previews of scanned and stamped invoices.
+
+After an upload is committed its file is handed to a process pool, which
+writes a small JPEG thumbnail and a larger compressed preview under
+``derivatives/<kind>/`` in ``MEDIA_ROOT``. PDFs are rasterised from their
+first page. Pages show the derivatives when they exist and fall back to a
+plain link otherwise, so a slow or failed render never blocks anything.
+
+Pillow is required for images and pypdfium2 additionally for PDFs; when they
+are not installed no derivatives are made. ``build_derivatives`` backfills
+files uploaded before this pipeline existed.
+"""
+import hashlib
+import importlib.util
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from .storage import is_blob_name
+
+logger = logging.getLogger(__name__)
+
+# kind: (bounding box in pixels, JPEG quality)
+SIZES = {
+    'thumbnail': ((240, 240), 70),
+    'preview': ((1400, 1400), 80),
+}
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif', '.tiff', '.webp'}
+PDF_EXTENSIONS = {'.pdf'}
+
+_executor = None
+
+
+def derivative_name(name, kind):
+    """Storage name of the ``kind`` derivative of the stored file ``name``."""
+    if is_blob_name(name):
+        stem = PurePosixPath(name).stem  # Already the content hash
+    else:
+        stem = hashlib.sha256(name.encode()).hexdigest()
+    return f"derivatives/{kind}/{stem[:2]}/{stem}.jpg"
+
+
+def derivative_url(name, kind):
+    """URL of the derivative if it has been generated, else None."""
+    if not name:
+        return None
+    derivative = derivative_name(name, kind)
+    return default_storage.url(derivative) if default_storage.exists(derivative) else None
+
+
+def can_render(name):
+    extension = PurePosixPath(name).suffix.lower()
+    if extension in IMAGE_EXTENSIONS:
+        return importlib.util.find_spec('PIL') is not None
+    if extension in PDF_EXTENSIONS:
+        return (importlib.util.find_spec('PIL') is not None
+                and importlib.util.find_spec('pypdfium2') is not None)
+    return False
+
+
+def jobs_for(name, force=False):
+    """Arguments for ``render_derivatives``, or None if there is nothing to do."""
+    if not name or not can_render(name) or not default_storage.exists(name):
+        return None
+    targets = {
+        kind: (default_storage.path(derivative_name(name, kind)), box, quality)
+        for kind, (box, quality) in SIZES.items()
+    }
+    if not force and all(os.path.exists(path) for path, _, _ in targets.values()):
+        return None
+    return default_storage.path(name), targets
+
+
+def render_derivatives(source_path, targets):
+    """Write each target derivative of ``source_path``. Runs in a worker process.
+
+    Only touches the filesystem, so workers need no Django setup or database.
+    """
+    from PIL import Image
+
+    if PurePosixPath(source_path).suffix.lower() in PDF_EXTENSIONS:
+        import pypdfium2
+
+        pdf = pypdfium2.PdfDocument(source_path)
+        try:
+            page = pdf[0]
+            largest = max(max(box) for _, box, _ in targets.values())
+            scale = largest / max(page.get_size())
+            image = page.render(scale=scale).to_pil()
+        finally:
+            pdf.close()
+    else:
+        image = Image.open(source_path)
+        image.load()
+
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    written = []
+    for path, box, quality in targets.values():
+        copy = image.copy()
+        copy.thumbnail(box)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.part"
+        copy.save(partial, 'JPEG', quality=quality, optimize=True, progressive=True)
+        os.replace(partial, path)
+        written.append(path)
+    return written
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        # spawn, not fork: the web process may have threads and open DB sockets.
+        _executor = ProcessPoolExecutor(
+            max_workers=getattr(settings, 'DERIVATIVE_WORKERS', 2),
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    return _executor
+
+
+def _log_failure(name):
+    def callback(future):
+        if future.exception() is not None:
+            logger.warning("Could not render derivatives of %s: %s", name, future.exception())
+    return callback
+
+
+def queue_derivatives(name):
+    """Render derivatives of ``name`` in the background (inline if DERIVATIVES_ASYNC is off)."""
+    job = jobs_for(name)
+    if job is None:
+        return
+    if not getattr(settings, 'DERIVATIVES_ASYNC', True):
+        try:
+            render_derivatives(*job)
+        except Exception as exc:
+            logger.warning("Could not render derivatives of %s: %s", name, exc)
+        return
+    get_executor().submit(render_derivatives, *job).add_done_callback(_log_failure(name))
+
+
+def delete_derivatives(name):
+    for kind in SIZES:
+        default_storage.delete(derivative_name(name, kind))
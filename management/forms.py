@@ -1,16 +1,46 @@
 from django import forms
 from django.core.exceptions import ValidationError
-from .models import Quotation, QuotationItem,Invoice, InvoiceItem
+from .models import Quotation, QuotationItem,Invoice, InvoiceItem, Receipt
 from decimal import Decimal
 from django.utils import timezone
-from django.forms import modelformset_factory
+from django.forms import modelformset_factory, inlineformset_factory
 
-class QuotationForm(forms.ModelForm):
+CONFLICT_MESSAGE = (
+    "Someone else saved changes to this document while you were editing it. "
+    "Reload the page to see their changes, then make yours again."
+)
+
+
+class VersionedModelForm(forms.ModelForm):
+    """ModelForm for a ``VersionedModel``.
+
+    The version the form was rendered with comes back in a hidden field and
+    is what the conditional UPDATE checks, so an edit started before someone
+    else's save is rejected rather than silently overwriting it. Submissions
+    without a version (old clients) fall back to last-write-wins.
+    """
+    version = forms.IntegerField(widget=forms.HiddenInput, required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        version = cleaned_data.get('version')
+        if version is None:
+            cleaned_data['version'] = self.instance.version
+        elif self.instance.pk and version != self.instance.version:
+            raise ValidationError(CONFLICT_MESSAGE, code='conflict')
+        return cleaned_data
+
+    def add_conflict_error(self):
+        """Report a ``ConcurrentUpdateError`` raised while saving."""
+        self.add_error(None, ValidationError(CONFLICT_MESSAGE, code='conflict'))
+
+
+class QuotationForm(VersionedModelForm):
     class Meta:
         model = Quotation
         fields = [
             'client_name', 'client_email', 'client_address', 'client_phone_number',
-            'tax_rate', 'status', 'valid_until'
+            'tax_rate', 'status', 'valid_until', 'version'
         ]
         labels = {
             'client_name': 'Client Name',
@@ -62,12 +92,17 @@ class QuotationForm(forms.ModelForm):
 class QuotationItemForm(forms.ModelForm):
     class Meta:
         model = QuotationItem
-        fields = ['description', 'quantity', 'unit_price']
+        fields = ['catalog_item', 'description', 'quantity', 'unit_price']
         labels = {
             'description': 'Item Description',
             'quantity': 'Quantity',
             'unit_price': 'Unit Price',
         }
+        widgets = {
+            # Filled in by the autocomplete on the description field
+            'catalog_item': forms.HiddenInput(),
+            'description': forms.TextInput(attrs={'class': 'catalog-autocomplete', 'autocomplete': 'off'}),
+        }
 
     def clean_quantity(self):
         quantity = self.cleaned_data.get('quantity')
@@ -91,11 +126,11 @@ QuotationItemFormSet = modelformset_factory(
 )
 
 # forms for Invoices begin here
-class InvoiceForm(forms.ModelForm):
+class InvoiceForm(VersionedModelForm):
     class Meta:
         model = Invoice
         fields = ['client_name', 'client_email', 'client_address', 'client_phone_number',
-                  'status', 'due_date', 'tax_rate', 'stamped_invoice']
+                  'status', 'due_date', 'tax_rate', 'stamped_invoice', 'version']
         widgets = {
             'client_address': forms.Textarea(attrs={'rows': 3}),
             'due_date': forms.DateInput(attrs={'type': 'date'}),
@@ -145,10 +180,32 @@ class InvoiceItemForm(forms.ModelForm):
             raise ValidationError("Unit price must be a positive number.")
         return unit_price
 
-# Formset for handling multiple InvoiceItem forms
-InvoiceItemFormSet = modelformset_factory(
+# Inline formset for handling multiple InvoiceItem forms on an Invoice
+InvoiceItemFormSet = inlineformset_factory(
+    Invoice,
     InvoiceItem,
     form=InvoiceItemForm,
     extra=1,  # One empty form by default
     can_delete=True  # Allow deletion of items
-)
\ No newline at end of file
+)
+
+
+class PaymentAllocationForm(forms.Form):
+    """One payment from a client, spread over their open invoices (see ``allocate_payment``)."""
+    amount = forms.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0.01'))
+    payment_date = forms.DateField(initial=timezone.localdate)
+    payment_method = forms.ChoiceField(choices=[('', '---------')] + Receipt.PAYMENT_METHOD_CHOICES, required=False)
+    invoices = forms.ModelMultipleChoiceField(
+        queryset=Invoice.objects.none(), required=False, widget=forms.CheckboxSelectMultiple,
+        help_text="Leave empty to pay the oldest due invoices first.",
+    )
+    notes = forms.CharField(widget=forms.Textarea, required=False)
+
+    def __init__(self, *args, client_id, **kwargs):
+        from .services.payment_service import open_invoices
+
+        super().__init__(*args, **kwargs)
+        self.fields['invoices'].queryset = open_invoices(client_id)
+        self.fields['invoices'].label_from_instance = (
+            lambda invoice: f"{invoice.invoice_number} - due {invoice.due_date or '-'}, owes {invoice.outstanding}"
+        )
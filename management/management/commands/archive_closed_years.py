@@ -0,0 +1,92 @@
+import os
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import ExtractYear
+from django.utils import timezone
+
+from management import outbox
+from management.archive import (INVOICE_COLUMNS, ITEM_COLUMNS, RECEIPT_COLUMNS, archive_root,
+                                write_segment)
+from management.models import ArchivedInvoice, Invoice, InvoiceItem, Receipt, ScannedInvoice
+
+
+def archivable(before_year):
+    """Paid invoices dated before ``before_year`` that carry no uploaded files."""
+    return (
+        Invoice.objects.filter(status='Paid', date_created__lt=date(before_year, 1, 1))
+        .filter(Q(stamped_invoice='') | Q(stamped_invoice__isnull=True))
+        .exclude(pk__in=ScannedInvoice.objects.values('invoice_id'))
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Move fully paid invoices from closed years, with their items and receipts, into "
+        "compressed read-only archive files and delete them from the live tables in chunks. "
+        "Invoices with scans or a stamped copy stay live. See management/archive.py."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', type=int, default=timezone.now().year - 1,
+                            help='Archive invoices dated before 1 January of this year.')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Invoices per archive segment.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be archived.')
+
+    def handle(self, *args, **options):
+        if options['before'] > timezone.now().year:
+            raise CommandError("Only closed years can be archived.")
+        candidates = archivable(options['before'])
+        years = sorted(candidates.annotate(year=ExtractYear('date_created'))
+                       .values_list('year', flat=True).distinct().order_by())
+        if options['dry_run']:
+            self.stdout.write(f"Would archive {candidates.count()} invoices from years {years}.")
+            return
+
+        started, archived = time.monotonic(), 0
+        for year in years:
+            after = 0
+            while True:
+                count, after = self.archive_chunk(options['before'], year, after, options['chunk_size'])
+                if not count:
+                    break
+                archived += count
+            self.stdout.write(f"{year}: archived up to invoice #{after}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived} invoices to {archive_root()} in {time.monotonic() - started:.1f}s."
+        ))
+
+    def archive_chunk(self, before_year, year, after, chunk_size):
+        """Archive the next chunk of ``year`` after invoice id ``after``; returns (count, last id)."""
+        segment = None
+        try:
+            with transaction.atomic():
+                invoices = list(
+                    archivable(before_year)
+                    .filter(date_created__year=year, pk__gt=after).order_by('pk')
+                    .select_for_update(skip_locked=True)
+                    .values(*INVOICE_COLUMNS)[:chunk_size]
+                )
+                if not invoices:
+                    return 0, after
+                ids = [invoice['id'] for invoice in invoices]
+                items = list(InvoiceItem.objects.filter(invoice_id__in=ids).order_by('pk').values(*ITEM_COLUMNS))
+                receipts = list(Receipt.objects.filter(invoice_id__in=ids).order_by('pk').values(*RECEIPT_COLUMNS))
+
+                segment = write_segment(year, invoices, items, receipts)
+                ArchivedInvoice.objects.bulk_create([
+                    ArchivedInvoice(invoice_id=invoice['id'], invoice_number=invoice['invoice_number'],
+                                    client_name=invoice['client_name'], date_created=invoice['date_created'],
+                                    grand_total=invoice['grand_total'], segment=segment)
+                    for invoice in invoices
+                ])
+                outbox.delete_many(Invoice.objects.filter(pk__in=ids))  # Items and receipts cascade
+        except BaseException:
+            # Nothing was deleted, so the segment must not survive to duplicate the rows.
+            if segment is not None:
+                os.unlink(archive_root() / segment)
+            raise
+        return len(invoices), ids[-1]
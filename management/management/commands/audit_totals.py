@@ -0,0 +1,135 @@
+import logging
+import multiprocessing
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import F, Max, Min, Q
+
+from management.models import Invoice, Quotation
+from management.outbox import record_many
+from management.services.invoice_service import expected_invoice_totals
+from management.services.quotation_service import expected_quotation_totals
+
+TOTAL_FIELDS = ('subtotal', 'labour_cost', 'total_tax', 'grand_total')
+
+logger = logging.getLogger('management.audit_totals')
+
+# Quotations first: invoices raised from a quotation copy its (fixed) totals.
+# Item line totals are generated columns and cannot drift.
+TARGETS = {
+    'quotations': (Quotation, expected_quotation_totals),
+    'invoices': (Invoice, expected_invoice_totals),
+}
+
+
+def mismatches(model, expected, id_range):
+    """Rows in ``id_range`` whose stored totals differ from the SQL aggregates."""
+    queryset = model.objects.filter(pk__range=id_range).order_by('pk')
+    differs = Q()
+    for field in TOTAL_FIELDS:
+        differs |= ~Q(**{field: F(f'expected_{field}')})
+    return queryset.annotate(**expected()).filter(differs).only('pk', *TOTAL_FIELDS)
+
+
+def audit_range(target, id_range, chunk_size, fix, show, sample=1.0):
+    """Audit (and optionally fix) one id range of ``target``; the unit of work per worker.
+
+    With ``sample`` below 1 only that fraction of the chunks, picked at random,
+    is checked.
+    """
+    model, expected = TARGETS[target]
+    found, samples = 0, []
+    for start in range(id_range[0], id_range[1] + 1, chunk_size):
+        if sample < 1 and random.random() >= sample:
+            continue
+        window = (start, min(start + chunk_size - 1, id_range[1]))
+        with transaction.atomic():
+            rows = list(mismatches(model, expected, window).select_for_update(of=('self',)) if fix
+                        else mismatches(model, expected, window))
+            for row in rows:
+                before = {field: getattr(row, field) for field in TOTAL_FIELDS}
+                after = {field: getattr(row, f'expected_{field}') for field in TOTAL_FIELDS}
+                for field, value in after.items():
+                    setattr(row, field, value)
+                row.version = F('version') + 1
+                if len(samples) < show:
+                    samples.append((row.pk, {f: (str(before[f]), str(after[f]))
+                                             for f in before if before[f] != after[f]}))
+            if fix and rows:
+                model.objects.bulk_update(rows, [*TOTAL_FIELDS, 'version'], batch_size=chunk_size)
+                record_many(model, [row.pk for row in rows])
+        found += len(rows)
+    return found, samples
+
+
+def _audit_range_in_worker(args):
+    try:
+        return audit_range(*args)
+    finally:
+        connections.close_all()
+
+
+def split_range(low, high, parts):
+    step = -(-(high - low + 1) // parts)
+    return [(start, min(start + step - 1, high)) for start in range(low, high + 1, step)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the stored totals of every quotation and invoice with SQL "
+        "aggregates and report documents whose denormalised totals have drifted. With --fix the "
+        "drifted rows are corrected with chunked bulk_update. --workers splits each id range "
+        "across processes. Single-item edits adjust totals incrementally, so run this "
+        "periodically (e.g. nightly with --sample) to catch drift."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Write the recomputed totals back.')
+        parser.add_argument('--workers', type=int, default=1, help='Processes to split each id range across.')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Rows checked per query.')
+        parser.add_argument('--only', choices=list(TARGETS), action='append',
+                            help='Restrict to one kind of document (repeatable).')
+        parser.add_argument('--show', type=int, default=10, help='Mismatches to print per kind.')
+        parser.add_argument('--sample', type=float, default=1.0,
+                            help='Fraction of chunks to check, for cheap periodic runs (0-1].')
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 1)
+        total_found = 0
+        for target in TARGETS:
+            if options['only'] and target not in options['only']:
+                continue
+            model = TARGETS[target][0]
+            started = time.monotonic()
+            bounds = model.objects.aggregate(low=Min('pk'), high=Max('pk'))
+            if bounds['low'] is None:
+                self.stdout.write(f"{target}: nothing to check")
+                continue
+
+            jobs = [(target, id_range, options['chunk_size'], options['fix'], options['show'], options['sample'])
+                    for id_range in split_range(bounds['low'], bounds['high'], workers)]
+            if workers > 1:
+                connections.close_all()  # children must not share the parent's sockets
+                with multiprocessing.get_context('fork').Pool(workers) as pool:
+                    results = pool.map(_audit_range_in_worker, jobs)
+            else:
+                results = [audit_range(*job) for job in jobs]
+
+            found = sum(count for count, _ in results)
+            samples = [sample for _, batch in results for sample in batch][:options['show']]
+            total_found += found
+            action = 'fixed' if options['fix'] else 'found'
+            self.stdout.write(
+                f"{target}: {found} mismatched {action} in {time.monotonic() - started:.1f}s"
+            )
+            if found:
+                logger.warning("%s %s with drifted totals", found, target)
+            for pk, diff in samples:
+                changes = ', '.join(f"{field} {old} -> {new}" for field, (old, new) in diff.items())
+                self.stdout.write(f"  #{pk}: {changes}")
+
+        style = self.style.WARNING if total_found and not options['fix'] else self.style.SUCCESS
+        self.stdout.write(style(f"{total_found} rows with drifted totals"
+                                f"{' fixed' if options['fix'] else ''}."))
@@ -0,0 +1,92 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from management.models import Invoice, ScannedInvoice, StoredBlob
+from management.storage import CAS_PREFIX, is_blob_name, scan_storage
+
+
+def reference_counts():
+    """Map of blob name to the number of records pointing at it, from the file fields."""
+    counts = {}
+    for model, field in ((ScannedInvoice, 'scanned_file'), (Invoice, 'stamped_invoice')):
+        rows = (model.objects.filter(**{f'{field}__startswith': f'{CAS_PREFIX}/'})
+                .values(field).annotate(n=Count('pk')).values_list(field, 'n'))
+        for name, n in rows:
+            counts[name] = counts.get(name, 0) + n
+    return counts
+
+
+class Command(BaseCommand):
+    help = (
+        "Report how much disk space the content-addressed scan store saves through "
+        "de-duplication. --recount rebuilds each blob's reference count from the invoice and "
+        "scan records; --collect-garbage deletes blobs (and stray files) nothing refers to."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recount', action='store_true', help='Rebuild reference counts from the records.')
+        parser.add_argument('--collect-garbage', action='store_true', help='Delete unreferenced blobs and files.')
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            self.recount()
+        if options['collect_garbage']:
+            self.collect_garbage()
+
+        stats = StoredBlob.objects.aggregate(
+            blobs=Count('pk'), stored=Sum('size'), references=Sum('ref_count'),
+            saved=Sum((F('ref_count') - 1) * F('size'), filter=Q(ref_count__gt=1)),
+        )
+        self.stdout.write(
+            f"{stats['blobs']} blobs, {stats['references'] or 0} references, "
+            f"{_megabytes(stats['stored'])} on disk."
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"De-duplication saves {_megabytes(stats['saved'])}."
+        ))
+
+    def recount(self):
+        counts = reference_counts()
+        changed = 0
+        with transaction.atomic():
+            for blob in StoredBlob.objects.select_for_update().only('pk', 'name', 'ref_count'):
+                actual = counts.get(blob.name, 0)
+                if blob.ref_count != actual:
+                    blob.ref_count = actual
+                    blob.save(update_fields=['ref_count'])
+                    changed += 1
+        self.stdout.write(f"Recounted references; {changed} blobs corrected.")
+
+    def collect_garbage(self):
+        counts = reference_counts()
+        known = set()
+        removed = 0
+        for blob in StoredBlob.objects.only('pk', 'name', 'ref_count').iterator():
+            known.add(blob.name)
+            if blob.ref_count == 0 and not counts.get(blob.name):
+                scan_storage.delete(blob.name)
+                blob.delete()
+                removed += 1
+
+        stray = 0
+        for name in _walk(CAS_PREFIX):
+            if is_blob_name(name) and name not in known and not counts.get(name):
+                scan_storage.delete(name)
+                stray += 1
+        self.stdout.write(f"Removed {removed} unreferenced blobs and {stray} stray files.")
+
+
+def _walk(directory):
+    if not scan_storage.exists(directory):
+        return
+    dirs, files = scan_storage.listdir(directory)
+    for name in files:
+        yield f"{directory}/{name}"
+    for name in dirs:
+        if name != 'tmp':
+            yield from _walk(f"{directory}/{name}")
+
+
+def _megabytes(size):
+    return f"{(size or 0) / (1024 * 1024):.2f} MB"
@@ -0,0 +1,58 @@
+import importlib.util
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+
+from management.derivatives import jobs_for, render_derivatives
+from management.models import Invoice, ScannedInvoice
+
+
+def stored_file_names():
+    """Distinct names of every scanned and stamped invoice file."""
+    names = set(ScannedInvoice.objects.exclude(scanned_file='').values_list('scanned_file', flat=True))
+    names.update(Invoice.objects.exclude(stamped_invoice='').exclude(stamped_invoice__isnull=True)
+                 .values_list('stamped_invoice', flat=True))
+    return sorted(names)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate missing thumbnails and previews for scanned and stamped invoices uploaded "
+        "before derivative generation existed (or after a failed render). Files are rendered in "
+        "a process pool; --force re-renders files that already have derivatives."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                            help='Rendering processes.')
+        parser.add_argument('--force', action='store_true', help='Re-render existing derivatives.')
+
+    def handle(self, *args, **options):
+        if importlib.util.find_spec('PIL') is None:
+            raise CommandError("Pillow (and pypdfium2 for PDFs) must be installed to render derivatives.")
+
+        started = time.monotonic()
+        jobs = {}
+        skipped = 0
+        for name in stored_file_names():
+            job = jobs_for(name, force=options['force'])
+            if job is None:
+                skipped += 1
+            else:
+                jobs[name] = job
+
+        failed = 0
+        with ProcessPoolExecutor(max_workers=max(options['workers'], 1),
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = {pool.submit(render_derivatives, *job): name for name, job in jobs.items()}
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    failed += 1
+                    self.stderr.write(f"{futures[future]}: {future.exception()}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {len(jobs) - failed} files, {failed} failed, {skipped} skipped "
+            f"(already done, missing or unsupported) in {time.monotonic() - started:.1f}s."
+        ))
@@ -0,0 +1,251 @@
+import logging
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from management.models import Client, Invoice, InvoiceItem, Quotation, QuotationItem, Receipt, ScannedInvoice
+from management.services.invoice_service import recalculate_invoice_totals
+from management.services.payment_service import refresh_payment_status
+from management.services.quotation_service import recalculate_quotation_totals
+
+SERVICES = [
+    'Site survey', 'Electrical installation', 'CCTV camera installation', 'Network cabling (per point)',
+    'Solar panel installation', 'Inverter servicing', 'Generator maintenance', 'Plumbing works',
+    'Painting (per room)', 'Tiling (per sqm)', 'Gypsum ceiling (per sqm)', 'Door lock replacement',
+    'Water tank installation', 'Borehole pump repair', 'Air conditioner servicing', 'Roof repair',
+    'Transport and logistics', 'Consultation fee', 'Annual maintenance contract', 'Labour (per day)',
+]
+FIRST_NAMES = ['Grace', 'Peter', 'Mary', 'John', 'Faith', 'James', 'Esther', 'David', 'Ann', 'Samuel']
+LAST_NAMES = ['Otieno', 'Kamau', 'Wanjiku', 'Mwangi', 'Achieng', 'Njoroge', 'Kiptoo', 'Mutua', 'Wambui', 'Omondi']
+COMPANY_SUFFIXES = ['Ltd', 'Enterprises', 'Holdings', 'Traders', 'Investments', 'Academy', 'Hospital']
+TOWNS = ['Nairobi', 'Mombasa', 'Kisumu', 'Nakuru', 'Eldoret', 'Thika', 'Machakos', 'Nyeri']
+QUOTE_STATUSES = (['Draft', 'Sent', 'Approved', 'Rejected'], [10, 30, 45, 15])
+CLIENT_FIELDS = ('client_id', 'client_name', 'client_email', 'client_address', 'client_phone_number')
+PAYMENT_METHODS = (['Bank Transfer', 'Mobile Money', 'Cash', 'Cheque', 'Other'], [45, 35, 10, 8, 2])
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic dataset of clients' quotations, items, invoices, receipts and "
+        "scanned-file records for load and scale testing. Rows are inserted with bulk_create in "
+        "chunks, bypassing the per-row save() recalculation; totals and payment statuses are then "
+        "rebuilt for each chunk with set-based UPDATEs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quotations', type=int, default=1000, help='Number of quotations to create.')
+        parser.add_argument('--standalone-invoices', type=int, default=0,
+                            help='Invoices to create without a quotation, in addition to converted ones.')
+        parser.add_argument('--items', default='1-8', help='Items per document as MIN-MAX (uniform).')
+        parser.add_argument('--invoice-ratio', type=float, default=0.7,
+                            help='Fraction of quotations converted to an invoice.')
+        parser.add_argument('--paid-ratio', type=float, default=0.6, help='Fraction of invoices paid in full.')
+        parser.add_argument('--partial-ratio', type=float, default=0.2,
+                            help='Fraction of invoices partially paid.')
+        parser.add_argument('--max-receipts', type=int, default=3, help='Maximum receipts per paid invoice.')
+        parser.add_argument('--scan-ratio', type=float, default=0.3,
+                            help='Fraction of invoices with a scanned-file record.')
+        parser.add_argument('--clients', type=int, default=500,
+                            help='Distinct clients; a few clients receive most documents (Zipf-like).')
+        parser.add_argument('--years', type=int, default=3, help='Spread document dates over this many years.')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Documents per transaction.')
+        parser.add_argument('--seed', type=int, help='Random seed for a reproducible dataset.')
+
+    def handle(self, *args, **options):
+        try:
+            low, high = (int(part) for part in options['items'].split('-'))
+        except ValueError:
+            raise CommandError("--items must look like MIN-MAX, e.g. 1-8")
+        if not 1 <= low <= high:
+            raise CommandError("--items needs 1 <= MIN <= MAX")
+
+        self.options = options
+        self.item_range = (low, high)
+        self.random = random.Random(options['seed'])
+        self.now = timezone.now()
+        self.clients = [self.make_client(n) for n in range(max(options['clients'], 1))]
+        self.link_clients()
+        self.client_weights = [1 / rank for rank in range(1, len(self.clients) + 1)]
+        self.sequence = (
+            max(Quotation.objects.aggregate(m=Max('id'))['m'] or 0, Invoice.objects.aggregate(m=Max('id'))['m'] or 0)
+            + 1
+        )
+        self.receipt_sequence = (Receipt.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+
+        # SQL debug logging would print every multi-thousand-row INSERT.
+        db_logger = logging.getLogger('django.db.backends')
+        previous_level = db_logger.level
+        db_logger.setLevel(logging.WARNING)
+        started = time.monotonic()
+        try:
+            self.totals = dict.fromkeys(('quotations', 'quotation items', 'invoices', 'invoice items',
+                                         'receipts', 'scans'), 0)
+            chunk = options['chunk_size']
+            for start in range(0, options['quotations'], chunk):
+                self.generate_chunk(min(chunk, options['quotations'] - start), standalone=False)
+            for start in range(0, options['standalone_invoices'], chunk):
+                self.generate_chunk(min(chunk, options['standalone_invoices'] - start), standalone=True)
+        finally:
+            db_logger.setLevel(previous_level)
+
+        elapsed = time.monotonic() - started
+        summary = ', '.join(f"{count} {name}" for name, count in self.totals.items())
+        self.stdout.write(self.style.SUCCESS(f"Created {summary} in {elapsed:.1f}s."))
+
+    def make_client(self, n):
+        first, last = self.random.choice(FIRST_NAMES), self.random.choice(LAST_NAMES)
+        if self.random.random() < 0.5:
+            name = f"{last} {self.random.choice(COMPANY_SUFFIXES)}"
+            email = f"accounts{n}@{last.lower()}.example.com"
+        else:
+            name = f"{first} {last}"
+            email = f"{first.lower()}.{last.lower()}{n}@example.com"
+        return {
+            'client_name': name,
+            'client_email': email,
+            'client_address': f"P.O. Box {self.random.randint(100, 99999)}, {self.random.choice(TOWNS)}",
+            'client_phone_number': f"07{self.random.randint(10000000, 99999999)}",
+        }
+
+    def link_clients(self):
+        """Create (or reuse, on a re-run) a Client row for each synthetic client."""
+        emails = [client['client_email'] for client in self.clients]
+        existing = dict(Client.objects.filter(email__in=emails).values_list('email', 'pk'))
+        Client.objects.bulk_create([
+            Client(name=client['client_name'], email=client['client_email'], address=client['client_address'],
+                   phone_number=client['client_phone_number'])
+            for client in self.clients if client['client_email'] not in existing
+        ])
+        existing.update(Client.objects.filter(email__in=emails).exclude(email__in=existing).values_list('email', 'pk'))
+        for client in self.clients:
+            client['client_id'] = existing[client['client_email']]
+
+    def pick_client(self):
+        return self.random.choices(self.clients, self.client_weights)[0]
+
+    def random_date(self):
+        return self.now - timedelta(days=self.random.uniform(0, 365 * self.options['years']))
+
+    def random_items(self):
+        for _ in range(self.random.randint(*self.item_range)):
+            price = Decimal(round(self.random.lognormvariate(8, 1.2), -1) or 10).quantize(Decimal('0.01'))
+            yield {
+                'description': self.random.choice(SERVICES),
+                'quantity': self.random.choices([1, 2, 3, 5, 10], [50, 20, 12, 10, 8])[0],
+                'unit_price': min(price, Decimal('500000.00')),
+            }
+
+    def next_number(self, prefix, date):
+        number = f"{prefix}-{date.year}-{self.sequence:07d}"
+        self.sequence += 1
+        return number
+
+    @transaction.atomic
+    def generate_chunk(self, count, standalone):
+        rng = self.random
+        if standalone:
+            quotations, quotation_items = [], {}
+        else:
+            quotations, quotation_items = self.create_quotations(count)
+
+        invoices, invoice_items = [], []
+        sources = [None] * count if standalone else [
+            quotation for quotation in quotations if rng.random() < self.options['invoice_ratio']
+        ]
+        for quotation in sources:
+            if quotation is not None:
+                client = {field: getattr(quotation, field) for field in CLIENT_FIELDS}
+                created = quotation.date_created + timedelta(days=rng.randint(0, 30))
+                items = quotation_items[quotation.pk]
+                tax_rate = quotation.tax_rate
+            else:
+                client, created = self.pick_client(), self.random_date()
+                items = list(self.random_items())
+                tax_rate = rng.choice([Decimal('0.00'), Decimal('16.00')])
+            invoice = Invoice(
+                invoice_number=self.next_number('INV', created), quotation=quotation,
+                date_created=created.date(), due_date=(created + timedelta(days=30)).date(),
+                tax_rate=tax_rate, **client,
+            )
+            invoices.append(invoice)
+            invoice_items.append(items)
+
+        Invoice.objects.bulk_create(invoices)
+        InvoiceItem.objects.bulk_create(
+            [InvoiceItem(invoice=invoice, **item) for invoice, items in zip(invoices, invoice_items) for item in items],
+            batch_size=5000,
+        )
+        if invoices:
+            invoice_range = Invoice.objects.filter(pk__range=(invoices[0].pk, invoices[-1].pk))
+            recalculate_invoice_totals(invoice_range)
+            self.create_receipts(invoice_range)
+            refresh_payment_status(invoice_range)
+            self.create_scans(invoices)
+
+        self.totals['invoices'] += len(invoices)
+        self.totals['invoice items'] += sum(len(items) for items in invoice_items)
+
+    def create_quotations(self, count):
+        rng = self.random
+        quotations, items_by_index = [], []
+        for _ in range(count):
+            created = self.random_date()
+            quotations.append(Quotation(
+                quote_number=self.next_number('QUOTE', created), date_created=created,
+                status=rng.choices(*QUOTE_STATUSES)[0], valid_until=(created + timedelta(days=30)).date(),
+                tax_rate=rng.choice([Decimal('0.00'), Decimal('16.00')]), **self.pick_client(),
+            ))
+            items_by_index.append(list(self.random_items()))
+
+        Quotation.objects.bulk_create(quotations)
+        QuotationItem.objects.bulk_create(
+            [QuotationItem(quotation=quotation, **item)
+             for quotation, items in zip(quotations, items_by_index) for item in items],
+            batch_size=5000,
+        )
+        recalculate_quotation_totals(Quotation.objects.filter(pk__range=(quotations[0].pk, quotations[-1].pk)))
+
+        self.totals['quotations'] += len(quotations)
+        self.totals['quotation items'] += sum(len(items) for items in items_by_index)
+        return quotations, {quotation.pk: items for quotation, items in zip(quotations, items_by_index)}
+
+    def create_receipts(self, invoices):
+        rng, options = self.random, self.options
+        receipts = []
+        for invoice_id, invoice_date, grand_total in invoices.values_list('pk', 'date_created', 'grand_total'):
+            roll = rng.random()
+            if grand_total <= 0 or roll >= options['paid_ratio'] + options['partial_ratio']:
+                continue
+            if roll < options['paid_ratio']:
+                to_pay = grand_total
+            else:
+                to_pay = (grand_total * Decimal(rng.uniform(0.1, 0.9))).quantize(Decimal('0.01'))
+            parts = rng.randint(1, max(options['max_receipts'], 1))
+            paid_on = invoice_date
+            for part in range(parts):
+                amount = to_pay if part == parts - 1 else (to_pay / parts).quantize(Decimal('0.01'))
+                if amount <= 0:
+                    continue
+                to_pay -= amount
+                paid_on = min(paid_on + timedelta(days=rng.randint(0, 20)), self.now.date())
+                receipts.append(Receipt(
+                    receipt_number=f"RCT-{paid_on.year}-{self.receipt_sequence:07d}", invoice_id=invoice_id,
+                    payment_date=paid_on, amount_paid=amount, payment_method=rng.choices(*PAYMENT_METHODS)[0],
+                ))
+                self.receipt_sequence += 1
+        Receipt.objects.bulk_create(receipts, batch_size=5000)
+        self.totals['receipts'] += len(receipts)
+
+    def create_scans(self, invoices):
+        scans = [
+            ScannedInvoice(invoice=invoice, scanned_file=f"scanned_invoices/synthetic/{invoice.invoice_number}.pdf")
+            for invoice in invoices if self.random.random() < self.options['scan_ratio']
+        ]
+        ScannedInvoice.objects.bulk_create(scans, batch_size=5000)
+        self.totals['scans'] += len(scans)
@@ -0,0 +1,37 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from management.services.recurring_service import DEFAULT_BATCH_SIZE, due_contracts, generate_due_invoices
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the invoices of every recurring invoice period that has started by --date "
+        "(default today), --batch-size contracts per transaction. Safe to rerun after a failure: "
+        "a period is never invoiced twice. Run it daily from cron. See "
+        "management/services/recurring_service.py."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Run as of this date (YYYY-MM-DD).')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Contracts per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the contracts due.')
+
+    def handle(self, *args, **options):
+        try:
+            run_date = date.fromisoformat(options['date']) if options['date'] else None
+        except ValueError:
+            raise CommandError("--date must be YYYY-MM-DD.")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        if options['dry_run']:
+            self.stdout.write(f"{due_contracts(run_date or timezone.localdate()).count()} contracts due.")
+            return
+        result = generate_due_invoices(run_date, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {result.invoices} invoices with {result.items} items "
+            f"from {result.contracts} contract periods in {result.batches} batches."
+        ))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from management.partitioning import PARTITIONED, create_year_index, drop_year_index, existing_years, index_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the per-year partial indexes on invoices and receipts for the current and "
+        "upcoming years, and drop those for years older than --keep. Run it yearly (or from "
+        "cron) ahead of the new year. See management/partitioning.py."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=1, help='Future years to prepare.')
+        parser.add_argument('--keep', type=int, default=5,
+                            help='Years, counting the current one, whose indexes are kept.')
+        parser.add_argument('--since', type=int, help='Also create indexes back to this year.')
+        parser.add_argument('--dry-run', action='store_true', help='Only print what would change.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Year partitions need PostgreSQL partial indexes.")
+        if options['keep'] < 1:
+            raise CommandError("--keep must be at least 1.")
+
+        current = timezone.now().year
+        oldest_kept = current - options['keep'] + 1
+        wanted = range(max(options['since'] or current, oldest_kept), current + options['ahead'] + 1)
+        for name in PARTITIONED:
+            existing = set(existing_years(name))
+            for year in wanted:
+                if year not in existing:
+                    self.apply(f"create {index_name(name, year)}", create_year_index, name, year, options)
+            for year in sorted(existing):
+                if year < oldest_kept:
+                    self.apply(f"drop {index_name(name, year)}", drop_year_index, name, year, options)
+        self.stdout.write(self.style.SUCCESS(f"Year indexes cover {wanted.start}-{wanted.stop - 1}."))
+
+    def apply(self, description, action, name, year, options):
+        self.stdout.write(f"{'Would ' if options['dry_run'] else ''}{description}")
+        if not options['dry_run']:
+            action(name, year)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from management import outbox
+from management.models import ChangeEvent, OutboxCursor
+
+
+class Command(BaseCommand):
+    help = (
+        "Show each change event consumer's position and how many events it has still to read. "
+        "--prune deletes the events every consumer has read; --reset CONSUMER removes a "
+        "consumer's cursor so it replays the outbox from the oldest event kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prune', action='store_true', help='Delete events all consumers have read.')
+        parser.add_argument('--reset', metavar='CONSUMER', help="Forget a consumer's position.")
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            deleted, _ = OutboxCursor.objects.filter(consumer=options['reset']).delete()
+            if not deleted:
+                raise CommandError(f"No consumer named {options['reset']!r}.")
+            self.stdout.write(f"Reset {options['reset']}.")
+        if options['prune']:
+            self.stdout.write(f"Pruned {outbox.prune()} events.")
+
+        self.stdout.write(f"{ChangeEvent.objects.count()} events kept.")
+        for cursor in OutboxCursor.objects.order_by('consumer'):
+            self.stdout.write(
+                f"{cursor.consumer}: {outbox.lag(cursor)} unread, last read {cursor.date_updated:%Y-%m-%d %H:%M}"
+            )
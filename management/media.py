@@ -0,0 +1,171 @@
+"""Permission-checked delivery of uploaded media (scans, stamped invoices, previews).
+
+Every ``MEDIA_URL`` request goes through ``serve_media``, which checks the
+user may view invoices, answers conditional requests (ETag/Last-Modified)
+itself and then either
+
+* hands the transfer to the front server when ``settings.MEDIA_ACCEL`` is
+  ``'nginx'`` (``X-Accel-Redirect`` to the internal location
+  ``settings.MEDIA_ACCEL_PREFIX``) or ``'apache'``/``'lighttpd'``
+  (``X-Sendfile``), which then also handles Range requests; or
+* streams the file with ``FileResponse``. Range requests are answered with
+  ``206 Partial Content`` through ``RangeFile``, which keeps ``fileno()`` so
+  servers with a sendfile-capable ``wsgi.file_wrapper`` (gunicorn, uWSGI)
+  still avoid copying the bytes through Python.
+
+Example nginx location for the accelerated mode::
+
+    location /protected-media/ {
+        internal;
+        alias /path/to/media/;
+    }
+"""
+import hashlib
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.core.exceptions import PermissionDenied, SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from .query_budget import query_budget
+
+MEDIA_PERMISSIONS = ('management.view_invoice', 'management.view_scannedinvoice')
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFile:
+    """A file limited to ``length`` bytes from ``start``, for ranged FileResponses.
+
+    ``read`` never goes past the range; ``fileno`` and the current offset are
+    left in place so sendfile-based file wrappers (which honour the response's
+    Content-Length) can send the range straight from the page cache.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def can_view_media(user):
+    return user.is_active and (user.is_staff or any(user.has_perm(perm) for perm in MEDIA_PERMISSIONS))
+
+
+def parse_range(header, size):
+    """Return ``(start, end)`` (inclusive) for a single-range header, or None to send everything.
+
+    Raises ValueError for ranges that cannot be satisfied.
+    """
+    match = _RANGE.match(header.strip()) if header else None
+    if match is None or size == 0:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:  # Suffix range: the last N bytes
+        if int(last) == 0:
+            raise ValueError(header)
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+@query_budget(5)
+@require_safe
+def serve_media(request, name):
+    if not request.user.is_authenticated:
+        return redirect_to_login(request.get_full_path(), reverse('admin:login'))
+    if not can_view_media(request.user):
+        raise PermissionDenied
+
+    try:
+        path = default_storage.path(name)
+        stat = os.stat(path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404("No such file")
+    if not os.path.isfile(path):
+        raise Http404("No such file")
+
+    last_modified = int(stat.st_mtime)
+    etag = '"%s"' % hashlib.md5(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        # A 304 carries the same validators and caching as the response it stands for.
+        not_modified['ETag'] = etag
+        not_modified['Last-Modified'] = http_date(last_modified)
+        not_modified['Cache-Control'] = 'private, max-age=3600'
+        return not_modified
+
+    content_type, encoding = mimetypes.guess_type(path)
+    accel = getattr(settings, 'MEDIA_ACCEL', '')
+    if accel:
+        response = HttpResponse(content_type=content_type or 'application/octet-stream')
+        if accel == 'nginx':
+            prefix = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+            response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(name)
+        else:
+            response['X-Sendfile'] = path
+    else:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{stat.st_size}"
+            return response
+        if byte_range is not None and not _if_range_matches(request, etag, last_modified):
+            byte_range = None
+
+        file = open(path, 'rb')
+        if byte_range is None:
+            response = FileResponse(file, content_type=content_type)
+        else:
+            start, end = byte_range
+            response = FileResponse(RangeFile(file, start, end - start + 1),
+                                    content_type=content_type or 'application/octet-stream', status=206)
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Range'] = f"bytes {start}-{end}/{stat.st_size}"
+        if encoding:
+            response['Content-Encoding'] = encoding
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, max-age=3600'
+    response['X-Content-Type-Options'] = 'nosniff'
+    return response
@@ -0,0 +1,127 @@
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+
+from .models import ConcurrentUpdateError
+
+from .profiling import aprofile_request, profile_request, requested_mode
+from .query_budget import budget_for_view, record_queries
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetMiddleware:
+    """Count queries and DB time per request and flag views over budget.
+
+    The budget comes from the view (see ``management.query_budget``) or
+    falls back to ``settings.QUERY_BUDGET_DEFAULT``. Works in sync and async
+    middleware chains, so it does not push async views onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.default_budget = getattr(settings, 'QUERY_BUDGET_DEFAULT', None)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with record_queries() as recorder:
+            response = self.get_response(request)
+        return self.report(request, response, recorder)
+
+    async def __acall__(self, request):
+        # Connections are per thread and async views query through sync_to_async,
+        # i.e. on the request's thread-sensitive worker: record on that thread.
+        queries = record_queries()
+        recorder = await sync_to_async(queries.__enter__)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(queries.__exit__)(None, None, None)
+        return self.report(request, response, recorder)
+
+    def report(self, request, response, recorder):
+        budget = getattr(request, '_query_budget', self.default_budget)
+        logger.debug("%s %s: %s", request.method, request.path, recorder.summary())
+        if budget is not None and recorder.count > budget:
+            logger.warning(
+                "Query budget exceeded on %s %s (view %s, budget %s): %s",
+                request.method, request.path, getattr(request, '_query_budget_view', '?'),
+                budget, recorder.summary(),
+            )
+        if settings.DEBUG:
+            response['X-DB-Queries'] = str(recorder.count)
+            response['X-DB-Time-Ms'] = f"{recorder.duration * 1000:.1f}"
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = budget_for_view(view_func, self.default_budget)
+        request._query_budget_view = getattr(view_func, '__qualname__', repr(view_func))
+        return None
+
+
+class ProfilingMiddleware:
+    """Profile requests asked for by staff (``?profile=1``) or picked by sampling.
+
+    Must come after AuthenticationMiddleware. See ``management.profiling``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        mode = requested_mode(request)
+        if mode is None:
+            return self.get_response(request)
+        return profile_request(request, self.get_response, mode)
+
+    async def __acall__(self, request):
+        # ?profile= checks request.user, which may load it from the database.
+        if 'profile' in request.GET:
+            mode = await sync_to_async(requested_mode)(request)
+        else:
+            mode = requested_mode(request)
+        if mode is None:
+            return await self.get_response(request)
+        return await aprofile_request(request, self.get_response, mode)
+
+
+class ConcurrentUpdateMiddleware:
+    """Answer a ``ConcurrentUpdateError`` a view did not handle with 409 Conflict.
+
+    Form views turn conflicts into form errors themselves; this covers the
+    JSON endpoints, whose clients should re-read the document (the response
+    carries the stale version) and retry.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        return self.get_response(request)  # A coroutine in async chains, awaited by the caller
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, ConcurrentUpdateError):
+            return None
+        return JsonResponse({
+            'error': str(exception),
+            'model': exception.model._meta.model_name,
+            'id': exception.pk,
+            'version': exception.version,
+        }, status=409)
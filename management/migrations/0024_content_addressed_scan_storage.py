@@ -0,0 +1,34 @@
+# Generated by Django 5.1.2 on 2026-10-19 18:26
+
+import management.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0023_alter_scannedinvoice_scanned_file'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='stamped_invoice',
+            field=models.FileField(blank=True, null=True, storage=management.storage.get_scan_storage, upload_to='scanned_invoices/'),
+        ),
+        migrations.AlterField(
+            model_name='scannedinvoice',
+            name='scanned_file',
+            field=models.FileField(storage=management.storage.get_scan_storage, upload_to='scanned_invoices/'),
+        ),
+    ]
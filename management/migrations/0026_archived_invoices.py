@@ -0,0 +1,26 @@
+# Generated by Django 5.1.2 on 2026-10-19 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0025_quotation_revisions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedInvoice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('invoice_id', models.IntegerField(unique=True)),
+                ('invoice_number', models.CharField(max_length=20, unique=True)),
+                ('client_name', models.CharField(blank=True, max_length=100, null=True)),
+                ('date_created', models.DateField()),
+                ('grand_total', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('segment', models.CharField(max_length=255)),
+                ('date_archived', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
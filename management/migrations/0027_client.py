@@ -0,0 +1,39 @@
+# Generated by Django 5.1.2 on 2026-10-19 20:10
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0026_archived_invoices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Client',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('email', models.EmailField(blank=True, db_index=True, max_length=254)),
+                ('address', models.TextField(blank=True)),
+                ('phone_number', models.CharField(blank=True, max_length=15)),
+                ('date_created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['name'], name='client_name_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='client',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='invoices', to='management.client'),
+        ),
+        migrations.AddField(
+            model_name='quotation',
+            name='client',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='quotations', to='management.client'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.1.2 on 2026-10-19 20:12
+
+from django.db import migrations
+from django.db.models import OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Lower, Trim
+
+BATCH_SIZE = 2000
+NAME_LENGTH = 100  # Client.name max_length: a bare email can be longer
+
+
+def client_key(name, email, phone_number):
+    """Same matching rule as Client.for_details: email, else name and phone."""
+    email = (email or '').strip().lower()
+    if email:
+        return ('email', email)
+    if name:
+        return ('name', name.strip(), phone_number or '')
+    return None
+
+
+def deduplicate_clients(apps, schema_editor):
+    Client = apps.get_model('management', 'Client')
+    Quotation = apps.get_model('management', 'Quotation')
+    Invoice = apps.get_model('management', 'Invoice')
+    fields = ('client_name', 'client_email', 'client_address', 'client_phone_number')
+
+    # Oldest documents first, so the newest address and phone win.
+    details = {}
+    for model in (Quotation, Invoice):
+        for name, email, address, phone in model.objects.order_by('date_created', 'pk').values_list(*fields).iterator():
+            key = client_key(name, email, phone)
+            if key is not None:
+                details[key] = Client(name=(name or email).strip()[:NAME_LENGTH], email=(email or '').strip().lower(),
+                                      address=address or '', phone_number=phone or '')
+    Client.objects.bulk_create(details.values(), batch_size=BATCH_SIZE)
+
+    # Link documents with one UPDATE per matching rule and table.
+    by_email = Client.objects.filter(email=Lower(Trim(OuterRef('client_email')))).order_by('pk').values('pk')[:1]
+    by_name = Client.objects.filter(
+        email='', name=Trim(OuterRef('client_name')), phone_number=Coalesce(OuterRef('client_phone_number'), Value('')),
+    ).order_by('pk').values('pk')[:1]
+    no_email = Q(client_email__isnull=True) | Q(client_email='')
+    for documents in (Quotation.objects.all(), Invoice.objects.filter(quotation__isnull=True)):
+        documents.exclude(no_email).update(client=Subquery(by_email))
+        documents.filter(no_email).update(client=Subquery(by_name))
+    # Invoices raised from a quotation belong to the quotation's client.
+    Invoice.objects.filter(quotation__isnull=False).update(
+        client=Subquery(Quotation.objects.filter(pk=OuterRef('quotation_id')).values('client_id')[:1])
+    )
+
+
+def unlink_clients(apps, schema_editor):
+    apps.get_model('management', 'Quotation').objects.update(client=None)
+    apps.get_model('management', 'Invoice').objects.update(client=None)
+    apps.get_model('management', 'Client').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0027_client'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_clients, unlink_clients),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0029_catalog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='quotation',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
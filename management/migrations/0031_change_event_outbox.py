@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:50
+
+import django.utils.timezone
+import management.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0030_version_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('consumer', models.CharField(max_length=100, unique=True)),
+                ('transaction_id', models.BigIntegerField(default=0)),
+                ('event_id', models.BigIntegerField(default=0)),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChangeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_id', models.BigIntegerField(db_default=management.models.CurrentTransactionId())),
+                ('model', models.CharField(max_length=50)),
+                ('object_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted')], max_length=10)),
+                ('data', models.JSONField(default=dict)),
+                ('date_created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['transaction_id', 'id'],
+                'indexes': [models.Index(fields=['transaction_id', 'id'], name='changeevent_position_idx')],
+            },
+        ),
+    ]
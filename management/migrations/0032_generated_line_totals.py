@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:04
+
+import django.db.models.expressions
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0031_change_event_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quotationitem',
+            name='line_total',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(models.F('quantity'), '*', models.F('unit_price')), output_field=models.DecimalField(decimal_places=2, max_digits=10), verbose_name='Line Total'),
+        ),
+        # A column cannot be altered into a generated one: drop it and add it back,
+        # which also recomputes every stored line total.
+        migrations.RemoveField(
+            model_name='invoiceitem',
+            name='total_price',
+        ),
+        migrations.AddField(
+            model_name='invoiceitem',
+            name='total_price',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(models.F('quantity'), '*', models.F('unit_price')), output_field=models.DecimalField(decimal_places=2, max_digits=10)),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:10
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0032_generated_line_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecurringInvoiceItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('description', models.CharField(max_length=255)),
+                ('quantity', models.PositiveIntegerField()),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='period',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='RecurringInvoice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('interval_months', models.PositiveSmallIntegerField(default=1)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField(blank=True, null=True)),
+                ('next_period', models.DateField(blank=True)),
+                ('payment_terms_days', models.PositiveSmallIntegerField(default=30)),
+                ('tax_rate', models.DecimalField(decimal_places=2, default=0.0, max_digits=5)),
+                ('labour_cost', models.DecimalField(decimal_places=2, default=0.0, max_digits=10)),
+                ('is_active', models.BooleanField(default=True)),
+                ('date_created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='recurring_invoices', to='management.client')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='recurring',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invoices', to='management.recurringinvoice'),
+        ),
+        migrations.AddConstraint(
+            model_name='invoice',
+            constraint=models.UniqueConstraint(fields=('recurring', 'period'), name='unique_recurring_invoice_period'),
+        ),
+        migrations.AddField(
+            model_name='recurringinvoiceitem',
+            name='catalog_item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='recurring_items', to='management.catalogitem'),
+        ),
+        migrations.AddField(
+            model_name='recurringinvoiceitem',
+            name='recurring',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='management.recurringinvoice'),
+        ),
+        migrations.AddIndex(
+            model_name='recurringinvoice',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['next_period'], name='recurring_invoice_due_idx'),
+        ),
+    ]
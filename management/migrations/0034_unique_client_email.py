@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 21:40
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_emails(apps, schema_editor):
+    """Point documents at the oldest client for each email and drop the others."""
+    Client = apps.get_model('management', 'Client')
+    duplicated = (Client.objects.exclude(email='').values('email')
+                  .annotate(count=Count('pk'), keep=Min('pk')).filter(count__gt=1))
+    for row in duplicated:
+        others = Client.objects.filter(email=row['email']).exclude(pk=row['keep'])
+        for relation in Client._meta.related_objects:
+            relation.related_model.objects.filter(**{f'{relation.field.name}__in': others}).update(
+                **{relation.field.name: row['keep']})
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0033_recurring_invoices'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_emails, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='client',
+            constraint=models.UniqueConstraint(condition=models.Q(('email', ''), _negated=True), fields=('email',), name='unique_client_email'),
+        ),
+    ]
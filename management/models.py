@@ -1,17 +1,138 @@
+from django.conf import settings
 from django.db import models
 from decimal import Decimal, ROUND_HALF_UP
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
-from django.db import transaction
+from django.db import connections, router, transaction
 import logging
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_delete, post_init
 from django.dispatch import receiver
+from .profiling import timed_span
+from .storage import get_scan_storage, release_blob
+from .derivatives import derivative_url, queue_derivatives
 
 
 logger = logging.getLogger(__name__)
 
-class Quotation(models.Model):
+
+class ConcurrentUpdateError(Exception):
+    """Saving a row that someone else changed after it was loaded."""
+
+    def __init__(self, instance):
+        self.model = type(instance)
+        self.pk = instance.pk
+        self.version = instance.version
+        super().__init__(
+            f"{self.model._meta.verbose_name.capitalize()} {self.pk} was changed by someone else "
+            f"since version {self.version} was loaded."
+        )
+
+
+class VersionedModel(models.Model):
+    """Optimistic concurrency control through a ``version`` column.
+
+    Every UPDATE issued by ``save()`` carries ``WHERE version = <loaded
+    version>`` and sets ``version = version + 1``; when no row matches, the
+    row has moved on and ``ConcurrentUpdateError`` is raised instead of
+    overwriting the other edit. No lock is held between loading and saving.
+    Saves limited to ``update_fields`` without ``version`` (derived columns
+    such as the payment status) still bump the version but are not checked.
+    Set-based writers bump it too, so the version changes whenever the row
+    does (list pages cache rendered rows by it).
+    """
+    version = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        abstract = True
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        field = self._meta.get_field('version')
+        values = [value for value in values if value[0] is not field]
+        values.append((field, None, models.F('version') + 1))
+        checked = update_fields is None or 'version' in update_fields
+        if checked:
+            base_qs = base_qs.filter(version=self.version)
+        if super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update):
+            self.version += 1
+            return True
+        if checked and base_qs.model._base_manager.using(using).filter(pk=pk_val).exists():
+            raise ConcurrentUpdateError(self)
+        return False
+
+
+def lock_numbering(model, series):
+    """Hold ``series``' numbering until the current transaction ends.
+
+    Numbers follow the last one issued, so concurrent transactions would
+    pick the same block: a transaction-scoped advisory lock makes the next
+    one wait until this one commits and then read past its rows.
+    """
+    connection = connections[router.db_for_write(model)]
+    if connection.vendor == 'postgresql' and connection.in_atomic_block:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [series])
+
+
+class Client(models.Model):
+    """A customer. Documents link here and keep a snapshot of the details they were issued with."""
+    name = models.CharField(max_length=100)
+    email = models.EmailField(blank=True, db_index=True)  # Stored lower-cased
+    address = models.TextField(blank=True)
+    phone_number = models.CharField(max_length=15, blank=True)
+    date_created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['name'], name='client_name_idx')]
+        constraints = [
+            models.UniqueConstraint(fields=['email'], condition=~models.Q(email=''), name='unique_client_email'),
+        ]
+
+    @staticmethod
+    def normalise_email(email):
+        return (email or '').strip().lower()
+
+    @classmethod
+    def for_details(cls, name, email, address=None, phone_number=None):
+        """The client with this email (or, without one, this name and phone), created if new."""
+        email = cls.normalise_email(email)
+        if not (email or name):
+            return None
+        details = {'name': (name or email).strip()[:cls._meta.get_field('name').max_length],
+                   'address': address or '', 'phone_number': phone_number or ''}
+        if email:
+            # get_or_create retries the lookup when a concurrent first save wins the unique email.
+            return cls.objects.get_or_create(email=email, defaults=details)[0]
+        client = cls.objects.filter(
+            email='', name=details['name'], phone_number=details['phone_number'],
+        ).order_by('pk').first()
+        return client or cls.objects.create(email='', **details)
+
+    def save(self, *args, **kwargs):
+        self.email = self.normalise_email(self.email)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.name
+
+
+class CatalogItem(models.Model):
+    """A product or service we sell, offered as a suggestion when writing quotations."""
+    name = models.CharField(max_length=255, unique=True)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    is_active = models.BooleanField(default=True)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+class Quotation(VersionedModel):
+    client = models.ForeignKey(Client, on_delete=models.PROTECT, null=True, blank=True, related_name='quotations')
+    # Snapshot of the client's details as printed on this quotation
     client_name = models.CharField(max_length=100, blank=False, null=False)
     client_email = models.EmailField(blank=False, null=False)
     client_address = models.TextField(blank=False, null=False)
@@ -39,7 +160,7 @@ class Quotation(models.Model):
 
     def calculate_totals(self):
         """Calculate subtotal, tax, and grand total without triggering infinite recursion."""
-        self.subtotal = sum(item.total_price() for item in self.items.all())
+        self.subtotal = self.items.aggregate(subtotal=models.Sum('line_total'))['subtotal'] or Decimal('0.00')
         self.labour_cost = self.subtotal * Decimal('0.30')
 
         # Ensure tax_rate is Decimal for compatibility in calculations
@@ -67,19 +188,25 @@ class Quotation(models.Model):
         if not self.client_phone_number:
             raise ValidationError("Client phone number is required.")
 
+    @timed_span('Quotation.save')
     def save(self, *args, **kwargs):
-        # Check if this is a new entry without an assigned `quote_number`
-        if not self.pk:  # Only generate if this is a new instance
-            self.quote_number = self.generate_unique_quote_number()
-        
-        self.clean()
+        # One transaction for the row and its change events (see outbox.py).
+        with transaction.atomic():
+            if self.client_id is None:
+                self.client = Client.for_details(self.client_name, self.client_email,
+                                                 self.client_address, self.client_phone_number)
+            # Check if this is a new entry without an assigned `quote_number`
+            if not self.pk:  # Only generate if this is a new instance
+                self.quote_number = self.generate_unique_quote_number()
 
-        if self.pk is None:  # This is a new instance
-            super().save(*args, **kwargs)  # Save without update_fields
+            self.clean()
 
-        self.calculate_totals()
+            if self.pk is None:  # This is a new instance
+                super().save(*args, **kwargs)  # Save without update_fields
 
-        super().save(*args, **kwargs)
+            self.calculate_totals()
+
+            super().save(*args, **kwargs)
 
     def generate_unique_quote_number(self):
         current_year = timezone.now().year
@@ -116,33 +243,102 @@ class Quotation(models.Model):
 
 class QuotationItem(models.Model):
     quotation = models.ForeignKey(Quotation, on_delete=models.CASCADE, related_name="items")  # Link to the related quotation
+    catalog_item = models.ForeignKey(CatalogItem, on_delete=models.SET_NULL, null=True, blank=True, related_name='quotation_items')
     description = models.CharField(max_length=255)   # Description of the item
     quantity = models.IntegerField()                 # Quantity of the item
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)  # Price per unit
+    # Computed by the database, so bulk writes and UPDATEs cannot leave it stale.
+    line_total = models.GeneratedField(
+        expression=models.F('quantity') * models.F('unit_price'),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        db_persist=True,
+        verbose_name='Line Total',
+    )
+
+    TOTAL_FIELDS = ('subtotal', 'labour_cost', 'total_tax', 'grand_total', 'version')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What this row contributed to its quotation's subtotal when loaded.
+        instance._loaded = (instance.quotation_id, instance.total_price())
+        return instance
 
     def total_price(self):
+        """The line total of the values in memory (``line_total`` is only refreshed from the database)."""
         if self.quantity is not None and self.unit_price is not None:
             return self.quantity * self.unit_price
         return 0
+
+    def _stored_contribution(self):
+        if self._state.adding:
+            return None
+        if hasattr(self, '_loaded'):
+            return self._loaded
+        row = QuotationItem.objects.filter(pk=self.pk).values_list('quotation_id', 'quantity', 'unit_price').first()
+        return (row[0], row[1] * row[2]) if row else None
+
+    def _apply_delta(self, quotation_id, delta):
+        from .services.quotation_service import apply_item_delta
+
+        if delta:
+            apply_item_delta(quotation_id, delta)
+            # Keep an in-memory parent in step without re-reading its items.
+            cached = QuotationItem.quotation.field.get_cached_value(self, None)
+            if cached is not None and cached.pk == quotation_id:
+                cached.refresh_from_db(fields=self.TOTAL_FIELDS)
+
     def save(self, *args, **kwargs):
-        # Save the QuotationItem and trigger recalculation on the parent Quotation
-        super().save(*args, **kwargs)
-        self.quotation.calculate_totals()
-        self.quotation.save()
+        # Adjust the parent Quotation by this item's change: O(1) in the number of items.
+        with transaction.atomic():
+            previous = self._stored_contribution()
+            super().save(*args, **kwargs)
+            if previous is not None and previous[0] != self.quotation_id:
+                self._apply_delta(previous[0], -previous[1])
+                previous = None
+            self._apply_delta(self.quotation_id, self.total_price() - (previous[1] if previous else 0))
+        self._loaded = (self.quotation_id, self.total_price())
 
     def delete(self, *args, **kwargs):
-        # Delete the item and trigger recalculation on the parent Quotation
-        super().delete(*args, **kwargs)
-        self.quotation.calculate_totals()
-        self.quotation.save()
+        with transaction.atomic():
+            previous = self._stored_contribution()
+            result = super().delete(*args, **kwargs)
+            if previous is not None:
+                self._apply_delta(previous[0], -previous[1])
+        return result
 
     def __str__(self):
         return f"{self.description} (x{self.quantity})"
 
-class Invoice(models.Model):
+
+class QuotationRevision(models.Model):
+    """One recorded version of a quotation (see services/revision_service.py).
+
+    ``data`` holds either a full snapshot of the header fields and items or,
+    for most revisions, only what changed since the previous revision.
+    """
+    quotation = models.ForeignKey(Quotation, on_delete=models.CASCADE, related_name='revisions')
+    number = models.PositiveIntegerField()
+    is_snapshot = models.BooleanField(default=False)
+    data = models.JSONField()
+    date_created = models.DateTimeField(default=timezone.now)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    note = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        ordering = ['quotation', 'number']
+        constraints = [
+            models.UniqueConstraint(fields=['quotation', 'number'], name='unique_quotation_revision_number'),
+        ]
+
+    def __str__(self):
+        return f"{self.quotation.quote_number} revision {self.number}"
+
+class Invoice(VersionedModel):
     # Fields for Invoice model
     invoice_number = models.CharField(max_length=20, unique=True)
     quotation = models.ForeignKey('Quotation', on_delete=models.CASCADE, null=True, blank=True)
+    client = models.ForeignKey(Client, on_delete=models.PROTECT, null=True, blank=True, related_name='invoices')
     date_created = models.DateField(default=timezone.now)
     due_date = models.DateField(null=True, blank=True)
     client_name = models.CharField(max_length=100, blank=True, null=True)
@@ -166,7 +362,24 @@ class Invoice(models.Model):
         ],
         default='Draft'
     )
-    stamped_invoice = models.FileField(upload_to='scanned_invoices/', null=True, blank=True)
+    stamped_invoice = models.FileField(upload_to='scanned_invoices/', storage=get_scan_storage, null=True, blank=True)
+    # Set on invoices generated from a recurring invoice, for the period they bill.
+    recurring = models.ForeignKey('RecurringInvoice', on_delete=models.SET_NULL, null=True, blank=True,
+                                  related_name='invoices')
+    period = models.DateField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # Makes generation idempotent: a period can only ever be invoiced once.
+            models.UniqueConstraint(fields=['recurring', 'period'], name='unique_recurring_invoice_period'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The client when loaded: moving the invoice changes two clients' statements.
+        instance._loaded_client_id = instance.__dict__.get('client_id')
+        return instance
 
     def calculate_outstanding_balance(self):
         """Calculate the outstanding balance of the invoice."""
@@ -186,6 +399,14 @@ class Invoice(models.Model):
             if save_instance:
                 super().save(update_fields=['status'])
     
+    @property
+    def stamped_thumbnail_url(self):
+        return derivative_url(self.stamped_invoice.name, 'thumbnail')
+
+    @property
+    def stamped_preview_url(self):
+        return derivative_url(self.stamped_invoice.name, 'preview')
+
     def get_balance(self):
         """Calculate the balance for the invoice."""
         outstanding_balance = self.calculate_outstanding_balance()
@@ -206,25 +427,32 @@ class Invoice(models.Model):
         self.grand_total = subtotal + labour_cost + self.total_tax
         
 
+    @timed_span('Invoice.save')
     def save(self, *args, **kwargs):
         is_new_invoice = self.pk is None
 
-        if not self.invoice_number:
-            self.invoice_number = self.generate_unique_invoice_number()
-        
-        if is_new_invoice:
-            super().save(*args, **kwargs)
+        # One transaction for the row, its items and its change events (see outbox.py).
+        with transaction.atomic():
+            if not self.invoice_number:
+                self.invoice_number = self.generate_unique_invoice_number()
+            if self.client_id is None and not self.quotation_id and (self.client_name or self.client_email):
+                self.client = Client.for_details(self.client_name, self.client_email,
+                                                 self.client_address, self.client_phone_number)
 
-        if self.quotation:
-            self._populate_from_quotation(is_new_invoice)
-        else:
-            self.calculate_totals()
+            if is_new_invoice:
+                super().save(*args, **kwargs)
 
-        super().save(*args, **kwargs)
-        self.update_payment_status(save_instance=True)
+            if self.quotation:
+                self._populate_from_quotation(is_new_invoice)
+            else:
+                self.calculate_totals()
+
+            super().save(*args, **kwargs)
+            self.update_payment_status(save_instance=True)
 
     def _populate_from_quotation(self, is_new_invoice):
         """Populate invoice fields from the linked quotation."""
+        self.client_id = self.quotation.client_id
         self.client_name = self.quotation.client_name
         self.client_email = self.quotation.client_email
         self.client_address = self.quotation.client_address
@@ -239,18 +467,24 @@ class Invoice(models.Model):
             for item in self.quotation.items.all():
                 InvoiceItem.objects.create(
                     invoice=self,
+                    catalog_item_id=item.catalog_item_id,
                     description=item.description,
                     quantity=item.quantity,
                     unit_price=item.unit_price,
-                    total_price=item.total_price
                 )
 
     def generate_unique_invoice_number(self):
         """Generate a unique invoice number."""
+        return self.next_invoice_numbers(1)[0]
+
+    @classmethod
+    def next_invoice_numbers(cls, count):
+        """The next ``count`` invoice numbers of the year, for invoices created together."""
         current_year = timezone.now().year
+        lock_numbering(cls, f"INV-{current_year}")
         last_invoice = Invoice.objects.filter(invoice_number__startswith=f"INV-{current_year}-").last()
-        new_sequence_number = 1 if not last_invoice else int(last_invoice.invoice_number.split('-')[-1]) + 1
-        return f"INV-{current_year}-{new_sequence_number:03d}"
+        first = 1 if not last_invoice else int(last_invoice.invoice_number.split('-')[-1]) + 1
+        return [f"INV-{current_year}-{number:03d}" for number in range(first, first + count)]
 
     def __str__(self):
         return f"Invoice {self.invoice_number} for {self.client_name}"
@@ -258,35 +492,200 @@ class Invoice(models.Model):
 
 class InvoiceItem(models.Model):
     invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='items')
+    catalog_item = models.ForeignKey(CatalogItem, on_delete=models.SET_NULL, null=True, blank=True, related_name='invoice_items')
     description = models.CharField(max_length=255)
     quantity = models.PositiveIntegerField()
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
-    total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    total_price = models.GeneratedField(
+        expression=models.F('quantity') * models.F('unit_price'),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        db_persist=True,
+    )
+
+    TOTAL_FIELDS = ('subtotal', 'total_tax', 'grand_total', 'status', 'version')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded = (instance.invoice_id, instance.total_price)
+        return instance
+
+    def _stored_contribution(self):
+        if self._state.adding:
+            return None
+        if hasattr(self, '_loaded'):
+            return self._loaded
+        return InvoiceItem.objects.filter(pk=self.pk).values_list('invoice_id', 'total_price').first()
+
+    def _apply_delta(self, invoice_id, delta):
+        from .services.invoice_service import apply_item_delta
+
+        if delta and apply_item_delta(invoice_id, delta):
+            cached = InvoiceItem.invoice.field.get_cached_value(self, None)
+            if cached is not None and cached.pk == invoice_id:
+                cached.refresh_from_db(fields=self.TOTAL_FIELDS)
 
     def save(self, *args, **kwargs):
+        # Standalone invoices are adjusted by this item's change (see QuotationItem.save).
+        # The column is generated; this only keeps the instance in step without a re-read.
         self.total_price = self.quantity * self.unit_price
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            previous = self._stored_contribution()
+            super().save(*args, **kwargs)
+            if previous is not None and previous[0] != self.invoice_id:
+                self._apply_delta(previous[0], -previous[1])
+                previous = None
+            self._apply_delta(self.invoice_id, self.total_price - (previous[1] if previous else 0))
+        self._loaded = (self.invoice_id, self.total_price)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = self._stored_contribution()
+            result = super().delete(*args, **kwargs)
+            if previous is not None:
+                self._apply_delta(previous[0], -previous[1])
+        return result
 
     def __str__(self):
         return self.description
 
 
-@receiver(post_save, sender=InvoiceItem)
-def update_invoice_totals(sender, instance, **kwargs):
-    """Update the invoice totals after saving an InvoiceItem."""
-    invoice = instance.invoice
-    invoice.calculate_totals()
-    invoice.save()
+class RecurringInvoice(models.Model):
+    """A contract billed every ``interval_months`` (see services/recurring_service.py).
+
+    ``next_period`` is the start of the next period to invoice; periods fall
+    on ``start_date``'s day of the month (the last day in shorter months).
+    """
+    client = models.ForeignKey(Client, on_delete=models.PROTECT, related_name='recurring_invoices')
+    description = models.CharField(max_length=255, blank=True)
+    interval_months = models.PositiveSmallIntegerField(default=1)
+    start_date = models.DateField()
+    end_date = models.DateField(null=True, blank=True)  # Last period start to invoice
+    next_period = models.DateField(blank=True)  # Defaults to start_date
+    payment_terms_days = models.PositiveSmallIntegerField(default=30)
+    tax_rate = models.DecimalField(max_digits=5, decimal_places=2, default=0.00)
+    labour_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    is_active = models.BooleanField(default=True)
+    date_created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['next_period'], condition=models.Q(is_active=True),
+                                name='recurring_invoice_due_idx')]
+
+    def save(self, *args, **kwargs):
+        if self.next_period is None:
+            self.next_period = self.start_date
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.description or 'Recurring invoice'} for {self.client} every {self.interval_months} month(s)"
+
+
+class RecurringInvoiceItem(models.Model):
+    recurring = models.ForeignKey(RecurringInvoice, on_delete=models.CASCADE, related_name='items')
+    catalog_item = models.ForeignKey(CatalogItem, on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='recurring_items')
+    description = models.CharField(max_length=255)
+    quantity = models.PositiveIntegerField()
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    def __str__(self):
+        return self.description
 
 
 class ScannedInvoice(models.Model):
     invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE)
-    scanned_file = models.FileField(upload_to= 'scanned_invoices/')
+    scanned_file = models.FileField(upload_to= 'scanned_invoices/', storage=get_scan_storage)
     date_uploaded = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"Scanned Invoice for {self.invoice.invoice_number}"
 
+    @property
+    def thumbnail_url(self):
+        return derivative_url(self.scanned_file.name, 'thumbnail')
+
+    @property
+    def preview_url(self):
+        return derivative_url(self.scanned_file.name, 'preview')
+
+
+class StoredBlob(models.Model):
+    """A de-duplicated file in the content-addressed scan store (see storage.py)."""
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} references)"
+
+
+_UNLOADED = object()  # The file field was deferred (.only()/.defer()) and never assigned
+
+
+def _blob_field(instance):
+    return 'stamped_invoice' if isinstance(instance, Invoice) else 'scanned_file'
+
+
+def _blob_name(instance):
+    # Read __dict__ rather than the attribute: a deferred field would cost a query per row.
+    value = instance.__dict__.get(_blob_field(instance), _UNLOADED)
+    return getattr(value, 'name', value)  # A FieldFile once accessed, the stored name before
+
+
+@receiver(post_init, sender=Invoice)
+@receiver(post_init, sender=ScannedInvoice)
+def remember_loaded_blob(sender, instance, **kwargs):
+    """Note which stored file a record points at, to release it if replaced."""
+    instance._loaded_blob = _blob_name(instance)
+
+
+@receiver(pre_save, sender=Invoice)
+@receiver(pre_save, sender=ScannedInvoice)
+def resolve_unloaded_blob(sender, instance, **kwargs):
+    """A file assigned to a record loaded without one: look up the file it replaces."""
+    if instance._loaded_blob is _UNLOADED and _blob_name(instance) is not _UNLOADED and instance.pk:
+        field = _blob_field(instance)
+        instance._loaded_blob = sender._base_manager.filter(pk=instance.pk).values_list(field, flat=True).first()
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_save, sender=ScannedInvoice)
+def track_blob_changes(sender, instance, **kwargs):
+    """Release a replaced file and queue previews of a newly uploaded one."""
+    previous, current = instance._loaded_blob, _blob_name(instance)
+    if current is _UNLOADED:  # Still deferred, so this save did not write it
+        return
+    if previous and previous is not _UNLOADED and previous != current:
+        transaction.on_commit(lambda: release_blob(previous))
+    if current and current != previous:
+        transaction.on_commit(lambda: queue_derivatives(current))
+    instance._loaded_blob = current
+
+
+@receiver(post_delete, sender=Invoice)
+@receiver(post_delete, sender=ScannedInvoice)
+def release_deleted_blob(sender, instance, **kwargs):
+    name = getattr(instance, _blob_field(instance)).name
+    if name:
+        transaction.on_commit(lambda: release_blob(name))
+
+
+class ArchivedInvoice(models.Model):
+    """Index entry for an invoice moved to a cold archive file (see archive.py)."""
+    invoice_id = models.IntegerField(unique=True)  # The id it had in the live table
+    invoice_number = models.CharField(max_length=20, unique=True)
+    client_name = models.CharField(max_length=100, blank=True, null=True)
+    date_created = models.DateField()
+    grand_total = models.DecimalField(max_digits=10, decimal_places=2)
+    segment = models.CharField(max_length=255)  # Archive file, relative to ARCHIVE_DIR
+    date_archived = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived invoice {self.invoice_number}"
+
 
 # this model class is for both invoice and quotation
 class Footnote(models.Model):
@@ -340,19 +739,67 @@ class Receipt(models.Model):
         if self.amount_paid <= Decimal('0.00'):
             raise ValueError("Amount paid must be greater than zero.")
 
+    @timed_span('Receipt.save')
     def save(self, *args, **kwargs):
-        if not self.receipt_number:
-            self.receipt_number = self.generate_unique_receipt_number()
         self.clean()
-        super().save(*args, **kwargs)
-        self.invoice.update_payment_status(save_instance=True)
+        with transaction.atomic():
+            if not self.receipt_number:
+                self.receipt_number = self.generate_unique_receipt_number()
+            super().save(*args, **kwargs)
+            self.invoice.update_payment_status(save_instance=True)
 
     def generate_unique_receipt_number(self):
+        return self.next_receipt_numbers(1)[0]
+
+    @classmethod
+    def next_receipt_numbers(cls, count):
+        """The next ``count`` receipt numbers of the year, for receipts created together."""
         current_year = timezone.now().year
+        lock_numbering(cls, f"RCT-{current_year}")
         last_receipt = Receipt.objects.filter(receipt_number__startswith=f"RCT-{current_year}-").last()
-        new_sequence_number = 1 if not last_receipt else int(last_receipt.receipt_number.split('-')[-1]) + 1
-        return f"RCT-{current_year}-{new_sequence_number:03d}"
+        first = 1 if not last_receipt else int(last_receipt.receipt_number.split('-')[-1]) + 1
+        return [f"RCT-{current_year}-{number:03d}" for number in range(first, first + count)]
 
     def __str__(self):
         return f"Receipt {self.receipt_number} for Invoice {self.invoice.invoice_number} - {self.amount_paid} paid on {self.payment_date}"
 
+
+
+class CurrentTransactionId(models.Func):
+    function = 'txid_current'
+    template = '%(function)s()'
+    output_field = models.BigIntegerField()
+
+
+class ChangeEvent(models.Model):
+    """One entry in the append-only outbox of document changes (see outbox.py).
+
+    Written by the same transaction as the change it records, so an event
+    exists exactly when its change committed.
+    """
+    ACTIONS = [('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted')]
+
+    transaction_id = models.BigIntegerField(db_default=CurrentTransactionId())
+    model = models.CharField(max_length=50)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    data = models.JSONField(default=dict)  # Parent/client ids and version, for routing without a read
+    date_created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['transaction_id', 'id']
+        indexes = [models.Index(fields=['transaction_id', 'id'], name='changeevent_position_idx')]
+
+    def __str__(self):
+        return f"{self.model} {self.object_id} {self.action}"
+
+
+class OutboxCursor(models.Model):
+    """How far a named consumer has read the change events."""
+    consumer = models.CharField(max_length=100, unique=True)
+    transaction_id = models.BigIntegerField(default=0)
+    event_id = models.BigIntegerField(default=0)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.consumer} at {self.transaction_id}/{self.event_id}"
@@ -0,0 +1,170 @@
+"""Transactional outbox of document changes.
+
+Every save or delete of a quotation, invoice, their items or a receipt
+appends a ``ChangeEvent`` from a signal receiver. Those models save and
+delete inside ``transaction.atomic``, so the event commits (or rolls back)
+together with the change it records. Bulk writes, which send no signals,
+record their rows with ``record_many``; bulk deletes go through
+``delete_many``, which records the whole cascade in one INSERT per model.
+Reports, caches, search indexes and integrations read the events instead
+of rescanning the document tables.
+
+Events are read in ``(transaction_id, id)`` order. Ids are handed out when
+rows are inserted, not when they commit, so reading by id alone could step
+past an event whose transaction commits later. ``transaction_id`` is the
+writer's PostgreSQL transaction id, and only events of transactions older
+than every transaction still running are returned; nothing can then appear
+behind a consumer's cursor. A long-running transaction delays consumers
+but never makes them miss an event.
+
+A consumer handles batches with ``consume``::
+
+    def project(events):
+        for event in latest_changes(events):
+            ...  # re-read event.object_id, or drop it if event.action == 'deleted'
+
+    outbox.consume('search-index', project)
+
+The handler runs in the transaction that advances the consumer's cursor, so
+a projection stored in this database is updated exactly once per event.
+Side effects elsewhere must be idempotent: a batch whose handler fails is
+delivered again.
+"""
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models import BigIntegerField, Min, Q
+from django.db.models.deletion import Collector
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+
+from .models import ChangeEvent, Invoice, InvoiceItem, OutboxCursor, Quotation, QuotationItem, Receipt
+
+TRACKED = (Quotation, QuotationItem, Invoice, InvoiceItem, Receipt)
+DEFAULT_BATCH_SIZE = 500
+
+_deleting_in_bulk = ContextVar('outbox_deleting_in_bulk', default=False)
+
+
+def event_data(instance):
+    """Foreign keys (parent document, client) and version, so consumers can route an event without a read."""
+    data = {field.attname: getattr(instance, field.attname)
+            for field in instance._meta.concrete_fields if field.many_to_one}
+    if hasattr(instance, 'version'):
+        data['version'] = instance.version
+    return data
+
+
+def record(instance, action):
+    return ChangeEvent.objects.create(model=instance._meta.model_name, object_id=instance.pk,
+                                      action=action, data=event_data(instance))
+
+
+def record_many(model, pks, action='updated', data=None):
+    """Events for rows changed in bulk (``update``/``bulk_update`` send no signals).
+
+    ``data`` optionally maps each pk to its ``event_data``.
+    """
+    data = data or {}
+    return ChangeEvent.objects.bulk_create(
+        ChangeEvent(model=model._meta.model_name, object_id=pk, action=action, data=data.get(pk, {})) for pk in pks
+    )
+
+
+def delete_many(queryset):
+    """``queryset.delete()`` recording one bulk INSERT of events per model instead of one per deleted row.
+
+    The cascade is collected first, so the rows it takes along are recorded too.
+    """
+    collector = Collector(using=queryset.db, origin=queryset)
+    collector.collect(queryset)
+    # Read before deleting: the collector clears the instances' pks.
+    deleted = {model: {instance.pk: event_data(instance) for instance in instances}
+               for model, instances in collector.data.items() if model in TRACKED}
+    token = _deleting_in_bulk.set(True)
+    try:
+        result = collector.delete()
+    finally:
+        _deleting_in_bulk.reset(token)
+    for model, data in deleted.items():
+        record_many(model, list(data), 'deleted', data)
+    return result
+
+
+def record_save(sender, instance, created, raw=False, **kwargs):
+    if not raw:  # Fixtures are loaded as-is
+        record(instance, 'created' if created else 'updated')
+
+
+def record_delete(sender, instance, **kwargs):
+    if not _deleting_in_bulk.get():  # delete_many records the whole batch itself
+        record(instance, 'deleted')
+
+
+for _model in TRACKED:
+    post_save.connect(record_save, sender=_model, dispatch_uid=f'outbox_save_{_model._meta.model_name}')
+    post_delete.connect(record_delete, sender=_model, dispatch_uid=f'outbox_delete_{_model._meta.model_name}')
+
+
+def visible_events():
+    """Events of transactions older than every transaction still in progress."""
+    horizon = RawSQL('txid_snapshot_xmin(txid_current_snapshot())', [], output_field=BigIntegerField())
+    return ChangeEvent.objects.filter(transaction_id__lt=horizon)
+
+
+def after(transaction_id, event_id):
+    return Q(transaction_id__gt=transaction_id) | Q(transaction_id=transaction_id, id__gt=event_id)
+
+
+def read_batch(cursor, batch_size=DEFAULT_BATCH_SIZE):
+    """The next events after ``cursor`` (an ``OutboxCursor``), without advancing it."""
+    events = visible_events().filter(after(cursor.transaction_id, cursor.event_id))
+    return list(events.order_by('transaction_id', 'id')[:batch_size])
+
+
+def latest_changes(events):
+    """The last event for each document in ``events``, in order: what a projection has to apply."""
+    latest = {}
+    for event in events:
+        latest.pop((event.model, event.object_id), None)
+        latest[(event.model, event.object_id)] = event
+    return list(latest.values())
+
+
+def consume(consumer, handler, batch_size=DEFAULT_BATCH_SIZE, max_batches=None):
+    """Feed unread events to ``handler`` in batches and advance ``consumer``'s cursor.
+
+    Each batch is handled and acknowledged in one transaction holding the
+    cursor row's lock, so two processes running the same consumer never
+    handle the same batch. Returns the number of events handled.
+    """
+    handled = batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            cursor, _ = OutboxCursor.objects.select_for_update().get_or_create(consumer=consumer)
+            events = read_batch(cursor, batch_size)
+            if not events:
+                break
+            handler(events)
+            cursor.transaction_id, cursor.event_id = events[-1].transaction_id, events[-1].pk
+            cursor.save(update_fields=['transaction_id', 'event_id', 'date_updated'])
+        handled += len(events)
+        batches += 1
+        if len(events) < batch_size:
+            break
+    return handled
+
+
+def lag(cursor):
+    """Number of visible events ``cursor`` has not read yet."""
+    return visible_events().filter(after(cursor.transaction_id, cursor.event_id)).count()
+
+
+def prune():
+    """Delete the events every consumer has read; returns how many. Keeps everything without consumers."""
+    oldest = OutboxCursor.objects.aggregate(transaction_id=Min('transaction_id'))['transaction_id']
+    if oldest is None:
+        return 0
+    event_id = (OutboxCursor.objects.filter(transaction_id=oldest)
+                .aggregate(event_id=Min('event_id'))['event_id'])
+    return ChangeEvent.objects.exclude(after(oldest, event_id)).delete()[0]
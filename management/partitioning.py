@@ -0,0 +1,78 @@
+"""Year "partitions" of the invoice and receipt tables.
+
+Real declarative partitioning does not fit this schema: PostgreSQL requires
+every primary key and unique constraint on a partitioned table to include the
+partition key, and invoice items, receipts and scans reference ``Invoice.id``
+through ordinary foreign keys, which cannot point at a partitioned table's
+composite key. Instead each year gets its own partial B-tree index::
+
+    CREATE INDEX invoice_y2026_idx ON management_invoice (date_created, status)
+        WHERE date_created >= '2026-01-01' AND date_created < '2027-01-01';
+
+The planner only uses such an index when the query's own predicate implies
+the index predicate, so queries that should stay inside one year must filter
+with the same half-open constant range - use ``in_year``. That gives the
+pruning effect of partitions: a current-year query touches a small index that
+stays in cache, and old years cost nothing to maintain once their indexes are
+dropped with ``manage_year_partitions --keep``.
+"""
+from datetime import date
+
+from django.db import connection
+
+from .models import Invoice, Receipt
+
+# name: (model, date field, extra indexed columns)
+PARTITIONED = {
+    'invoice': (Invoice, 'date_created', ('status',)),
+    'receipt': (Receipt, 'payment_date', ('invoice_id',)),
+}
+
+
+def year_bounds(year):
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+
+def in_year(queryset, field, year):
+    """Filter ``queryset`` to ``year`` with the range the year indexes are built on."""
+    start, end = year_bounds(year)
+    return queryset.filter(**{f'{field}__gte': start, f'{field}__lt': end})
+
+
+def index_name(name, year):
+    return f"{name}_y{year}_idx"
+
+
+def existing_years(name):
+    """Years that currently have an index for the ``name`` table."""
+    model = PARTITIONED[name][0]
+    prefix = f"{name}_y"
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+    return sorted(
+        int(index[len(prefix):-len('_idx')]) for index in constraints
+        if index.startswith(prefix) and index.endswith('_idx') and index[len(prefix):-len('_idx')].isdigit()
+    )
+
+
+def create_year_index(name, year):
+    model, field, extra = PARTITIONED[name]
+    table = model._meta.db_table
+    column = model._meta.get_field(field).column
+    start, end = year_bounds(year)
+    qn = connection.ops.quote_name
+    # CONCURRENTLY keeps the table writable while the index builds, but is not
+    # allowed inside a transaction block.
+    concurrently = '' if connection.in_atomic_block else ' CONCURRENTLY'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE INDEX{concurrently} IF NOT EXISTS {qn(index_name(name, year))} "
+            f"ON {qn(table)} ({', '.join(qn(c) for c in (column, *extra))}) "
+            f"WHERE {qn(column)} >= '{start.isoformat()}' AND {qn(column)} < '{end.isoformat()}'"
+        )
+
+
+def drop_year_index(name, year):
+    concurrently = '' if connection.in_atomic_block else ' CONCURRENTLY'
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP INDEX{concurrently} IF EXISTS {connection.ops.quote_name(index_name(name, year))}")
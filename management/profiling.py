@@ -0,0 +1,167 @@
+"""On-demand request profiling and timing spans around model saves.
+
+A request is profiled when a staff user adds ``?profile=1`` (or
+``?profile=sampling``) to the URL, or when it is picked by
+``settings.PROFILE_SAMPLE_RATE``. The profile is written to
+``settings.PROFILE_DIR``:
+
+* ``<id>.prof`` - cProfile stats, open with ``python -m pstats`` or snakeviz;
+* ``<id>.folded`` - (sampling mode) collapsed stacks for flamegraph.pl or
+  speedscope;
+* ``<id>.json`` - request metadata and the ``timed_span`` timings.
+
+When no profile is being taken ``timed_span`` costs a single ContextVar
+lookup per call.
+"""
+import cProfile
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+
+_spans = ContextVar('profiling_spans', default=None)
+_SLUG = re.compile(r'[^A-Za-z0-9]+')
+
+
+def timed_span(name):
+    """Record the duration of each call to the decorated function while profiling."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            spans = _spans.get()
+            if spans is None:
+                return func(*args, **kwargs)
+            span = {'name': name, 'depth': sum(1 for s in spans if s['end_ms'] is None)}
+            span['start_ms'] = (time.perf_counter() - spans.started) * 1000
+            span['end_ms'] = None
+            spans.append(span)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                span['end_ms'] = (time.perf_counter() - spans.started) * 1000
+                span['duration_ms'] = round(span['end_ms'] - span['start_ms'], 3)
+        return wrapper
+    return decorator
+
+
+class SpanList(list):
+    def __init__(self):
+        super().__init__()
+        self.started = time.perf_counter()
+
+
+class StackSampler:
+    """Sample one thread's Python stack at a fixed interval into folded stacks."""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def folded(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def requested_mode(request):
+    """Return 'cprofile' or 'sampling' if this request should be profiled, else None."""
+    param = request.GET.get('profile')
+    if param and getattr(request, 'user', None) is not None and request.user.is_staff:
+        return 'sampling' if param == 'sampling' else 'cprofile'
+    rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+    if rate and random.random() < rate:
+        return 'cprofile'
+    return None
+
+
+@contextmanager
+def _profiled(request, mode):
+    """Profile the block on the current thread; the block puts its response in the yielded dict."""
+    spans = SpanList()
+    token = _spans.set(spans)
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{_SLUG.sub('-', request.path).strip('-') or 'root'}-{uuid.uuid4().hex[:8]}"
+    outcome = {}
+    started = time.perf_counter()
+    try:
+        if mode == 'sampling':
+            with StackSampler(threading.get_ident(), getattr(settings, 'PROFILE_SAMPLE_INTERVAL', 0.005)) as sampler:
+                yield outcome
+            profiler = None
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield outcome
+            finally:
+                profiler.disable()
+            sampler = None
+    finally:
+        _spans.reset(token)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    response = outcome['response']
+
+    directory = Path(settings.PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    if profiler is not None:
+        profiler.dump_stats(directory / f"{profile_id}.prof")
+    if sampler is not None:
+        (directory / f"{profile_id}.folded").write_text(sampler.folded())
+    (directory / f"{profile_id}.json").write_text(json.dumps({
+        'id': profile_id,
+        'mode': mode,
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        'duration_ms': round(elapsed_ms, 3),
+        'spans': [{k: v for k, v in span.items() if k != 'end_ms'} for span in spans],
+    }, indent=2))
+    response['X-Profile-Id'] = profile_id
+
+
+def profile_request(request, get_response, mode):
+    """Run ``get_response`` under the chosen profiler and persist the results."""
+    with _profiled(request, mode) as outcome:
+        outcome['response'] = get_response(request)
+    return outcome['response']
+
+
+async def aprofile_request(request, get_response, mode):
+    """``profile_request`` for async middleware chains.
+
+    The profiler watches the event loop thread, so the profile also shows
+    whatever else the loop ran while this request was awaiting.
+    """
+    with _profiled(request, mode) as outcome:
+        outcome['response'] = await get_response(request)
+    return outcome['response']
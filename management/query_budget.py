@@ -0,0 +1,110 @@
+"""Count SQL queries and database time, and enforce per-view query budgets.
+
+Views declare a ceiling with the ``query_budget`` decorator (or a
+``query_budget`` attribute on a class-based view); ``QueryBudgetMiddleware``
+logs any request that goes over it, together with the most repeated SQL
+fingerprints, which is usually enough to spot an N+1 loop. Tests use
+``assert_max_queries`` to pin the same ceilings.
+"""
+import re
+import time
+from collections import Counter
+from contextlib import ContextDecorator, ExitStack
+
+from django.db import connections
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    """Reduce ``sql`` to its shape so repeated queries group together."""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _PLACEHOLDER_LIST.sub('(...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    """Database execute wrapper that tallies queries, time and fingerprints."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def top_repeated(self, limit=5):
+        """Return ``(fingerprint, count)`` pairs for SQL run more than once."""
+        return [(sql, count) for sql, count in self.fingerprints.most_common(limit) if count > 1]
+
+    def summary(self, limit=5):
+        lines = [f"{self.count} queries in {self.duration * 1000:.1f}ms"]
+        lines += [f"  {count}x {sql}" for sql, count in self.top_repeated(limit)]
+        return '\n'.join(lines)
+
+
+class record_queries(ContextDecorator):
+    """Record every query run on ``using`` (default: all databases) in the block."""
+
+    def __init__(self, using=None):
+        self.using = using
+
+    def __enter__(self):
+        self.recorder = QueryRecorder()
+        self._stack = ExitStack()
+        aliases = [self.using] if self.using else list(connections)
+        for alias in aliases:
+            self._stack.enter_context(connections[alias].execute_wrapper(self.recorder))
+        return self.recorder
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+        return False
+
+
+class assert_max_queries(record_queries):
+    """Fail if the block (or decorated test) runs more than ``ceiling`` queries."""
+
+    def __init__(self, ceiling, using=None):
+        super().__init__(using)
+        self.ceiling = ceiling
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super().__exit__(exc_type, exc_value, traceback)
+        if exc_type is None and self.recorder.count > self.ceiling:
+            raise AssertionError(
+                f"Query ceiling of {self.ceiling} exceeded: {self.recorder.summary()}"
+            )
+        return False
+
+
+def query_budget(max_queries):
+    """Declare the maximum number of queries a function-based view may run."""
+    def decorator(view_func):
+        view_func.query_budget = max_queries
+        return view_func
+    return decorator
+
+
+def budget_for_view(view_func, default=None):
+    """Look up the budget declared on a view function or class-based view."""
+    budget = getattr(view_func, 'query_budget', None)
+    if budget is None:
+        budget = getattr(getattr(view_func, 'view_class', None), 'query_budget', None)
+    return default if budget is None else budget
+
+
+def set_request_budget(request, max_queries):
+    """Replace the view's budget for this request, for views whose cost grows with the input (batch APIs)."""
+    request._query_budget = max_queries
@@ -0,0 +1,89 @@
+"""Set-based operations on invoices.
+
+Mirrors the rules in ``Invoice.save``: an invoice raised from a quotation
+carries the quotation's totals, while a standalone invoice is priced from its
+own items, keeps its labour cost and adds tax at its own rate.
+"""
+from decimal import Decimal
+
+from django.db.models import Case, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Round
+
+from management.models import Invoice, InvoiceItem, Quotation
+from management.services.payment_service import refresh_payment_status
+from management.services.quotation_service import MONEY
+
+
+def items_subtotal(invoice_ref='pk'):
+    """Subquery summing the line totals of an invoice's items."""
+    totals = (
+        InvoiceItem.objects
+        .filter(invoice=OuterRef(invoice_ref))
+        .order_by()
+        .values('invoice')
+        .annotate(total=Sum('total_price'))
+        .values('total')
+    )
+    return Coalesce(Subquery(totals), Value(Decimal('0.00')), output_field=MONEY)
+
+
+def quotation_value(field):
+    return Subquery(Quotation.objects.filter(pk=OuterRef('quotation_id')).values(field)[:1])
+
+
+def total_tax_expression(subtotal, labour_cost, tax_rate=F('tax_rate')):
+    return Round((subtotal + labour_cost) * tax_rate / Value(100), 2, output_field=MONEY)
+
+
+def expected_invoice_totals():
+    """Annotations computing what each stored total should be, for auditing."""
+    linked = Q(quotation__isnull=False)
+
+    def either(field, standalone):
+        return Case(When(linked, then=quotation_value(field)), default=standalone, output_field=MONEY)
+
+    return {
+        'expected_subtotal': either('subtotal', items_subtotal()),
+        'expected_labour_cost': either('labour_cost', F('labour_cost')),
+        'expected_total_tax': either(
+            'total_tax', total_tax_expression(F('expected_subtotal'), F('labour_cost'))),
+        'expected_grand_total': either(
+            'grand_total', F('expected_subtotal') + F('labour_cost') + F('expected_total_tax')),
+    }
+
+
+def recalculate_invoice_totals(queryset):
+    """Recompute the totals of every invoice in ``queryset`` from its items.
+
+    Quotation totals should be brought up to date first (see
+    ``recalculate_quotation_totals``) since linked invoices copy them.
+    Bumps each invoice's version. Returns the number of invoices updated.
+    """
+    queryset = queryset.order_by()
+    linked = queryset.filter(quotation__isnull=False)
+    standalone = queryset.filter(quotation__isnull=True)
+    updated = linked.update(version=F('version') + 1, **{
+        field: quotation_value(field) for field in ('subtotal', 'labour_cost', 'total_tax', 'grand_total')
+    })
+    updated += standalone.update(subtotal=items_subtotal(), version=F('version') + 1)
+    standalone.update(total_tax=total_tax_expression(F('subtotal'), F('labour_cost')))
+    standalone.update(grand_total=F('subtotal') + F('labour_cost') + F('total_tax'))
+    return updated
+
+
+def apply_item_delta(invoice_id, delta):
+    """Shift a standalone invoice's subtotal by ``delta`` and re-derive tax and grand total.
+
+    One UPDATE for the totals (see ``quotation_service.apply_item_delta``)
+    plus one for the payment status, and bumps the version like the
+    quotation helper. Invoices raised from a quotation carry the quotation's
+    totals, so their items never move them.
+    """
+    invoice = Invoice.objects.filter(pk=invoice_id, quotation__isnull=True)
+    subtotal = F('subtotal') + Value(delta, output_field=MONEY)
+    tax = total_tax_expression(subtotal, F('labour_cost'))
+    if invoice.update(subtotal=subtotal, total_tax=tax, grand_total=subtotal + F('labour_cost') + tax,
+                      version=F('version') + 1):
+        refresh_payment_status(invoice)
+        return True
+    return False
@@ -0,0 +1,107 @@
+"""Set-based payment status maintenance and lump-sum payment allocation for invoices."""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan, LessThanOrEqual
+from django.utils import timezone
+
+from management import outbox
+from management.models import Invoice, Receipt
+from management.services.quotation_service import MONEY
+from management.services.statement_service import retire_statement
+
+
+def amount_paid(invoice_ref='pk'):
+    """Subquery summing the receipts posted against an invoice."""
+    paid = (
+        Receipt.objects
+        .filter(invoice=OuterRef(invoice_ref))
+        .order_by()
+        .values('invoice')
+        .annotate(total=Sum('amount_paid'))
+        .values('total')
+    )
+    return Coalesce(Subquery(paid), Value(Decimal('0.00')), output_field=MONEY)
+
+
+def payment_status_expression(paid):
+    """SQL equivalent of ``Invoice.update_payment_status``."""
+    return Case(
+        When(LessThanOrEqual(F('grand_total'), paid), then=Value('Paid')),
+        When(GreaterThan(paid, Value(Decimal('0.00'))), then=Value('Partially Paid')),
+        default=Value('Unpaid'),
+    )
+
+
+def refresh_payment_status(queryset):
+    """Set Paid / Partially Paid / Unpaid on every invoice in ``queryset`` in one UPDATE.
+
+    Only invoices whose status actually changes are written (and have their
+    version bumped); returns how many.
+    """
+    status = payment_status_expression(amount_paid())
+    return queryset.order_by().exclude(status=status).update(status=status, version=F('version') + 1)
+
+
+def open_invoices(client_id):
+    """The client's invoices with money still owed, annotated with ``outstanding``, oldest due first."""
+    return (
+        Invoice.objects.filter(client_id=client_id)
+        .annotate(outstanding=F('grand_total') - amount_paid())
+        .filter(outstanding__gt=0)
+        .order_by(F('due_date').asc(nulls_last=True), 'date_created', 'pk')
+    )
+
+
+def allocate_payment(client_id, amount, invoice_ids=None, payment_date=None, payment_method=None, notes=None):
+    """Spread one payment from a client over their open invoices; returns the receipts created.
+
+    Invoices are settled in full one after another, oldest due date first,
+    or in the order of ``invoice_ids`` when given; the last one may be paid
+    in part. Everything happens in one transaction holding the invoices'
+    row locks: one query reads the balances, one ``bulk_create`` writes the
+    receipts (numbered under ``Receipt.next_receipt_numbers``' lock, so
+    payments from other clients cannot take the same numbers) and one
+    UPDATE sets the payment statuses. Raises ``ValueError``
+    (as ``Receipt.clean`` does) for a non-positive amount, an invoice that is
+    not one of the client's open invoices, or more than they owe.
+    """
+    amount = Decimal(amount)
+    if amount <= Decimal('0.00'):
+        raise ValueError("Amount paid must be greater than zero.")
+    with transaction.atomic():
+        invoices = open_invoices(client_id).select_for_update()
+        if invoice_ids is not None:
+            chosen = {invoice.pk: invoice for invoice in invoices.filter(pk__in=invoice_ids)}
+            missing = [pk for pk in invoice_ids if pk not in chosen]
+            if missing:
+                raise ValueError(f"Not open invoices of this client: {', '.join(map(str, missing))}.")
+            invoices = [chosen[pk] for pk in dict.fromkeys(invoice_ids)]
+        invoices = list(invoices)
+        owed = sum((invoice.outstanding for invoice in invoices), Decimal('0.00'))
+        if amount > owed:
+            raise ValueError(f"Amount paid cannot exceed the outstanding balance of {owed}.")
+
+        allocations, remaining = [], amount
+        for invoice in invoices:
+            if not remaining:
+                break
+            allocated = min(remaining, invoice.outstanding)
+            allocations.append((invoice, allocated))
+            remaining -= allocated
+
+        numbers = Receipt.next_receipt_numbers(len(allocations))
+        receipts = Receipt.objects.bulk_create(
+            Receipt(receipt_number=number, invoice=invoice, amount_paid=allocated, notes=notes,
+                    payment_date=payment_date or timezone.localdate(), payment_method=payment_method)
+            for number, (invoice, allocated) in zip(numbers, allocations)
+        )
+        # bulk_create and update send no signals: record what they did.
+        paid_ids = [invoice.pk for invoice, _ in allocations]
+        refresh_payment_status(Invoice.objects.filter(pk__in=paid_ids))
+        outbox.record_many(Receipt, [receipt.pk for receipt in receipts], 'created')
+        outbox.record_many(Invoice, paid_ids)
+        retire_statement(client_id)
+    return receipts
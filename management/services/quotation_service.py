@@ -0,0 +1,89 @@
+"""Set-based operations on quotations.
+
+``Quotation.calculate_totals`` works on one instance at a time and re-reads
+every item. The helpers here compute the same figures in SQL so that whole
+ranges of quotations can be brought up to date in a handful of statements
+(for example after ``bulk_create`` or an edit that bypassed ``save()``).
+"""
+from decimal import Decimal
+
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+
+from management.models import Quotation, QuotationItem
+
+LABOUR_RATE = Decimal('0.30')
+MONEY = DecimalField(max_digits=10, decimal_places=2)
+
+
+def items_subtotal(quotation_ref='pk'):
+    """Subquery summing the line totals of a quotation's items."""
+    totals = (
+        QuotationItem.objects
+        .filter(quotation=OuterRef(quotation_ref))
+        .order_by()
+        .values('quotation')
+        .annotate(total=Sum('line_total'))
+        .values('total')
+    )
+    return Coalesce(Subquery(totals), Value(Decimal('0.00')), output_field=MONEY)
+
+
+def labour_cost_expression(subtotal):
+    return Round(subtotal * Value(LABOUR_RATE), 2, output_field=MONEY)
+
+
+def total_tax_expression(subtotal, tax_rate=F('tax_rate')):
+    # Tax is charged on the unrounded subtotal + labour, as in calculate_totals().
+    return Round(subtotal * Value(1 + LABOUR_RATE) * tax_rate / Value(100), 2, output_field=MONEY)
+
+
+def grand_total_expression(subtotal, total_tax):
+    return Round(subtotal * Value(1 + LABOUR_RATE) + total_tax, 2, output_field=MONEY)
+
+
+def expected_quotation_totals():
+    """Annotations computing what each stored total should be, for auditing."""
+    return {
+        'expected_subtotal': items_subtotal(),
+        'expected_labour_cost': labour_cost_expression(F('expected_subtotal')),
+        'expected_total_tax': total_tax_expression(F('expected_subtotal')),
+        'expected_grand_total': grand_total_expression(F('expected_subtotal'), F('expected_total_tax')),
+    }
+
+
+def recalculate_quotation_totals(queryset):
+    """Recompute subtotal, labour, tax and grand total for every quotation in ``queryset``.
+
+    Runs three UPDATE statements regardless of how many rows match, because
+    each derived column depends on the one written by the previous statement.
+    Bumps each quotation's version. Returns the number of quotations updated.
+    """
+    queryset = queryset.order_by()
+    updated = queryset.update(subtotal=items_subtotal(), version=F('version') + 1)
+    queryset.update(
+        labour_cost=labour_cost_expression(F('subtotal')),
+        total_tax=total_tax_expression(F('subtotal')),
+    )
+    queryset.update(grand_total=grand_total_expression(F('subtotal'), F('total_tax')))
+    return updated
+
+
+def apply_item_delta(quotation_id, delta):
+    """Shift a quotation's subtotal by ``delta`` and re-derive its other totals.
+
+    A single UPDATE whatever the number of items: every SET expression reads
+    the row's old subtotal, so all four columns move together. Used when one
+    item is added, changed or removed; ``audit_totals`` catches any drift.
+    The version is bumped too, so a form opened before the item changed
+    cannot save stale figures over it.
+    """
+    subtotal = F('subtotal') + Value(delta, output_field=MONEY)
+    tax = total_tax_expression(subtotal)
+    return Quotation.objects.filter(pk=quotation_id).update(
+        subtotal=subtotal,
+        labour_cost=labour_cost_expression(subtotal),
+        total_tax=tax,
+        grand_total=grand_total_expression(subtotal, tax),
+        version=F('version') + 1,
+    )
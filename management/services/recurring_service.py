@@ -0,0 +1,128 @@
+"""Generation of invoices from recurring invoices (maintenance contracts).
+
+``generate_due_invoices`` invoices every period that has started by the run
+date, a batch of contracts at a time. Each batch is one transaction with a
+fixed number of queries whatever its size: lock the due contracts
+(``SKIP LOCKED``, so two runs share the work instead of waiting), read their
+items, allocate a block of invoice numbers, ``bulk_create`` the invoices and
+their items, compute totals and statuses with the set-based services, and
+move each contract's ``next_period`` on. A contract several periods behind
+gets one invoice per period, one period per pass.
+
+Runs are idempotent: the invoices and the contracts' new ``next_period``
+commit together, so a run that crashes leaves its batch as it was, and the
+unique ``(recurring, period)`` constraint on ``Invoice`` guarantees a period
+is never invoiced twice even if the schedule was edited by hand. Invoice
+numbers are allocated under the same lock as
+``Invoice.generate_unique_invoice_number``, so concurrent runs and invoices
+created meanwhile wait for the batch to commit instead of taking its numbers.
+"""
+import calendar
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from management import outbox
+from management.models import Invoice, InvoiceItem, RecurringInvoice, RecurringInvoiceItem
+from management.services.invoice_service import recalculate_invoice_totals
+from management.services.payment_service import refresh_payment_status
+from management.services.statement_service import retire_statement
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def add_months(day, months):
+    """``day`` moved ``months`` later, clamped to the end of shorter months."""
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def following_period(contract, period):
+    # Counted from start_date so a 31st that was clamped to the 28th returns to the 31st.
+    months = (period.year - contract.start_date.year) * 12 + period.month - contract.start_date.month
+    return add_months(contract.start_date, months + contract.interval_months)
+
+
+def due_contracts(run_date):
+    return RecurringInvoice.objects.filter(
+        Q(end_date__isnull=True) | Q(next_period__lte=F('end_date')),
+        is_active=True, next_period__lte=run_date,
+    )
+
+
+@dataclass
+class RunResult:
+    contracts: int = 0  # Contract periods processed (already invoiced ones included)
+    invoices: int = 0
+    items: int = 0
+    batches: int = 0
+
+
+def generate_batch(run_date, batch_size=DEFAULT_BATCH_SIZE):
+    """Invoice the next period of up to ``batch_size`` due contracts; returns ``(contracts, invoices, items)``."""
+    with transaction.atomic():
+        contracts = list(
+            due_contracts(run_date).select_related('client').select_for_update(skip_locked=True, of=('self',))
+            .order_by('pk')[:batch_size]
+        )
+        if not contracts:
+            return 0, 0, 0
+        items = defaultdict(list)
+        for item in RecurringInvoiceItem.objects.filter(recurring__in=contracts).order_by('pk'):
+            items[item.recurring_id].append(item)
+        invoiced = set(Invoice.objects.filter(
+            recurring__in=contracts, period__in={contract.next_period for contract in contracts},
+        ).values_list('recurring_id', 'period'))
+
+        pending = [contract for contract in contracts if (contract.pk, contract.next_period) not in invoiced]
+        numbers = Invoice.next_invoice_numbers(len(pending))
+        invoices = Invoice.objects.bulk_create(
+            Invoice(
+                invoice_number=number, recurring=contract, period=contract.next_period,
+                client=contract.client, client_name=contract.client.name, client_email=contract.client.email,
+                client_address=contract.client.address, client_phone_number=contract.client.phone_number,
+                date_created=contract.next_period,
+                due_date=contract.next_period + timedelta(days=contract.payment_terms_days),
+                tax_rate=contract.tax_rate, labour_cost=contract.labour_cost, status='Unpaid',
+            )
+            for number, contract in zip(numbers, pending)
+        )
+        invoice_items = InvoiceItem.objects.bulk_create(
+            InvoiceItem(invoice=invoice, catalog_item_id=item.catalog_item_id, description=item.description,
+                        quantity=item.quantity, unit_price=item.unit_price)
+            for invoice in invoices for item in items[invoice.recurring_id]
+        )
+        new_invoices = Invoice.objects.filter(pk__in=[invoice.pk for invoice in invoices])
+        recalculate_invoice_totals(new_invoices)
+        refresh_payment_status(new_invoices)
+
+        for contract in contracts:
+            contract.next_period = following_period(contract, contract.next_period)
+        RecurringInvoice.objects.bulk_update(contracts, ['next_period'])
+
+        # Bulk writes send no signals: record the changes they made.
+        outbox.record_many(Invoice, [invoice.pk for invoice in invoices], 'created')
+        outbox.record_many(InvoiceItem, [item.pk for item in invoice_items], 'created')
+        for client_id in {contract.client_id for contract in pending}:
+            retire_statement(client_id)
+    return len(contracts), len(invoices), len(invoice_items)
+
+
+def generate_due_invoices(run_date=None, batch_size=DEFAULT_BATCH_SIZE, max_batches=None):
+    """Invoice every period started by ``run_date`` (default today), in batches; returns a ``RunResult``."""
+    run_date = run_date or timezone.localdate()
+    result = RunResult()
+    while max_batches is None or result.batches < max_batches:
+        contracts, invoices, items = generate_batch(run_date, batch_size)
+        if not contracts:  # Nothing due, or the rest is locked by another run
+            break
+        result.contracts += contracts
+        result.invoices += invoices
+        result.items += items
+        result.batches += 1
+    return result
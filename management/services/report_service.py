@@ -0,0 +1,89 @@
+"""Reporting queries over invoices and receipts.
+
+Reports are scoped to calendar years with ``partitioning.in_year`` so that
+PostgreSQL can answer them from the per-year indexes instead of scanning
+every year ever invoiced, and to clients through the indexed ``client``
+foreign key rather than by matching the snapshot name or email. The
+functions that run their queries read from the replica when one is
+configured (see ``management.db_router``); the queryset helpers run wherever
+their caller evaluates them.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, Sum, Value
+from django.db.models.functions import Coalesce, ExtractMonth
+
+from management.db_router import use_replica
+from management.models import Invoice, InvoiceItem, Quotation, Receipt
+from management.partitioning import in_year, year_bounds
+from management.services.quotation_service import MONEY
+
+
+def invoices_in_year(year):
+    return in_year(Invoice.objects.all(), 'date_created', year)
+
+
+def receipts_in_year(year):
+    return in_year(Receipt.objects.all(), 'payment_date', year)
+
+
+@use_replica()
+def monthly_summary(year):
+    """Invoiced and collected amounts for each month of ``year``.
+
+    Two grouped queries, one per table, each confined to the year's range.
+    """
+    zero = Value(Decimal('0.00'))
+    invoiced = {
+        row['month']: row for row in
+        invoices_in_year(year).order_by().annotate(month=ExtractMonth('date_created')).values('month')
+        .annotate(invoices=Count('pk'), invoiced=Coalesce(Sum('grand_total'), zero, output_field=MONEY))
+    }
+    collected = dict(
+        receipts_in_year(year).order_by().annotate(month=ExtractMonth('payment_date')).values('month')
+        .annotate(collected=Coalesce(Sum('amount_paid'), zero, output_field=MONEY)).values_list('month', 'collected')
+    )
+    return [
+        {
+            'month': month,
+            'invoices': invoiced.get(month, {}).get('invoices', 0),
+            'invoiced': invoiced.get(month, {}).get('invoiced', Decimal('0.00')),
+            'collected': collected.get(month, Decimal('0.00')),
+        }
+        for month in range(1, 13)
+    ]
+
+
+def client_history(client_id):
+    """A client's quotations and invoices, newest first."""
+    return (
+        Quotation.objects.filter(client_id=client_id).order_by('-date_created'),
+        Invoice.objects.filter(client_id=client_id).order_by('-date_created'),
+    )
+
+
+@use_replica()
+def client_balance(client_id):
+    """Amount invoiced to, paid by and still owed by a client."""
+    zero = Value(Decimal('0.00'))
+    invoiced = Invoice.objects.filter(client_id=client_id).aggregate(
+        total=Coalesce(Sum('grand_total'), zero, output_field=MONEY))['total']
+    paid = Receipt.objects.filter(invoice__client_id=client_id).aggregate(
+        total=Coalesce(Sum('amount_paid'), zero, output_field=MONEY))['total']
+    return {'invoiced': invoiced, 'paid': paid, 'outstanding': invoiced - paid}
+
+
+@use_replica()
+def sales_by_item(year):
+    """Invoiced quantity and value per catalog entry in ``year``, best sellers first.
+
+    Groups on the indexed ``catalog_item`` id; items typed without a catalog
+    entry are reported together under ``catalog_item_id=None``.
+    """
+    start, end = year_bounds(year)
+    return list(
+        InvoiceItem.objects.filter(invoice__date_created__gte=start, invoice__date_created__lt=end)
+        .order_by().values('catalog_item_id', 'catalog_item__name')
+        .annotate(quantity=Sum('quantity'), sales=Coalesce(Sum('total_price'), Value(Decimal('0.00')), output_field=MONEY))
+        .order_by('-sales')
+    )
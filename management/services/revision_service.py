@@ -0,0 +1,134 @@
+"""Quotation revision history stored as diffs with periodic snapshots.
+
+``record_revision`` captures a quotation's header fields and items after an
+edit. Revision 1 and every ``SNAPSHOT_INTERVAL``-th revision after it store
+the full state; the others store only the fields and items that changed
+since the previous revision. ``revision_state`` rebuilds any revision from
+the nearest snapshot at or before it, so at most ``SNAPSHOT_INTERVAL - 1``
+diffs are applied however long the history grows.
+
+State layout (all values are strings so Decimals and dates survive JSON)::
+
+    {'fields': {'client_name': ..., 'tax_rate': '16.00', ...},
+     'items': {'<item id>': {'description': ..., 'quantity': '2', 'unit_price': '10.00'}}}
+
+A diff's ``fields`` holds only changed values, its ``items`` only added or
+changed items (changed ones with just the changed attributes), and an extra
+``removed_items`` key lists the ids of deleted items.
+"""
+from django.db import transaction
+from django.db.models import Max
+
+from management.models import Quotation, QuotationRevision
+
+SNAPSHOT_INTERVAL = 10
+
+REVISION_FIELDS = (
+    'client_name', 'client_email', 'client_address', 'client_phone_number', 'status',
+    'valid_until', 'tax_rate', 'subtotal', 'labour_cost', 'total_tax', 'grand_total',
+)
+ITEM_FIELDS = ('description', 'quantity', 'unit_price')
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def current_state(quotation, fields=None):
+    """The quotation's state as stored: header ``fields`` as read from its row (read here when not given).
+
+    Item writes update the totals with SQL, so the in-memory quotation may not have them.
+    """
+    if fields is None:
+        fields = Quotation.objects.filter(pk=quotation.pk).values(*REVISION_FIELDS).get()
+    return {
+        'fields': {name: _text(fields[name]) for name in REVISION_FIELDS},
+        'items': {
+            str(item['id']): {field: _text(item[field]) for field in ITEM_FIELDS}
+            for item in quotation.items.order_by('id').values('id', *ITEM_FIELDS)
+        },
+    }
+
+
+def diff_states(old, new):
+    """The diff that turns ``old`` into ``new``, or None if they are equal."""
+    fields = {name: value for name, value in new['fields'].items() if old['fields'].get(name) != value}
+    items = {}
+    for item_id, item in new['items'].items():
+        previous = old['items'].get(item_id)
+        if previous is None:
+            items[item_id] = item
+        else:
+            changed = {name: value for name, value in item.items() if previous.get(name) != value}
+            if changed:
+                items[item_id] = changed
+    removed = sorted(set(old['items']) - set(new['items']), key=int)
+    if not (fields or items or removed):
+        return None
+    return {'fields': fields, 'items': items, 'removed_items': removed}
+
+
+def apply_diff(state, diff):
+    state = {'fields': dict(state['fields']), 'items': {k: dict(v) for k, v in state['items'].items()}}
+    state['fields'].update(diff['fields'])
+    for item_id, changes in diff['items'].items():
+        state['items'].setdefault(item_id, {}).update(changes)
+    for item_id in diff.get('removed_items', ()):
+        state['items'].pop(item_id, None)
+    return state
+
+
+def revision_state(quotation_id, number):
+    """Rebuild revision ``number`` of a quotation from its nearest snapshot."""
+    revisions = QuotationRevision.objects.filter(quotation_id=quotation_id, number__lte=number)
+    base = revisions.filter(is_snapshot=True).aggregate(n=Max('number'))['n']
+    if base is None:
+        raise QuotationRevision.DoesNotExist(f"No snapshot for revision {number} of quotation {quotation_id}")
+    chain = list(revisions.filter(number__gte=base).order_by('number').values_list('number', 'data'))
+    if chain[-1][0] != number:
+        raise QuotationRevision.DoesNotExist(f"Quotation {quotation_id} has no revision {number}")
+    state = chain[0][1]
+    for _, diff in chain[1:]:
+        state = apply_diff(state, diff)
+    return state
+
+
+def record_revision(quotation, user=None, note=''):
+    """Store the quotation's current state as a new revision if anything changed.
+
+    Returns the new ``QuotationRevision`` or None when nothing changed.
+    """
+    with transaction.atomic():
+        # Serialise concurrent edits of the same quotation so numbers stay dense.
+        fields = Quotation.objects.select_for_update().filter(pk=quotation.pk).values(*REVISION_FIELDS).get()
+        latest = quotation.revisions.aggregate(n=Max('number'))['n']
+        state = current_state(quotation, fields)
+        diff = None
+        if latest is not None:
+            diff = diff_states(revision_state(quotation.pk, latest), state)
+            if diff is None:
+                return None
+        number = (latest or 0) + 1
+        is_snapshot = (number - 1) % SNAPSHOT_INTERVAL == 0
+        data = state if is_snapshot else diff
+        return QuotationRevision.objects.create(
+            quotation=quotation, number=number, is_snapshot=is_snapshot, data=data,
+            created_by=user if user is not None and user.is_authenticated else None, note=note,
+        )
+
+
+def compare_revisions(quotation_id, first, second):
+    """Header and item differences between two revisions, for display."""
+    old, new = revision_state(quotation_id, first), revision_state(quotation_id, second)
+    fields = [
+        (name, old['fields'].get(name), value)
+        for name, value in new['fields'].items() if old['fields'].get(name) != value
+    ]
+    items = []
+    for item_id in sorted(set(old['items']) | set(new['items']), key=int):
+        before, after = old['items'].get(item_id), new['items'].get(item_id)
+        if before == after:
+            continue
+        change = 'added' if before is None else 'removed' if after is None else 'changed'
+        items.append({'id': item_id, 'change': change, 'before': before, 'after': after})
+    return {'fields': fields, 'items': items}
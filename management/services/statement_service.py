@@ -0,0 +1,146 @@
+"""Client statements of account.
+
+A statement is the client's ledger in date order: each invoice a debit of
+its grand total, each receipt a credit, with the balance after every entry.
+``ledger`` reads it in one query - a ``UNION ALL`` of the two tables with the
+running balance computed by ``SUM(...) OVER`` - instead of opening every
+invoice and its receipts.
+
+Months before the current one rarely change, so ``client_statement`` caches
+their entries and closing balance and only queries the current month, which
+starts from that balance. The cached months are always read from the
+primary, since a lagging replica's ledger would otherwise be kept for a
+day; only the uncached current month may come from the replica. Saving or
+deleting one of the client's invoices
+or receipts stores a new generation token for the client (after commit, as
+in ``management.catalog``), which retires the cached months. Set-based
+repairs (``recalculate_invoice_totals``, ``audit_totals --fix``) send no
+signals, so cached months also expire after ``CLOSED_MONTHS_TIMEOUT``.
+Paid invoices moved to the cold archive leave the ledger with their
+receipts; they settled to zero, so balances are unaffected.
+"""
+import uuid
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connections, router, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from management.db_router import use_replica
+from management.models import Invoice, Receipt
+
+CLOSED_MONTHS_TIMEOUT = 60 * 60 * 24
+ZERO = Decimal('0.00')
+
+LEDGER_SQL = """
+    SELECT kind, id, number, entry_date, debit, credit,
+           %s + SUM(debit - credit) OVER (ORDER BY entry_date, position, id ROWS UNBOUNDED PRECEDING)
+    FROM (
+        SELECT 'invoice' AS kind, 0 AS position, i.id, i.invoice_number AS number,
+               i.date_created AS entry_date, i.grand_total AS debit, 0 AS credit
+        FROM {invoice} i
+        WHERE i.client_id = %s AND i.date_created >= %s
+        UNION ALL
+        SELECT 'receipt', 1, r.id, r.receipt_number, r.payment_date, 0, r.amount_paid
+        FROM {receipt} r JOIN {invoice} i ON i.id = r.invoice_id
+        WHERE i.client_id = %s AND r.payment_date >= %s
+    ) AS entries
+    ORDER BY entry_date, position, id
+"""
+
+
+@dataclass(frozen=True)
+class Entry:
+    kind: str  # 'invoice' or 'receipt'
+    id: int
+    number: str
+    date: date
+    debit: Decimal
+    credit: Decimal
+    balance: Decimal
+
+
+@dataclass(frozen=True)
+class Statement:
+    client_id: int
+    entries: list
+    balance: Decimal
+
+    @property
+    def invoiced(self):
+        return sum((entry.debit for entry in self.entries), ZERO)
+
+    @property
+    def paid(self):
+        return sum((entry.credit for entry in self.entries), ZERO)
+
+
+def ledger(client_id, since=date.min, opening=ZERO, using=None):
+    """The client's entries dated ``since`` or later, with the balance carried on from ``opening``."""
+    sql = LEDGER_SQL.format(invoice=Invoice._meta.db_table, receipt=Receipt._meta.db_table)
+    with connections[using or router.db_for_read(Invoice)].cursor() as cursor:
+        cursor.execute(sql, [opening, client_id, since, client_id, since])
+        return [Entry(*row) for row in cursor.fetchall()]
+
+
+def generation_key(client_id):
+    return f'statement:{client_id}:generation'
+
+
+def current_generation(client_id):
+    key = generation_key(client_id)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        generation = cache.get(key)
+    return generation
+
+
+@use_replica()
+def client_statement(client_id, today=None):
+    """The client's whole ledger: cached closed months plus a query for the current month."""
+    month_start = (today or timezone.localdate()).replace(day=1)
+    key = f'statement:{client_id}:{current_generation(client_id)}:{month_start:%Y-%m}'
+    closed = cache.get(key)
+    if closed is None:
+        entries = ledger(client_id, using=router.db_for_write(Invoice))
+        closed_entries = [entry for entry in entries if entry.date < month_start]
+        closed = (closed_entries, closed_entries[-1].balance if closed_entries else ZERO)
+        cache.set(key, closed, CLOSED_MONTHS_TIMEOUT)
+        current = entries[len(closed_entries):]
+    else:
+        current = ledger(client_id, since=month_start, opening=closed[1])
+    entries = closed[0] + current
+    return Statement(client_id, entries, entries[-1].balance if entries else ZERO)
+
+
+def retire_statement(client_id):
+    """Drop the client's cached months once the current transaction commits."""
+    if client_id is not None:
+        transaction.on_commit(lambda: cache.set(generation_key(client_id), uuid.uuid4().hex, None))
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+def retire_invoice_statement(sender, instance, **kwargs):
+    retire_statement(instance.client_id)
+    previous = getattr(instance, '_loaded_client_id', None)
+    if previous != instance.client_id:  # Moved to another client: the old one loses the invoice
+        retire_statement(previous)
+    instance._loaded_client_id = instance.client_id
+
+
+@receiver(post_save, sender=Receipt)
+@receiver(post_delete, sender=Receipt)
+def retire_receipt_statement(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Invoice) or getattr(origin, 'model', None) is Invoice:
+        return  # Deleted with its invoice, which retires the statement itself
+    if Receipt.invoice.is_cached(instance):
+        client_id = instance.invoice.client_id
+    else:
+        client_id = Invoice.objects.filter(pk=instance.invoice_id).values_list('client_id', flat=True).first()
+    retire_statement(client_id)
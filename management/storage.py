@@ -0,0 +1,108 @@
+"""Content-addressed, de-duplicating storage for scanned and stamped invoices.
+
+Uploads are streamed to a temporary file in chunks while their SHA-256 is
+computed, then moved to ``cas/<aa>/<bb>/<sha256><ext>`` under ``MEDIA_ROOT``.
+Uploading a file that is already stored only bumps the reference count on
+its ``StoredBlob`` row, and ``release_blob`` deletes the file once the last
+record pointing at it is gone. Files saved before this storage was introduced
+keep their old names and are served as before; they are not reference counted.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import PurePosixPath
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+CAS_PREFIX = 'cas'
+CHUNK_SIZE = 1024 * 1024
+
+
+def blob_name(digest, extension):
+    return f"{CAS_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{extension.lower()}"
+
+
+def is_blob_name(name):
+    return bool(name) and name.startswith(f"{CAS_PREFIX}/") and '/tmp/' not in name
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is derived from the content in _save(), so the
+        # requested name never needs a random suffix.
+        return name
+
+    def _save(self, name, content):
+        from .models import StoredBlob
+
+        tmp_dir = self.path(f"{CAS_PREFIX}/tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        digest, size = hashlib.sha256(), 0
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+            try:
+                for chunk in content.chunks(CHUNK_SIZE):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+            except BaseException:
+                os.unlink(tmp.name)
+                raise
+
+        digest = digest.hexdigest()
+        final_name = blob_name(digest, PurePosixPath(name).suffix)
+        try:
+            with transaction.atomic():
+                blob, _ = StoredBlob.objects.select_for_update().get_or_create(
+                    sha256=digest, defaults={'name': final_name, 'size': size})
+                if self.exists(blob.name):
+                    os.unlink(tmp.name)
+                else:
+                    final_path = self.path(blob.name)
+                    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                    os.replace(tmp.name, final_path)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(final_path, self.file_permissions_mode)
+                StoredBlob.objects.filter(pk=digest).update(ref_count=F('ref_count') + 1)
+        finally:
+            if os.path.exists(tmp.name):
+                os.unlink(tmp.name)
+        return blob.name
+
+
+scan_storage = ContentAddressedStorage()
+
+
+def get_scan_storage():
+    """Storage callable for FileFields (keeps migrations free of storage details)."""
+    return scan_storage
+
+
+def release_blob(name):
+    """Drop one reference to ``name``; delete the file when nothing uses it any more."""
+    from .derivatives import delete_derivatives
+    from .models import StoredBlob
+
+    if not is_blob_name(name):
+        return
+    with transaction.atomic():
+        blob = StoredBlob.objects.select_for_update().filter(name=name).first()
+        if blob is None:
+            return
+        blob.ref_count = max(blob.ref_count - 1, 0)
+        if blob.ref_count == 0 and not count_references(name):
+            scan_storage.delete(name)
+            delete_derivatives(name)
+            blob.delete()
+        else:
+            blob.save(update_fields=['ref_count'])
+
+
+def count_references(name):
+    """Number of records whose file fields point at ``name``."""
+    from .models import Invoice, ScannedInvoice
+
+    return (ScannedInvoice.objects.filter(scanned_file=name).count()
+            + Invoice.objects.filter(stamped_invoice=name).count())
@@ -6,10 +6,14 @@ from management.forms import QuotationForm ,QuotationItemForm, InvoiceForm, Invo
 from unittest import mock
 from datetime import date, timedelta
 from django.utils import timezone
-from django.db import connection
+from django.db import connection, transaction
+import json
 import logging
 from django.urls import reverse
 from django.test import Client
+from django.core.management import call_command
+from management.query_budget import assert_max_queries, fingerprint
+from .models import Receipt, ScannedInvoice, Footnote
 
 logger = logging.getLogger(__name__)
 
@@ -495,4 +499,1266 @@ class TestInvoiceViews:
         response = self.client.get(url)
         
         assert response.status_code == 200
-        assert 'invoice' in response.context  # Context contains the invoice instance
\ No newline at end of file
+        assert 'invoice' in response.context  # Context contains the invoice instance
+
+@pytest.mark.django_db
+class TestReadAPI:
+
+    def setup_method(self):
+        self.client = Client()
+
+    def test_invoice_list_paginates_by_id(self):
+        """The invoice list API returns keyset pages with a cursor for the next page."""
+        invoices = []
+        for n in range(3):
+            invoice = Invoice(client_name=f"Client {n}", client_email=f"c{n}@example.com")
+            invoice.save()
+            invoices.append(invoice)
+        response = self.client.get(reverse('api_invoice_list'), {'limit': 2})
+        assert response.status_code == 200
+        data = response.json()
+        assert [row['id'] for row in data['results']] == [invoices[0].id, invoices[1].id]
+        assert data['next_after'] == invoices[1].id
+
+        response = self.client.get(reverse('api_invoice_list'), {'limit': 2, 'after': data['next_after']})
+        data = response.json()
+        assert [row['id'] for row in data['results']] == [invoices[2].id]
+        assert data['next_after'] is None
+
+    def test_quotation_detail_includes_items(self):
+        """The quotation detail API nests the quotation's items."""
+        quotation = Quotation(
+            client_name="John Doe",
+            client_email="john@example.com",
+            client_address="123 Main St",
+            client_phone_number="555-1234",
+        )
+        quotation.save()
+        QuotationItem.objects.create(quotation=quotation, description="Item 1", quantity=2, unit_price=Decimal('25.00'))
+
+        response = self.client.get(reverse('api_quotation_detail', args=[quotation.id]))
+        assert response.status_code == 200
+        data = response.json()
+        assert data['quote_number'] == quotation.quote_number
+        assert data['subtotal'] == '50.00'
+        assert [item['description'] for item in data['items']] == ["Item 1"]
+
+    def test_missing_receipt_returns_404(self):
+        response = self.client.get(reverse('api_receipt_detail', args=[999999]))
+        assert response.status_code == 404
+
+
+@pytest.mark.django_db
+class TestDbConnectionMetrics:
+
+    def test_metrics_require_staff(self):
+        response = Client().get(reverse('db_connection_metrics'))
+        assert response.status_code == 302  # Redirected to the admin login
+
+    def test_metrics_report_connection_mode(self, admin_client):
+        response = admin_client.get(reverse('db_connection_metrics'))
+        assert response.status_code == 200
+        data = response.json()
+        assert data['alias'] == 'default'
+        assert data['mode'] == 'none'
+        assert {'in_use', 'waiting', 'acquire_latency_ms'} <= set(data)
+
+
+
+@pytest.mark.django_db
+class TestQueryBudgets:
+    """Query ceilings for every view in management/urls.py and each admin changelist.
+
+    Each page is rendered with several related rows so an N+1 loop would push
+    it over its ceiling.
+    """
+
+    @pytest.fixture(autouse=True)
+    def documents(self, db):
+        for n in range(5):
+            quotation = Quotation(
+                client_name=f"Client {n}",
+                client_email=f"client{n}@example.com",
+                client_address="123 Main St",
+                client_phone_number="555-1234",
+                tax_rate=Decimal('10.00'),
+            )
+            quotation.save()
+            QuotationItem.objects.create(quotation=quotation, description="Item 1", quantity=2, unit_price=Decimal('25.00'))
+            QuotationItem.objects.create(quotation=quotation, description="Item 2", quantity=1, unit_price=Decimal('10.00'))
+            invoice = Invoice(quotation=quotation)
+            invoice.save()
+            Receipt(invoice=invoice, amount_paid=Decimal('5.00')).save()
+            ScannedInvoice.objects.create(invoice=invoice, scanned_file='scanned_invoices/scan.pdf')
+        Footnote.objects.create()
+        self.quotation = quotation
+        self.invoice = invoice
+
+    @assert_max_queries(5)
+    def test_quotation_list(self, client):
+        assert client.get(reverse('quotation_list')).status_code == 200
+
+    @assert_max_queries(30)
+    def test_create_quotation(self, client):
+        assert client.get(reverse('create_quotation')).status_code == 200
+
+    @assert_max_queries(15)
+    def test_edit_quotation(self, client):
+        assert client.get(reverse('edit_quotation', args=[self.quotation.id])).status_code == 200
+
+    @assert_max_queries(5)
+    def test_invoice_list(self, client):
+        assert client.get(reverse('invoice_list')).status_code == 200
+
+    @assert_max_queries(30)
+    def test_invoice_create(self, client):
+        assert client.get(reverse('invoice_create')).status_code == 200
+
+    @assert_max_queries(10)
+    def test_invoice_detail(self, client):
+        assert client.get(reverse('invoice_detail', args=[self.invoice.id])).status_code == 200
+
+    @assert_max_queries(40)
+    def test_invoice_update(self, client):
+        assert client.get(reverse('invoice_update', args=[self.invoice.id])).status_code == 200
+
+    @assert_max_queries(20)
+    def test_invoice_delete(self, client):
+        assert client.get(reverse('invoice_delete', args=[self.invoice.id])).status_code == 200
+
+    @assert_max_queries(2)
+    def test_api_quotation_detail(self, client):
+        assert client.get(reverse('api_quotation_detail', args=[self.quotation.id])).status_code == 200
+
+    @assert_max_queries(3)
+    def test_api_invoice_detail(self, client):
+        assert client.get(reverse('api_invoice_detail', args=[self.invoice.id])).status_code == 200
+
+    @pytest.mark.parametrize('name', ['api_quotation_list', 'api_invoice_list', 'api_receipt_list'])
+    @assert_max_queries(1)
+    def test_api_lists(self, client, name):
+        assert client.get(reverse(name)).status_code == 200
+
+    @pytest.mark.parametrize('model', ['quotation', 'invoice', 'receipt', 'scannedinvoice', 'footnote'])
+    @assert_max_queries(12)
+    def test_admin_changelist(self, admin_client, model):
+        assert admin_client.get(reverse(f'admin:management_{model}_changelist')).status_code == 200
+
+    def test_ceiling_failure_lists_repeated_queries(self):
+        with pytest.raises(AssertionError, match=r"Query ceiling of 1 exceeded: .*\n  5x SELECT COUNT"):
+            with assert_max_queries(1):
+                for quotation in Quotation.objects.all():
+                    quotation.items.count()
+
+    def test_middleware_flags_view_over_budget(self, client, caplog, monkeypatch):
+        from management import views
+        monkeypatch.setattr(views.quotation_list, 'query_budget', 0)
+        with caplog.at_level(logging.WARNING, logger='management.middleware'):
+            client.get(reverse('quotation_list'))
+        assert "Query budget exceeded on GET /" in caplog.text
+
+    def test_middleware_stays_async_for_async_views(self, settings):
+        from asgiref.sync import async_to_sync, iscoroutinefunction
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from .middleware import QueryBudgetMiddleware
+        settings.DEBUG = True
+
+        async def view(request):
+            await Quotation.objects.acount()
+            return HttpResponse()
+        middleware = QueryBudgetMiddleware(view)
+        assert iscoroutinefunction(middleware)
+        assert async_to_sync(middleware)(RequestFactory().get('/'))['X-DB-Queries'] == '1'
+
+    def test_fingerprint_collapses_literals(self):
+        assert fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x' LIMIT 21") == \
+            "SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?"
+
+
+
+@pytest.mark.django_db
+class TestGenerateDataset:
+
+    def test_generated_totals_match_model_calculation(self):
+        """Set-based totals rebuilt after bulk_create agree with calculate_totals()."""
+        call_command('generate_dataset', quotations=20, standalone_invoices=5, seed=7, stdout=mock.Mock())
+
+        assert Quotation.objects.count() == 20
+        assert Invoice.objects.filter(quotation__isnull=True).count() == 5
+        for quotation in Quotation.objects.all():
+            stored = (quotation.subtotal, quotation.total_tax, quotation.grand_total)
+            quotation.calculate_totals()
+            assert stored == (quotation.subtotal, quotation.total_tax, quotation.grand_total)
+
+        for invoice in Invoice.objects.select_related('quotation'):
+            if invoice.quotation:
+                assert invoice.grand_total == invoice.quotation.grand_total
+            else:
+                assert invoice.subtotal == sum(item.quantity * item.unit_price for item in invoice.items.all())
+            status = invoice.status
+            invoice.update_payment_status()
+            assert invoice.status == status
+
+
+@pytest.mark.django_db
+class TestProfiling:
+
+    @pytest.fixture(autouse=True)
+    def profile_dir(self, settings, tmp_path):
+        settings.PROFILE_DIR = str(tmp_path)
+        self.profile_dir = tmp_path
+
+    def test_staff_profile_records_save_spans(self, admin_client):
+        """A staff ?profile=1 request writes a cProfile dump and the timed save spans."""
+        response = admin_client.post(reverse('invoice_create') + '?profile=1', {
+            'client_name': "John Doe",
+            'client_email': "john@example.com",
+            'tax_rate': '10.00',
+            'status': 'Draft',
+            'items-TOTAL_FORMS': '0',
+            'items-INITIAL_FORMS': '0',
+        })
+        assert response.status_code == 302
+        profile_id = response['X-Profile-Id']
+        assert (self.profile_dir / f"{profile_id}.prof").exists()
+        report = json.loads((self.profile_dir / f"{profile_id}.json").read_text())
+        assert report['path'].startswith('/invoices/create/')
+        assert 'Invoice.save' in [span['name'] for span in report['spans']]
+
+    def test_sampling_mode_writes_folded_stacks(self, admin_client):
+        response = admin_client.get(reverse('quotation_list') + '?profile=sampling')
+        assert (self.profile_dir / f"{response['X-Profile-Id']}.folded").exists()
+
+    def test_anonymous_users_cannot_trigger_profiling(self, client):
+        response = client.get(reverse('quotation_list') + '?profile=1')
+        assert 'X-Profile-Id' not in response
+        assert not list(self.profile_dir.iterdir())
+
+    def test_async_requests_are_profiled_without_a_thread(self, admin_user):
+        from asgiref.sync import async_to_sync, iscoroutinefunction
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from .middleware import ProfilingMiddleware
+
+        async def view(request):
+            return HttpResponse()
+        middleware = ProfilingMiddleware(view)
+        assert iscoroutinefunction(middleware)
+        request = RequestFactory().get('/api/?profile=1')
+        request.user = admin_user
+        response = async_to_sync(middleware)(request)
+        assert (self.profile_dir / f"{response['X-Profile-Id']}.prof").exists()
+
+
+@pytest.mark.django_db
+class TestAuditTotals:
+
+    def test_reports_and_fixes_drifted_totals(self):
+        """Totals changed behind save()'s back are reported, then fixed with --fix."""
+        call_command('generate_dataset', quotations=10, standalone_invoices=3, seed=3, stdout=mock.Mock())
+        quotation = Quotation.objects.first()
+        standalone = Invoice.objects.filter(quotation__isnull=True).first()
+        expected_quote_total = quotation.grand_total
+        expected_invoice_total = standalone.grand_total
+        Quotation.objects.filter(pk=quotation.pk).update(grand_total=Decimal('1.00'))
+        Invoice.objects.filter(pk=standalone.pk).update(subtotal=Decimal('0.00'), grand_total=Decimal('0.00'))
+
+        out = mock.Mock()
+        call_command('audit_totals', stdout=out)
+        report = ''.join(str(call.args[0]) for call in out.write.call_args_list)
+        assert f"#{quotation.pk}: grand_total 1.00 -> {expected_quote_total}" in report
+        assert Quotation.objects.get(pk=quotation.pk).grand_total == Decimal('1.00')  # Dry run by default
+
+        call_command('audit_totals', fix=True, stdout=mock.Mock())
+        assert Quotation.objects.get(pk=quotation.pk).grand_total == expected_quote_total
+        assert Invoice.objects.get(pk=standalone.pk).grand_total == expected_invoice_total
+
+
+@pytest.mark.django_db
+class TestContentAddressedStorage:
+
+    @pytest.fixture(autouse=True)
+    def media_root(self, settings, tmp_path):
+        settings.MEDIA_ROOT = str(tmp_path)
+        self.media_root = tmp_path
+        self.invoice = Invoice(client_name="Jane Doe", client_email="jane@example.com",
+                               client_address="1 Main St", client_phone_number="555-0000")
+        self.invoice.save()
+
+    def scan(self, content, name='scan.pdf'):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        return ScannedInvoice.objects.create(invoice=self.invoice, scanned_file=SimpleUploadedFile(name, content))
+
+    def test_identical_uploads_share_one_file(self):
+        """The same bytes uploaded twice are stored once and reference counted."""
+        from .models import StoredBlob
+        first, second = self.scan(b'%PDF-1.4 same'), self.scan(b'%PDF-1.4 same', name='copy.PDF')
+        assert first.scanned_file.name == second.scanned_file.name
+        assert first.scanned_file.name.startswith('cas/')
+        blob = StoredBlob.objects.get()
+        assert blob.ref_count == 2 and blob.size == len(b'%PDF-1.4 same')
+        assert len([p for p in self.media_root.rglob('*') if p.is_file()]) == 1
+
+    def test_file_deleted_with_last_reference(self, django_capture_on_commit_callbacks):
+        from .models import StoredBlob
+        first, second = self.scan(b'shared'), self.scan(b'shared')
+        path = self.media_root / first.scanned_file.name
+        with django_capture_on_commit_callbacks(execute=True):
+            first.delete()
+        assert path.exists() and StoredBlob.objects.get().ref_count == 1
+        with django_capture_on_commit_callbacks(execute=True):
+            second.delete()
+        assert not path.exists() and not StoredBlob.objects.exists()
+
+    def test_deferred_file_is_not_loaded_but_still_released(self, settings, django_capture_on_commit_callbacks):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        settings.DERIVATIVES_ASYNC = False
+        old = self.scan(b'old scan')
+        self.scan(b'other scan')
+        with assert_max_queries(1):
+            assert len(ScannedInvoice.objects.only('pk')) == 2
+
+        scan = ScannedInvoice.objects.only('pk', 'invoice').get(pk=old.pk)
+        scan.scanned_file = SimpleUploadedFile('new.pdf', b'new scan')
+        with django_capture_on_commit_callbacks(execute=True):
+            scan.save()
+        assert not (self.media_root / old.scanned_file.name).exists()
+
+    def test_blobstore_reports_savings_and_collects_garbage(self):
+        from .models import StoredBlob
+        self.scan(b'x' * 1024 * 1024)
+        self.scan(b'x' * 1024 * 1024)
+        orphan = self.scan(b'orphan')
+        # post_delete queues the release for commit, which never comes inside this test: an orphan.
+        ScannedInvoice.objects.filter(pk=orphan.pk).delete()
+
+        out = mock.Mock()
+        call_command('blobstore', recount=True, collect_garbage=True, stdout=out)
+        report = ''.join(str(call.args[0]) for call in out.write.call_args_list)
+        assert "De-duplication saves 1.00 MB" in report
+        assert StoredBlob.objects.count() == 1
+        assert not (self.media_root / orphan.scanned_file.name).exists()
+
+
+@pytest.mark.django_db
+class TestScanDerivatives:
+
+    @pytest.fixture(autouse=True)
+    def media_root(self, settings, tmp_path):
+        settings.MEDIA_ROOT = str(tmp_path)
+        settings.DERIVATIVES_ASYNC = False
+        self.invoice = Invoice(client_name="Jane Doe", client_email="jane@example.com",
+                               client_address="1 Main St", client_phone_number="555-0000")
+        self.invoice.save()
+
+    def upload(self, content, name):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        return ScannedInvoice.objects.create(invoice=self.invoice, scanned_file=SimpleUploadedFile(name, content))
+
+    def test_detail_page_links_scans_without_previews(self, client):
+        """Files that cannot be rendered are still linked from the invoice page."""
+        scan = self.upload(b'not an image', 'notes.docx')
+        response = client.get(reverse('invoice_detail', args=[self.invoice.pk]))
+        assert scan.thumbnail_url is None
+        assert scan.scanned_file.url in response.content.decode()
+
+    def test_upload_renders_thumbnail_and_preview(self, client, django_capture_on_commit_callbacks):
+        Image = pytest.importorskip('PIL.Image')
+        import io
+        buffer = io.BytesIO()
+        Image.new('RGB', (2000, 1000), 'white').save(buffer, 'PNG')
+        with django_capture_on_commit_callbacks(execute=True):
+            scan = self.upload(buffer.getvalue(), 'scan.png')
+        assert scan.thumbnail_url and scan.preview_url
+        from django.core.files.storage import default_storage
+        from .derivatives import derivative_name
+        with Image.open(default_storage.path(derivative_name(scan.scanned_file.name, 'thumbnail'))) as thumbnail:
+            assert max(thumbnail.size) == 240
+        response = client.get(reverse('invoice_detail', args=[self.invoice.pk]))
+        assert scan.thumbnail_url in response.content.decode()
+
+
+@pytest.mark.django_db
+class TestMediaView:
+
+    @pytest.fixture(autouse=True)
+    def media_file(self, settings, tmp_path):
+        settings.MEDIA_ROOT = str(tmp_path)
+        (tmp_path / 'scanned_invoices').mkdir()
+        (tmp_path / 'scanned_invoices' / 'scan.pdf').write_bytes(b'0123456789')
+        self.url = reverse('media', args=['scanned_invoices/scan.pdf'])
+
+    def test_requires_login(self, client):
+        response = client.get(self.url)
+        assert response.status_code == 302
+        assert '/admin/login/' in response['Location']
+
+    def test_full_and_ranged_responses(self, admin_client):
+        response = admin_client.get(self.url)
+        assert response.status_code == 200
+        assert b''.join(response.streaming_content) == b'0123456789'
+        assert response['Accept-Ranges'] == 'bytes'
+
+        response = admin_client.get(self.url, HTTP_RANGE='bytes=2-4')
+        assert response.status_code == 206
+        assert response['Content-Range'] == 'bytes 2-4/10'
+        assert b''.join(response.streaming_content) == b'234'
+
+        response = admin_client.get(self.url, HTTP_RANGE='bytes=-3')
+        assert b''.join(response.streaming_content) == b'789'
+        assert admin_client.get(self.url, HTTP_RANGE='bytes=20-').status_code == 416
+        assert admin_client.get(self.url, HTTP_RANGE='bytes=-0').status_code == 416
+
+    def test_conditional_request(self, admin_client):
+        full = admin_client.get(self.url)
+        response = admin_client.get(self.url, HTTP_IF_NONE_MATCH=full['ETag'])
+        assert response.status_code == 304
+        assert response['ETag'] == full['ETag'] and response['Last-Modified'] == full['Last-Modified']
+        # A stale If-Range sends the whole file instead of the range
+        response = admin_client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"stale"')
+        assert response.status_code == 200
+
+    def test_accelerated_and_missing(self, admin_client, settings):
+        settings.MEDIA_ACCEL = 'nginx'
+        response = admin_client.get(self.url)
+        assert response['X-Accel-Redirect'] == '/protected-media/scanned_invoices/scan.pdf'
+        assert response.content == b''
+        assert admin_client.get(reverse('media', args=['../settings.py'])).status_code == 404
+
+
+@pytest.mark.django_db
+class TestQuotationRevisions:
+
+    @pytest.fixture(autouse=True)
+    def quotation(self):
+        self.quotation = Quotation(client_name="John Doe", client_email="john@example.com",
+                                   client_address="123 Main St", client_phone_number="555-1234")
+        self.quotation.save()
+        self.item = QuotationItem(quotation=self.quotation, description="Cable", quantity=2, unit_price=Decimal('10.00'))
+        self.item.save()
+
+    def test_diffs_between_snapshots_rebuild_every_revision(self, monkeypatch):
+        from .services import revision_service
+        monkeypatch.setattr(revision_service, 'SNAPSHOT_INTERVAL', 3)
+        revision_service.record_revision(self.quotation)
+        assert revision_service.record_revision(self.quotation) is None  # Nothing changed
+
+        states = [revision_service.current_state(self.quotation)]
+        for quantity in (3, 4, 5, 6):
+            self.item.quantity = quantity
+            self.item.save()
+            revision = revision_service.record_revision(self.quotation)
+            states.append(revision_service.current_state(self.quotation))
+        assert revision.number == 5
+        assert list(self.quotation.revisions.values_list('is_snapshot', flat=True)) == [True, False, False, True, False]
+        assert self.quotation.revisions.get(number=2).data == {
+            'fields': {'subtotal': '30.00', 'labour_cost': '9.00', 'grand_total': '39.00'},
+            'items': {str(self.item.pk): {'quantity': '3'}},
+            'removed_items': [],
+        }
+        for number, state in enumerate(states, start=1):
+            assert revision_service.revision_state(self.quotation.pk, number) == state
+
+    def test_totals_come_from_the_row_not_the_instance(self, admin_client):
+        from .services.revision_service import record_revision
+        extra = QuotationItem(quotation=self.quotation, description="Clip", quantity=1, unit_price=Decimal('5.00'))
+        extra.save()
+        record_revision(self.quotation)
+        QuotationItem.objects.get(pk=extra.pk).delete()  # Does not touch self.quotation
+        revision = record_revision(self.quotation)
+        assert revision.data['fields']['subtotal'] == '20.00'
+
+        # Admin inline deletes update the totals in SQL too.
+        quotation = Quotation.objects.get(pk=self.quotation.pk)
+        response = admin_client.post(reverse('admin:management_quotation_change', args=[quotation.pk]), {
+            'client_name': quotation.client_name, 'client_email': quotation.client_email,
+            'client_address': quotation.client_address, 'client_phone_number': quotation.client_phone_number,
+            'tax_rate': quotation.tax_rate, 'status': quotation.status, 'version': quotation.version,
+            'date_created_0': quotation.date_created.date().isoformat(), 'date_created_1': '12:00:00',
+            'items-TOTAL_FORMS': '1', 'items-INITIAL_FORMS': '1', 'items-0-id': self.item.pk,
+            'items-0-quotation': quotation.pk, 'items-0-description': "Cable", 'items-0-quantity': '2',
+            'items-0-unit_price': '10.00', 'items-0-DELETE': 'on',
+        })
+        assert response.status_code == 302, response.context['adminform'].form.errors
+        latest = self.quotation.revisions.latest('number')
+        assert latest.data['fields']['subtotal'] == '0.00' and latest.data['removed_items'] == [str(self.item.pk)]
+
+    def test_admin_compare_view(self, admin_client):
+        from .services.revision_service import record_revision
+        record_revision(self.quotation)
+        self.item.delete()
+        QuotationItem(quotation=self.quotation, description="Switch", quantity=1, unit_price=Decimal('5.00')).save()
+        self.quotation.client_name = "Jane Doe"
+        self.quotation.save()
+        record_revision(self.quotation)
+
+        url = reverse('admin:management_quotation_revisions', args=[self.quotation.pk])
+        response = admin_client.get(url, {'a': 1, 'b': 2})
+        assert response.status_code == 200
+        comparison = response.context['comparison']
+        assert ('client_name', 'John Doe', 'Jane Doe') in comparison['fields']
+        assert [item['change'] for item in comparison['items']] == ['removed', 'added']
+
+
+@pytest.mark.django_db
+class TestYearPartitions:
+
+    def test_command_creates_and_drops_year_indexes(self):
+        from .partitioning import existing_years
+        year = timezone.now().year
+        call_command('manage_year_partitions', since=year - 2, keep=3, stdout=mock.Mock())
+        assert existing_years('invoice') == [year - 2, year - 1, year, year + 1]
+        call_command('manage_year_partitions', keep=1, ahead=0, stdout=mock.Mock())
+        assert existing_years('receipt') == [year, year + 1]  # Future years are never dropped
+
+    def test_year_filter_and_monthly_summary(self, client):
+        from .services.report_service import monthly_summary
+        for created in (date(2025, 3, 5), date(2025, 12, 31), date(2026, 1, 1)):
+            invoice = Invoice(client_name="Client X", client_email="x@example.com", client_address="X",
+                              client_phone_number="1", date_created=created, grand_total=Decimal('100.00'))
+            invoice.save()
+            Invoice.objects.filter(pk=invoice.pk).update(date_created=created, grand_total=Decimal('100.00'))
+
+        response = client.get(reverse('invoice_list'), {'year': 2025})
+        assert len(response.context['invoices']) == 2
+        for year in (0, 9999, 99999):
+            response = client.get(reverse('invoice_list'), {'year': year})
+            assert response.status_code == 200 and not response.context['invoices']
+        summary = monthly_summary(2025)
+        assert [(row['month'], row['invoices']) for row in summary if row['invoices']] == [(3, 1), (12, 1)]
+
+
+@pytest.mark.django_db
+class TestColdArchive:
+
+    @pytest.fixture(autouse=True)
+    def archive_dir(self, settings, tmp_path):
+        from . import archive
+        settings.ARCHIVE_DIR = str(tmp_path)
+        archive.read_segment.cache_clear()
+        self.invoice = Invoice(client_name="Old Client", client_email="old@example.com",
+                               client_address="1 Old Rd", client_phone_number="555-0001")
+        self.invoice.save()
+        InvoiceItem(invoice=self.invoice, description="Survey", quantity=2, unit_price=Decimal('50.00')).save()
+        from .services.invoice_service import recalculate_invoice_totals
+        recalculate_invoice_totals(Invoice.objects.filter(pk=self.invoice.pk))
+        self.invoice.refresh_from_db()
+        Receipt(invoice=self.invoice, amount_paid=self.invoice.grand_total).save()
+        Invoice.objects.filter(pk=self.invoice.pk).update(date_created=date(2020, 6, 1))
+        self.unpaid = Invoice(client_name="Old Client", client_email="old@example.com",
+                              client_address="1 Old Rd", client_phone_number="555-0001")
+        self.unpaid.save()
+        Invoice.objects.filter(pk=self.unpaid.pk).update(date_created=date(2020, 7, 1), grand_total=Decimal('50.00'),
+                                                         status='Unpaid')
+
+    def test_paid_invoices_move_to_archive(self, client):
+        call_command('archive_closed_years', before=2021, stdout=mock.Mock())
+        assert not Invoice.objects.filter(pk=self.invoice.pk).exists()
+        assert Invoice.objects.filter(pk=self.unpaid.pk).exists()
+        assert not InvoiceItem.objects.filter(invoice_id=self.invoice.pk).exists()
+
+        response = client.get(reverse('invoice_detail', args=[self.invoice.pk]))
+        assert response.status_code == 200
+        document = response.context['document']
+        assert document.invoice['invoice_number'] == self.invoice.invoice_number
+        assert document.invoice['client_id'] == self.invoice.client_id is not None
+        assert [item['description'] for item in document.items] == ['Survey']
+        assert document.receipts[0]['amount_paid'] == str(self.invoice.grand_total)
+
+        response = client.get(reverse('invoice_list'), {'invoice_number': self.invoice.invoice_number})
+        assert [entry.invoice_id for entry in response.context['archived_invoices']] == [self.invoice.pk]
+        url = reverse('archived_invoice_detail', args=[self.invoice.invoice_number])
+        assert client.get(url).status_code == 200
+
+
+@pytest.mark.django_db
+class TestClients:
+
+    def make_quotation(self, email, name="John Doe"):
+        quotation = Quotation(client_name=name, client_email=email, client_address="123 Main St",
+                              client_phone_number="555-1234")
+        quotation.save()
+        return quotation
+
+    def test_documents_share_one_client_per_email(self):
+        from .models import Client
+        first = self.make_quotation("John@Example.com")
+        second = self.make_quotation("JOHN@example.com", name="J. Doe")
+        assert first.client_id == second.client_id
+        assert Client.objects.get().email == "john@example.com"
+
+        invoice = Invoice(quotation=first)
+        invoice.save()
+        assert invoice.client_id == first.client_id
+        standalone = Invoice(client_name="Walk-in", client_phone_number="1")
+        standalone.save()
+        assert standalone.client.name == "Walk-in"
+
+    def test_email_is_unique_and_long_emails_fit_the_name(self):
+        from django.db import IntegrityError
+        from .models import Client
+        email = f"{'a' * 150}@example.com"
+        client = Client.for_details('', email)
+        assert client.name == email[:100] and Client.for_details('', email.upper()) == client
+        with pytest.raises(IntegrityError), transaction.atomic():
+            Client.objects.create(name="Duplicate", email=email)
+
+    def test_client_balance_and_api_filter(self, client):
+        from .services.report_service import client_balance
+        quotation = self.make_quotation("john@example.com")
+        other = self.make_quotation("mary@example.com", name="Mary")
+        response = client.get(reverse('api_quotation_list'), {'client': quotation.client_id})
+        assert [row['id'] for row in response.json()['results']] == [quotation.pk]
+        assert other.client_id != quotation.client_id
+        assert client_balance(quotation.client_id)['outstanding'] == Decimal('0.00')
+
+
+@pytest.mark.django_db
+class TestCatalog:
+
+    @pytest.fixture(autouse=True)
+    def entries(self, django_capture_on_commit_callbacks):
+        from .models import CatalogItem
+        with django_capture_on_commit_callbacks(execute=True):
+            for name, price in [("CCTV camera installation", '4500.00'), ("Camera servicing", '1500.00'),
+                                ("Cable laying (per metre)", '120.00'), ("Solar panel installation", '9000.00')]:
+                CatalogItem.objects.create(name=name, unit_price=Decimal(price))
+
+    def test_prefix_suggestions_without_queries(self, client):
+        client.get(reverse('catalog_autocomplete'), {'q': 'ca'})  # Builds the index
+        with assert_max_queries(0):
+            response = client.get(reverse('catalog_autocomplete'), {'q': 'cam'})
+        names = [entry['name'] for entry in response.json()['results']]
+        assert names == ["Camera servicing", "CCTV camera installation"]  # Whole-name prefix first
+        response = client.get(reverse('catalog_autocomplete'), {'q': 'inst sol'})
+        assert [entry['name'] for entry in response.json()['results']] == ["Solar panel installation"]
+
+    def test_index_rebuilt_after_change(self, django_capture_on_commit_callbacks):
+        from . import catalog
+        from .models import CatalogItem
+        assert [entry.name for entry in catalog.suggest('pump')] == []
+        with django_capture_on_commit_callbacks(execute=True):
+            CatalogItem.objects.create(name="Borehole pump repair", unit_price=Decimal('3000.00'))
+        assert [entry.name for entry in catalog.suggest('pump')] == ["Borehole pump repair"]
+
+    def test_sales_by_item_groups_on_catalog_id(self):
+        from .models import CatalogItem
+        from .services.report_service import sales_by_item
+        camera = CatalogItem.objects.get(name="Camera servicing")
+        invoice = Invoice(client_name="Client X", client_email="x@example.com")
+        invoice.save()
+        for description in ("Camera servicing", "camera service (old name)"):
+            InvoiceItem(invoice=invoice, catalog_item=camera, description=description, quantity=1,
+                        unit_price=Decimal('1500.00')).save()
+        rows = sales_by_item(invoice.date_created.year)
+        assert rows[0]['catalog_item_id'] == camera.pk and rows[0]['sales'] == Decimal('3000.00')
+
+
+@pytest.mark.django_db
+class TestIncrementalTotals:
+
+    def test_single_item_edit_cost_is_independent_of_item_count(self):
+        quotation = Quotation(client_name="John Doe", client_email="john@example.com", client_address="1 St",
+                              client_phone_number="555", tax_rate=Decimal('16.00'))
+        quotation.save()
+        QuotationItem.objects.bulk_create([
+            QuotationItem(quotation=quotation, description=f"Item {n}", quantity=1, unit_price=Decimal('9.99'))
+            for n in range(200)
+        ])
+        from .services.quotation_service import recalculate_quotation_totals
+        recalculate_quotation_totals(Quotation.objects.filter(pk=quotation.pk))
+
+        item = QuotationItem.objects.select_related('quotation').filter(quotation=quotation).first()
+        item.quantity = 5
+        # Savepoint, item write, change event, one parent UPDATE, parent refresh, release - however many items
+        with assert_max_queries(6):
+            item.save()
+        assert item.quotation.subtotal == Decimal('9.99') * 204
+        with assert_max_queries(6):
+            QuotationItem(quotation=quotation, description="Extra", quantity=1, unit_price=Decimal('0.01')).save()
+        with assert_max_queries(6):
+            item.delete()
+
+        out = mock.Mock()
+        call_command('audit_totals', only=['quotations'], stdout=out)
+        assert "0 mismatched found" in ''.join(str(c.args[0]) for c in out.write.call_args_list)
+
+    def test_standalone_invoice_follows_item_changes(self):
+        invoice = Invoice(client_name="Client X", client_email="x@example.com", tax_rate=Decimal('10.00'))
+        invoice.save()
+        item = InvoiceItem.objects.create(invoice=invoice, description="Work", quantity=2, unit_price=Decimal('50.00'))
+        assert (invoice.subtotal, invoice.total_tax, invoice.grand_total) == (
+            Decimal('100.00'), Decimal('10.00'), Decimal('110.00'))
+        item.delete()
+        invoice.refresh_from_db()
+        assert invoice.grand_total == Decimal('0.00') and invoice.status == 'Paid'
+
+
+@pytest.mark.django_db
+class TestOptimisticConcurrency:
+
+    def make_quotation(self):
+        quotation = Quotation(client_name="John Doe", client_email="john@example.com", client_address="1 St",
+                              client_phone_number="555", tax_rate=Decimal('16.00'))
+        quotation.save()
+        QuotationItem.objects.create(quotation=quotation, description="Work", quantity=1, unit_price=Decimal('10.00'))
+        return Quotation.objects.get(pk=quotation.pk)
+
+    def post_data(self, quotation, **overrides):
+        data = {
+            'client_name': quotation.client_name, 'client_email': quotation.client_email,
+            'client_address': quotation.client_address, 'client_phone_number': quotation.client_phone_number,
+            'tax_rate': '16.00', 'status': 'Draft', 'valid_until': '', 'version': quotation.version,
+        }
+        data.update(overrides)
+        return data
+
+    def test_stale_save_raises_instead_of_overwriting(self):
+        from django.db import transaction
+        from .models import ConcurrentUpdateError
+
+        quotation = self.make_quotation()
+        first, second = Quotation.objects.get(pk=quotation.pk), Quotation.objects.get(pk=quotation.pk)
+        first.client_name = "First Editor"
+        first.save()
+        assert first.version == quotation.version + 1
+        second.client_name = "Second Editor"
+        with pytest.raises(ConcurrentUpdateError), transaction.atomic():
+            second.save()
+        assert Quotation.objects.get(pk=quotation.pk).client_name == "First Editor"
+
+    def test_item_changes_bump_the_parent_version(self):
+        quotation = self.make_quotation()
+        QuotationItem.objects.create(quotation_id=quotation.pk, description="More", quantity=1, unit_price=Decimal('5.00'))
+        assert Quotation.objects.get(pk=quotation.pk).version == quotation.version + 1
+
+    def test_stale_form_post_shows_conflict_error(self, client):
+        quotation = self.make_quotation()
+        stale = quotation.version
+        Quotation.objects.get(pk=quotation.pk).save()
+
+        response = client.post(reverse('edit_quotation', args=[quotation.pk]),
+                               self.post_data(quotation, client_name="Lost Update", version=stale))
+        assert response.status_code == 200
+        assert "Someone else saved changes" in response.content.decode()
+        assert Quotation.objects.get(pk=quotation.pk).client_name == "John Doe"
+
+        current = Quotation.objects.get(pk=quotation.pk)
+        response = client.post(reverse('edit_quotation', args=[quotation.pk]),
+                               self.post_data(current, client_name="Fresh Edit"))
+        assert response.status_code == 302
+        assert Quotation.objects.get(pk=quotation.pk).client_name == "Fresh Edit"
+
+    def test_unhandled_conflict_is_a_409(self, rf):
+        from .middleware import ConcurrentUpdateMiddleware
+        from .models import ConcurrentUpdateError
+
+        quotation = self.make_quotation()
+        response = ConcurrentUpdateMiddleware(lambda request: None).process_exception(
+            rf.post('/api/quotations/'), ConcurrentUpdateError(quotation))
+        assert response.status_code == 409
+        assert json.loads(response.content)['id'] == quotation.pk
+
+    def test_middleware_keeps_async_chains_async(self):
+        from asgiref.sync import async_to_sync, iscoroutinefunction
+        from django.http import HttpResponse
+        from .middleware import ConcurrentUpdateMiddleware
+
+        async def view(request):
+            return HttpResponse('ok')
+        middleware = ConcurrentUpdateMiddleware(view)
+        assert iscoroutinefunction(middleware)
+        assert async_to_sync(middleware)(None).content == b'ok'
+
+
+@pytest.mark.django_db(transaction=True)
+class TestChangeOutbox:
+    # Transactional: events only become readable once their transaction has committed.
+
+    def make_invoice(self):
+        invoice = Invoice(client_name="Client X", client_email="x@example.com", tax_rate=Decimal('10.00'))
+        invoice.save()
+        return invoice
+
+    def test_events_follow_changes_and_cursor_advances(self):
+        from . import outbox
+
+        invoice = self.make_invoice()
+        item = InvoiceItem.objects.create(invoice=invoice, description="Work", quantity=1, unit_price=Decimal('10.00'))
+        item_id = item.pk
+        item.delete()
+
+        seen = []
+        assert outbox.consume('test', seen.extend) == len(seen) > 0
+        changes = {(event.model, event.object_id): event for event in outbox.latest_changes(seen)}
+        assert set(changes) == {('invoice', invoice.pk), ('invoiceitem', item_id)}
+        assert changes[('invoiceitem', item_id)].action == 'deleted'
+        assert changes[('invoiceitem', item_id)].data['invoice_id'] == invoice.pk
+        assert outbox.consume('test', seen.extend) == 0  # Nothing new
+
+        invoice.refresh_from_db()
+        invoice.client_name = "Client Y"
+        invoice.save()
+        fresh = []
+        outbox.consume('test', fresh.extend)
+        assert {(event.model, event.action) for event in fresh} == {('invoice', 'updated')}
+        assert fresh[-1].data['version'] == invoice.version
+
+    def test_bulk_delete_records_the_cascade_in_bulk(self):
+        from . import outbox
+        from .models import ChangeEvent
+
+        invoices = [self.make_invoice() for _ in range(10)]
+        for invoice in invoices:
+            InvoiceItem.objects.create(invoice=invoice, description="Work", quantity=1, unit_price=Decimal('10.00'))
+        item_ids = set(InvoiceItem.objects.values_list('pk', flat=True))
+        with assert_max_queries(10):  # Whatever the number of rows
+            outbox.delete_many(Invoice.objects.filter(pk__in=[invoice.pk for invoice in invoices]))
+        deleted = ChangeEvent.objects.filter(action='deleted')
+        assert set(deleted.filter(model='invoiceitem').values_list('object_id', flat=True)) == item_ids
+        assert deleted.filter(model='invoice').count() == 10
+        assert deleted.get(model='invoiceitem', object_id=min(item_ids)).data['invoice_id'] == invoices[0].pk
+
+    def test_failed_mutation_leaves_no_event(self):
+        from .models import ChangeEvent
+
+        before = ChangeEvent.objects.count()
+        with pytest.raises(ValidationError):
+            Quotation(client_name="", client_email="not-an-email", client_address="x",
+                      client_phone_number="1").save()
+        assert ChangeEvent.objects.count() == before
+
+    def test_failed_batch_is_redelivered_and_prune_keeps_unread(self):
+        from . import outbox
+        from .models import ChangeEvent
+
+        self.make_invoice()
+
+        def fail(events):
+            raise RuntimeError("projection down")
+
+        with pytest.raises(RuntimeError):
+            outbox.consume('flaky', fail)
+        assert outbox.prune() == 0  # The cursor has not moved past anything
+        assert outbox.consume('flaky', lambda events: None) > 0
+        assert outbox.prune() > 0
+        assert not ChangeEvent.objects.exists()
+
+
+@pytest.mark.django_db(transaction=True, databases='__all__')
+class TestReplicaRouting:
+    # 'replica' mirrors the test database; transactional so it can see committed rows.
+
+    @pytest.fixture(autouse=True)
+    def replica(self, settings):
+        from django.db import connections
+
+        settings.REPLICA_READS = True
+        yield
+        connections['replica'].close()
+
+    def test_list_pages_read_from_replica_until_the_user_writes(self, client):
+        from management.query_budget import record_queries
+
+        quotation = Quotation(client_name="John Doe", client_email="john@example.com", client_address="1 St",
+                              client_phone_number="555", tax_rate=Decimal('16.00'))
+        quotation.save()
+        QuotationItem.objects.create(quotation=quotation, description="Work", quantity=1, unit_price=Decimal('10.00'))
+        quotation.refresh_from_db()
+        with record_queries(using='replica') as replica:
+            assert client.get(reverse('quotation_list')).status_code == 200
+            assert client.get(reverse('api_quotation_list')).json()['results'][0]['id'] == quotation.pk
+        assert replica.count == 2
+
+        response = client.post(reverse('edit_quotation', args=[quotation.pk]), {
+            'client_name': "Jane Doe", 'client_email': quotation.client_email, 'client_address': "1 St",
+            'client_phone_number': "555", 'tax_rate': '16.00', 'status': 'Draft', 'version': quotation.version,
+        })
+        assert response.status_code == 302 and 'primary_until' in response.cookies
+        with record_queries(using='replica') as replica:
+            response = client.get(reverse('quotation_list'))
+        assert replica.count == 0  # Pinned to the primary, so the edit is visible
+        assert response.context['quotations'][0].client_name == "Jane Doe"
+
+    def test_async_api_runs_through_an_async_middleware_chain(self, settings):
+        from asgiref.sync import async_to_sync
+        from django.test import AsyncClient
+        from django.utils.module_loading import import_string
+        from management.query_budget import record_queries
+
+        # One sync-only middleware would push every ASGI request onto a worker thread.
+        assert all(getattr(import_string(path), 'async_capable', False) for path in settings.MIDDLEWARE)
+        quotation = Quotation(client_name="John Doe", client_email="john@example.com", client_address="1 St",
+                              client_phone_number="555", tax_rate=Decimal('16.00'))
+        quotation.save()
+        with record_queries(using='replica') as replica:
+            response = async_to_sync(AsyncClient().get)(reverse('api_quotation_list'))
+        assert response.json()['results'][0]['id'] == quotation.pk
+        assert replica.count == 1
+
+    def test_reports_use_replica_and_writes_never_do(self):
+        from management.db_router import use_replica
+        from management.query_budget import record_queries
+        from management.services.report_service import monthly_summary
+
+        with record_queries(using='replica') as replica:
+            monthly_summary(timezone.now().year)
+        assert replica.count == 2
+
+        with use_replica():
+            quotation = Quotation(client_name="John Doe", client_email="john@example.com", client_address="1 St",
+                                  client_phone_number="555", tax_rate=Decimal('16.00'))
+            quotation.save()
+        assert quotation._state.db == 'default'
+
+    def test_nothing_is_routed_when_disabled(self, client, settings):
+        from management.query_budget import record_queries
+
+        settings.REPLICA_READS = False
+        with record_queries(using='replica') as replica:
+            client.get(reverse('invoice_list'))
+        assert replica.count == 0
+
+
+@pytest.mark.django_db
+class TestListRowCache:
+
+    def test_rows_are_reused_until_the_document_version_changes(self, client):
+        from django.core.cache import caches
+
+        caches['template_fragments'].clear()
+        invoice = Invoice(client_name="Cached Client", client_email="c@example.com")
+        invoice.save()
+        InvoiceItem.objects.create(invoice=invoice, description="Work", quantity=1, unit_price=Decimal('100.00'))
+        assert "Cached Client" in client.get(reverse('invoice_list')).content.decode()
+
+        # A write that does not bump the version is not seen: the row came from the cache.
+        Invoice.objects.filter(pk=invoice.pk).update(client_name="Renamed Client")
+        assert "Cached Client" in client.get(reverse('invoice_list')).content.decode()
+
+        Receipt.objects.create(invoice=Invoice.objects.get(pk=invoice.pk), amount_paid=Decimal('100.00'))
+        page = client.get(reverse('invoice_list')).content.decode()
+        assert "Renamed Client" in page and "Paid" in page
+
+
+@pytest.mark.django_db
+class TestBulkAPI:
+
+    CONTACT = {'client_address': "1 Batch Street", 'client_phone_number': "0123456789"}
+
+    def post(self, client, name, documents):
+        return client.post(reverse(name), json.dumps({'documents': documents}), content_type='application/json')
+
+    def test_batch_create_update_and_fetch(self, admin_client):
+        response = self.post(admin_client, 'api_quotation_batch', [
+            {'client_name': f"Batch Client {n}", 'client_email': f"b{n}@example.com", 'tax_rate': '10.00',
+             **self.CONTACT, 'items': [{'description': "Work", 'quantity': 2, 'unit_price': '50.00'},
+                       {'description': "Parts", 'quantity': 1, 'unit_price': '20.00'}]}
+            for n in range(3)
+        ])
+        assert response.status_code == 200
+        created = response.json()['results']
+        assert [doc['grand_total'] for doc in created] == ['171.60'] * 3  # Items 120 + 30% labour + 10% tax
+        first = created[0]
+
+        # Partial update: rename, change one item, drop the other, add a new one.
+        response = self.post(admin_client, 'api_quotation_batch', [{
+            'id': first['id'], 'version': first['version'], 'client_name': "Renamed",
+            'items': [{'id': first['items'][0]['id'], 'quantity': 3}, {'description': "Extra", 'quantity': 1, 'unit_price': '5.00'}],
+        }])
+        assert response.status_code == 200
+        updated = response.json()['results'][0]
+        assert updated['client_name'] == "Renamed" and updated['client_email'] == "b0@example.com"
+        assert [item['description'] for item in updated['items']] == ["Work", "Extra"]
+        assert Quotation.objects.get(pk=first['id']).grand_total == Decimal('221.65')
+
+        ids = ','.join(str(doc['id']) for doc in reversed(created))
+        with assert_max_queries(10):
+            response = admin_client.get(reverse('api_quotation_batch'),
+                                        {'ids': ids, 'fields': 'grand_total,items', 'item_fields': 'quantity'})
+        results = response.json()['results']
+        assert [doc['id'] for doc in results] == [doc['id'] for doc in reversed(created)]
+        assert set(results[0]) == {'id', 'grand_total', 'items'} and set(results[0]['items'][0]) == {'id', 'quantity'}
+        assert admin_client.get(reverse('api_quotation_batch'), {'ids': ids, 'fields': 'secret'}).status_code == 400
+
+    def test_batch_is_all_or_nothing(self, admin_client):
+        invoice = Invoice(client_name="Stale Client", client_email="s@example.com", **self.CONTACT)
+        invoice.save()
+        response = self.post(admin_client, 'api_invoice_batch', [
+            {'client_name': "Valid", 'client_email': "v@example.com", **self.CONTACT},
+            {'client_name': "Invalid", 'client_email': "i@example.com", **self.CONTACT,
+             'items': [{'description': "Work", 'quantity': 0, 'unit_price': '10.00'}]},
+        ])
+        assert response.status_code == 400
+        assert [error['index'] for error in response.json()['errors']] == [1]
+
+        response = self.post(admin_client, 'api_invoice_batch', [
+            {'client_name': "Valid", 'client_email': "v@example.com", **self.CONTACT},
+            {'id': invoice.pk, 'version': invoice.version + 1,
+             'client_name': "Overwritten"},
+        ])
+        assert response.status_code == 409 and response.json()['index'] == 1
+        assert not Invoice.objects.filter(client_name__in=["Valid", "Overwritten"]).exists()
+
+    def test_malformed_requests_are_rejected(self, admin_client):
+        invoice = Invoice(client_name="Shape Client", client_email="s@example.com", **self.CONTACT)
+        invoice.save()
+        url = reverse('api_invoice_batch')
+        for body in ([1, 2], "x"):
+            assert admin_client.post(url, json.dumps(body), content_type='application/json').status_code == 400
+        response = self.post(admin_client, 'api_invoice_batch', [
+            {'id': "abc", 'version': 1},
+            {'id': invoice.pk, 'version': invoice.version, 'items': [{'id': [1]}]},
+        ])
+        assert response.status_code == 400
+        assert [error['index'] for error in response.json()['errors']] == [0, 1]
+
+        # The same document (or item) twice would apply two updates against one version.
+        response = self.post(admin_client, 'api_invoice_batch', [
+            {'id': invoice.pk, 'version': invoice.version, 'client_name': "First"},
+            {'id': invoice.pk, 'version': invoice.version, 'client_name': "Second"},
+        ])
+        assert response.status_code == 400 and [error['index'] for error in response.json()['errors']] == [1]
+        item = InvoiceItem.objects.create(invoice=invoice, description="Work", quantity=1, unit_price=Decimal('5.00'))
+        invoice.refresh_from_db()
+        response = self.post(admin_client, 'api_invoice_batch', [
+            {'id': invoice.pk, 'version': invoice.version, 'items': [{'id': item.pk, 'quantity': 2}, {'id': item.pk, 'quantity': 3}]},
+        ])
+        assert response.status_code == 400 and '1' in response.json()['errors'][0]['errors']['items']
+        assert Invoice.objects.get(pk=invoice.pk).client_name == "Shape Client"
+        for fields in ({'fields': 'revisions'}, {'fields': 'stamped_invoice'}, {'item_fields': 'invoice'}):
+            assert admin_client.get(url, {'ids': str(invoice.pk), **fields}).status_code == 400
+
+    def test_requires_permission(self, client):
+        assert client.get(reverse('api_invoice_batch'), {'ids': '1'}).status_code == 401
+
+
+@pytest.mark.django_db
+class TestGeneratedLineTotals:
+
+    def test_bulk_writes_cannot_leave_line_totals_stale(self):
+        invoice = Invoice(client_name="Bulk Client", client_email="b@example.com")
+        invoice.save()
+        items = InvoiceItem.objects.bulk_create([
+            InvoiceItem(invoice=invoice, description=f"Part {n}", quantity=n + 1, unit_price=Decimal('2.50'))
+            for n in range(3)
+        ])
+        assert [item.total_price for item in items] == [Decimal('2.50'), Decimal('5.00'), Decimal('7.50')]
+
+        InvoiceItem.objects.filter(invoice=invoice).update(quantity=10)
+        assert set(InvoiceItem.objects.values_list('total_price', flat=True)) == {Decimal('25.00')}
+
+        quotation = Quotation(client_name="Bulk Client", client_email="b@example.com", client_address="1 Street",
+                              client_phone_number="0123456789", tax_rate=Decimal('0.00'))
+        quotation.save()
+        QuotationItem.objects.create(quotation=quotation, description="Big", quantity=4, unit_price=Decimal('30.00'))
+        QuotationItem.objects.create(quotation=quotation, description="Small", quantity=1, unit_price=Decimal('5.00'))
+        assert list(quotation.items.filter(line_total__gt=100).values_list('description', flat=True)) == ["Big"]
+        assert quotation.items.order_by('-line_total').first().line_total == Decimal('120.00')
+
+
+@pytest.mark.django_db
+class TestClientStatement:
+
+    def test_running_balance_and_cached_closed_months(self, django_capture_on_commit_callbacks):
+        from .services.statement_service import client_statement
+
+        today = date.today()
+        last_month = today.replace(day=1) - timedelta(days=5)
+        with django_capture_on_commit_callbacks(execute=True):
+            old = Invoice(client_name="Ledger Client", client_email="ledger@example.com", date_created=last_month)
+            old.save()
+            InvoiceItem.objects.create(invoice=old, description="Old work", quantity=1, unit_price=Decimal('100.00'))
+            Receipt.objects.create(invoice=Invoice.objects.get(pk=old.pk), amount_paid=Decimal('40.00'),
+                                   payment_date=last_month)
+            new = Invoice(client=old.client, client_name="Ledger Client", client_email="ledger@example.com",
+                          date_created=today)
+            new.save()
+            InvoiceItem.objects.create(invoice=new, description="New work", quantity=1, unit_price=Decimal('50.00'))
+
+        statement = client_statement(old.client_id, today)
+        assert [(entry.kind, entry.balance) for entry in statement.entries] == [
+            ('invoice', Decimal('100.00')), ('receipt', Decimal('60.00')), ('invoice', Decimal('110.00'))]
+
+        # Closed months come from the cache: one query for the current month.
+        with assert_max_queries(1):
+            assert client_statement(old.client_id, today).balance == Decimal('110.00')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            Receipt.objects.create(invoice=Invoice.objects.get(pk=old.pk), amount_paid=Decimal('60.00'),
+                                   payment_date=last_month)
+        statement = client_statement(old.client_id, today)
+        assert statement.balance == Decimal('50.00') and statement.paid == Decimal('100.00')
+
+    def test_moved_invoices_and_cascaded_receipts(self, django_capture_on_commit_callbacks):
+        from . import outbox
+        from .models import Client
+        from .services.statement_service import client_statement
+
+        last_month = date.today().replace(day=1) - timedelta(days=5)
+        with django_capture_on_commit_callbacks(execute=True):
+            invoice = Invoice(client_name="Mover", client_email="mover@example.com", date_created=last_month)
+            invoice.save()
+            InvoiceItem.objects.create(invoice=invoice, description="Work", quantity=1, unit_price=Decimal('10.00'))
+        old_client = invoice.client_id
+        assert client_statement(old_client).balance == Decimal('10.00')  # Now cached
+
+        invoice = Invoice.objects.get(pk=invoice.pk)
+        invoice.client = Client.objects.create(name="Other", email="other@example.com")
+        with django_capture_on_commit_callbacks(execute=True):
+            invoice.save()
+        assert client_statement(old_client).entries == []
+
+        for _ in range(8):
+            Receipt.objects.create(invoice=Invoice.objects.get(pk=invoice.pk), amount_paid=Decimal('1.00'))
+        with assert_max_queries(10):  # The receipts' client comes from their invoice's own retirement
+            outbox.delete_many(Invoice.objects.filter(pk=invoice.pk))
+
+    def test_cached_months_are_read_from_the_primary(self, monkeypatch, settings):
+        from .db_router import use_replica
+        from .services import statement_service
+        settings.REPLICA_READS = True
+        invoice = Invoice(client_name="Lag Client", client_email="lag@example.com")
+        invoice.save()
+        ledger, used = statement_service.ledger, []
+
+        def spy(*args, using=None, **kwargs):
+            used.append(using)
+            return ledger(*args, using=using or 'default', **kwargs)
+        monkeypatch.setattr(statement_service, 'ledger', spy)
+        with use_replica():
+            statement_service.client_statement(invoice.client_id)
+        assert used == ['default']
+
+    def test_admin_statement_page(self, admin_client):
+        invoice = Invoice(client_name="Page Client", client_email="page@example.com")
+        invoice.save()
+        response = admin_client.get(reverse('admin:management_client_statement', args=[invoice.client_id]))
+        assert response.status_code == 200 and invoice.invoice_number in response.content.decode()
+
+
+@pytest.mark.django_db
+class TestPaymentAllocation:
+
+    @pytest.fixture
+    def invoices(self):
+        first = Invoice(client_name="Lump Client", client_email="lump@example.com", due_date=date.today() + timedelta(days=30))
+        first.save()
+        invoices = [first]
+        for days in (10, 20):
+            invoice = Invoice(client=first.client, client_name="Lump Client", client_email="lump@example.com",
+                              due_date=date.today() + timedelta(days=days))
+            invoice.save()
+            invoices.append(invoice)
+        for invoice in invoices:
+            InvoiceItem.objects.create(invoice=invoice, description="Work", quantity=1, unit_price=Decimal('100.00'))
+        return invoices  # Due last, first, second
+
+    def test_oldest_due_first_in_a_handful_of_queries(self, invoices):
+        from .services.payment_service import allocate_payment
+
+        with assert_max_queries(9):  # Whatever the number of invoices
+            receipts = allocate_payment(invoices[0].client_id, Decimal('150.00'), payment_method='Bank Transfer')
+        assert [(receipt.invoice_id, receipt.amount_paid) for receipt in receipts] == [
+            (invoices[1].pk, Decimal('100.00')), (invoices[2].pk, Decimal('50.00'))]
+        assert len({receipt.receipt_number for receipt in receipts}) == 2
+        statuses = dict(Invoice.objects.values_list('pk', 'status'))
+        assert [statuses[invoice.pk] for invoice in invoices] == ['Unpaid', 'Paid', 'Partially Paid']
+
+    def test_receipt_numbering_holds_a_lock_until_commit(self):
+        """Payments from different clients lock no common rows, so numbering takes its own lock."""
+        with transaction.atomic():
+            Receipt.next_receipt_numbers(2)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid()")
+                assert cursor.fetchone()[0] == 1
+
+    def test_chosen_invoices_and_overpayment(self, invoices):
+        from .services.payment_service import allocate_payment
+
+        client_id = invoices[0].client_id
+        with pytest.raises(ValueError):
+            allocate_payment(client_id, Decimal('150.00'), invoice_ids=[invoices[0].pk])
+        assert not Receipt.objects.exists()
+
+        receipts = allocate_payment(client_id, Decimal('120.00'), invoice_ids=[invoices[0].pk, invoices[2].pk])
+        assert [(receipt.invoice_id, receipt.amount_paid) for receipt in receipts] == [
+            (invoices[0].pk, Decimal('100.00')), (invoices[2].pk, Decimal('20.00'))]
+
+    def test_admin_payment_page(self, admin_client, invoices):
+        url = reverse('admin:management_client_payment', args=[invoices[0].client_id])
+        assert admin_client.get(url).status_code == 200
+        response = admin_client.post(url, {'amount': '300.00', 'payment_date': date.today().isoformat()})
+        assert response.status_code == 302
+        assert set(Invoice.objects.values_list('status', flat=True)) == {'Paid'}
+
+
+@pytest.mark.django_db
+class TestRecurringInvoices:
+
+    @pytest.fixture
+    def contracts(self):
+        from .models import Client, RecurringInvoice, RecurringInvoiceItem
+
+        contracts = []
+        for n in range(5):
+            client = Client.objects.create(name=f"Contract Client {n}", email=f"contract{n}@example.com")
+            contract = RecurringInvoice.objects.create(client=client, start_date=date(2026, 1, 31),
+                                                       tax_rate=Decimal('10.00'), labour_cost=Decimal('20.00'))
+            RecurringInvoiceItem.objects.bulk_create([
+                RecurringInvoiceItem(recurring=contract, description="Maintenance", quantity=1, unit_price=Decimal('100.00')),
+                RecurringInvoiceItem(recurring=contract, description="Callouts", quantity=2, unit_price=Decimal('40.00')),
+            ])
+            contracts.append(contract)
+        return contracts
+
+    @pytest.mark.django_db(transaction=True)
+    def test_concurrent_invoices_wait_for_the_batch_numbers(self, contracts):
+        import threading
+        from .services.recurring_service import generate_batch
+
+        numbers = []
+
+        def create_invoice():
+            try:
+                invoice = Invoice(client_name="Walk-in", client_email="walkin@example.com")
+                invoice.save()
+                numbers.append(invoice.invoice_number)
+            finally:
+                connection.close()  # This thread's connection
+
+        with transaction.atomic():
+            assert generate_batch(date(2026, 1, 31))[1] == 5
+            thread = threading.Thread(target=create_invoice)
+            thread.start()
+            thread.join(0.5)
+            assert thread.is_alive()  # Waiting on the numbering lock
+        thread.join(10)
+        assert numbers and Invoice.objects.values('invoice_number').distinct().count() == 6
+
+    def test_catches_up_each_period_once(self, contracts):
+        from .services.recurring_service import generate_due_invoices
+
+        result = generate_due_invoices(date(2026, 3, 31), batch_size=2)
+        assert (result.invoices, result.items) == (15, 30)  # Jan, Feb and Mar for five contracts
+        periods = sorted(Invoice.objects.filter(recurring=contracts[0]).values_list('period', flat=True))
+        assert periods == [date(2026, 1, 31), date(2026, 2, 28), date(2026, 3, 31)]
+        invoice = Invoice.objects.filter(recurring=contracts[0]).first()
+        # Items 180 + labour 20, plus 10% tax
+        assert (invoice.subtotal, invoice.grand_total, invoice.status) == (Decimal('180.00'), Decimal('220.00'), 'Unpaid')
+        assert Invoice.objects.values('invoice_number').distinct().count() == 15
+
+        assert generate_due_invoices(date(2026, 3, 31)).invoices == 0
+
+    def test_rerun_never_duplicates_a_period(self, contracts):
+        from .models import RecurringInvoice
+        from .services.recurring_service import generate_batch
+
+        with assert_max_queries(17):  # Per batch, whatever its size
+            assert generate_batch(date(2026, 1, 31)) == (5, 5, 10)
+        # A schedule moved back by hand (or a crash between runs) does not invoice January twice.
+        RecurringInvoice.objects.update(next_period=date(2026, 1, 31))
+        assert generate_batch(date(2026, 1, 31)) == (5, 0, 0)
+        assert Invoice.objects.count() == 5
+        assert set(RecurringInvoice.objects.values_list('next_period', flat=True)) == {date(2026, 2, 28)}
@@ -1,22 +1,34 @@
 from django.urls import path
 from .views import (
     InvoiceCreateView, InvoiceUpdateView, InvoiceDetailView,
-    InvoiceDeleteView, InvoiceListView, create_quotation, quotation_list, edit_quotation )
+    InvoiceDeleteView, InvoiceListView, create_quotation, quotation_list, edit_quotation,
+    db_connection_metrics_view, archived_invoice_detail, catalog_autocomplete )
+from . import api, bulk_api, media
 from django.conf import settings
-from django.conf.urls.static import static
 
 urlpatterns = [
     path('create/', create_quotation, name='create_quotation'),  # Route for creating a quotation
     path('', quotation_list, name='quotation_list'),
     path('edit/<int:quotation_id>/', edit_quotation, name='edit_quotation'),
+    path('catalog/autocomplete/', catalog_autocomplete, name='catalog_autocomplete'),
     #Invoices
     path('invoices/', InvoiceListView.as_view(), name='invoice_list'),
     path('invoices/create/', InvoiceCreateView.as_view(), name='invoice_create'),
     path('invoices/<int:pk>/', InvoiceDetailView.as_view(), name='invoice_detail'),
     path('invoices/<int:pk>/update/', InvoiceUpdateView.as_view(), name='invoice_update'),
     path('invoices/<int:pk>/delete/', InvoiceDeleteView.as_view(), name='invoice_delete'),
-    
+    path('invoices/archived/<str:invoice_number>/', archived_invoice_detail, name='archived_invoice_detail'),
+    #JSON API: async reads, batch fetch and writes
+    path('api/quotations/', api.quotation_list_api, name='api_quotation_list'),
+    path('api/quotations/batch/', bulk_api.batch, {'kind': 'quotations'}, name='api_quotation_batch'),
+    path('api/quotations/<int:pk>/', api.quotation_detail_api, name='api_quotation_detail'),
+    path('api/invoices/', api.invoice_list_api, name='api_invoice_list'),
+    path('api/invoices/batch/', bulk_api.batch, {'kind': 'invoices'}, name='api_invoice_batch'),
+    path('api/invoices/<int:pk>/', api.invoice_detail_api, name='api_invoice_detail'),
+    path('api/receipts/', api.receipt_list_api, name='api_receipt_list'),
+    path('api/receipts/<int:pk>/', api.receipt_detail_api, name='api_receipt_detail'),
+    #Metrics
+    path('metrics/db/', db_connection_metrics_view, name='db_connection_metrics'),
+    #Uploaded scans and their previews, in every environment (see media.py)
+    path(f"{settings.MEDIA_URL.strip('/')}/<path:name>", media.serve_media, name='media'),
 ]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -1,15 +1,26 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.urls import reverse_lazy
+from django.db import transaction
 from django.db.models import Q
 from django.views.generic import CreateView, UpdateView, DetailView, DeleteView, ListView
 from .forms import QuotationForm, QuotationItemFormSet, InvoiceForm, InvoiceItemFormSet
-from .models import Quotation, QuotationItem, Invoice, InvoiceItem, Receipt
-from django.http import JsonResponse
+from .models import Quotation, QuotationItem, Invoice, InvoiceItem, Receipt, ArchivedInvoice, ConcurrentUpdateError
+from . import archive, catalog
+from django.http import Http404, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET
+from django.contrib.admin.views.decorators import staff_member_required
+from .db_metrics import connection_stats
+from .query_budget import query_budget
+from .db_router import replica_reads
+from .partitioning import in_year
+from .services.revision_service import record_revision
 import json
+from datetime import MAXYEAR, MINYEAR
 from decimal import Decimal, ROUND_HALF_UP
 
+@query_budget(30)
 def create_quotation(request, quotation_id=None):
     if quotation_id:
         # Editing an existing quotation
@@ -23,40 +34,54 @@ def create_quotation(request, quotation_id=None):
 
     if request.method == 'POST':
         if quotation_form.is_valid() and formset.is_valid():
-            # Save the quotation instance
-            quotation = quotation_form.save()
-
-            # Handle formset for QuotationItem instances
-            for form in formset:
-                if form.cleaned_data.get('DELETE'):
-                    if form.instance.pk:  # Ensure item exists before deletion
-                        form.instance.delete()
-                else:
-                    item = form.save(commit=False)
-                    item.quotation = quotation
-                    item.save()
-
-            messages.success(request, 'Quotation saved successfully!')
-            return redirect('quotation_list')
+            try:
+                # The header's versioned UPDATE locks the row, so the items
+                # below cannot interleave with another editor's save.
+                with transaction.atomic():
+                    quotation = quotation_form.save()
+
+                    # Handle formset for QuotationItem instances
+                    for form in formset:
+                        if form.cleaned_data.get('DELETE'):
+                            if form.instance.pk:  # Ensure item exists before deletion
+                                form.instance.delete()
+                        else:
+                            item = form.save(commit=False)
+                            item.quotation = quotation
+                            item.save()
+                    record_revision(quotation, request.user)
+            except ConcurrentUpdateError:
+                quotation_form.add_conflict_error()
+            else:
+                messages.success(request, 'Quotation saved successfully!')
+                return redirect('quotation_list')
 
     return render(request, 'management/quotation_form.html', {
         'form': quotation_form,
         'formset': formset,
     })
 
+@replica_reads
+@query_budget(5)
 def quotation_list(request):
     quotations = Quotation.objects.all()  # Fetch all quotations from the database
     return render(request, 'management/quotation_list.html', {'quotations': quotations})
 
 
+@query_budget(15)
 def edit_quotation(request, quotation_id):
     quotation = get_object_or_404(Quotation, id=quotation_id)  # Fetch the quotation by ID
     if request.method == 'POST':
         form = QuotationForm(request.POST, instance=quotation)  # Bind the form to the existing quotation
         if form.is_valid():
-            form.save()
-            messages.success(request, 'Quotation updated successfully!')
-            return redirect('quotation_list')  # Redirect to the quotation list
+            try:
+                with transaction.atomic():
+                    record_revision(form.save(), request.user)
+            except ConcurrentUpdateError:
+                form.add_conflict_error()
+            else:
+                messages.success(request, 'Quotation updated successfully!')
+                return redirect('quotation_list')  # Redirect to the quotation list
     else:
         form = QuotationForm(instance=quotation)  # Pre-fill the form with the existing quotation data
 
@@ -65,6 +90,7 @@ def edit_quotation(request, quotation_id):
 # Invoice views begin here
 class InvoiceCreateView(CreateView):
     model = Invoice
+    query_budget = 30
     form_class = InvoiceForm
     template_name = 'invoices/invoice_form.html'
     success_url = reverse_lazy('invoice_list')
@@ -105,6 +131,7 @@ class InvoiceCreateView(CreateView):
 
 class InvoiceUpdateView(UpdateView):
     model = Invoice
+    query_budget = 40
     form_class = InvoiceForm
     template_name = 'invoices/invoice_form.html'
     success_url = reverse_lazy('invoice_list')
@@ -121,9 +148,14 @@ class InvoiceUpdateView(UpdateView):
         context = self.get_context_data()
         formset = context['formset']
         if form.is_valid() and formset.is_valid():
-            self.object = form.save()
-            formset.instance = self.object
-            formset.save()
+            try:
+                with transaction.atomic():
+                    self.object = form.save()
+                    formset.instance = self.object
+                    formset.save()
+            except ConcurrentUpdateError:
+                form.add_conflict_error()
+                return self.form_invalid(form)
             return redirect(self.success_url)
         else:
             return self.form_invalid(form)
@@ -131,35 +163,82 @@ class InvoiceUpdateView(UpdateView):
 
 class InvoiceDetailView(DetailView):
     model = Invoice
+    query_budget = 10
     template_name = 'invoices/invoice_detail.html'
 
+    def get(self, request, *args, **kwargs):
+        try:
+            return super().get(request, *args, **kwargs)
+        except Http404:
+            # Paid invoices from closed years may have moved to the cold archive.
+            document = archive.find(invoice_id=kwargs['pk'])
+            if document is None:
+                raise
+            return render(request, 'invoices/archived_invoice_detail.html', {'document': document})
+
+
+@query_budget(3)
+def archived_invoice_detail(request, invoice_number):
+    document = archive.find(invoice_number=invoice_number)
+    if document is None:
+        raise Http404("No archived invoice with that number")
+    return render(request, 'invoices/archived_invoice_detail.html', {'document': document})
+
 
 class InvoiceDeleteView(DeleteView):
     model = Invoice
+    query_budget = 20
     template_name = 'invoices/invoice_confirm_delete.html'
     success_url = reverse_lazy('invoice_list')
 
 
 class InvoiceListView(ListView):
     model = Invoice
+    query_budget = 5
+    replica_reads = True
     template_name = 'invoices/invoice_list.html'
     context_object_name = 'invoices'
 
     def get_queryset(self):
         queryset = super().get_queryset()
         client_name = self.request.GET.get('client_name')
+        invoice_number = self.request.GET.get('invoice_number')
         status = self.request.GET.get('status')
         start_date = self.request.GET.get('start_date')
         end_date = self.request.GET.get('end_date')
-
+        year = self.request.GET.get('year')
+
+        if year and year.isdigit():
+            if MINYEAR <= int(year) < MAXYEAR:
+                # Same half-open range as the year indexes, so only that year's index is read.
+                queryset = in_year(queryset, 'date_created', int(year))
+            else:
+                queryset = queryset.none()  # No date falls in that year
         if client_name:
             queryset = queryset.filter(client_name__icontains=client_name)
+        if invoice_number:
+            queryset = queryset.filter(invoice_number__icontains=invoice_number)
         if status:
             queryset = queryset.filter(status=status)
         if start_date and end_date:
             queryset = queryset.filter(date_created__range=[start_date, end_date])
 
         return queryset
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Searches also cover the cold archive (only paid invoices are archived).
+        client_name = self.request.GET.get('client_name')
+        invoice_number = self.request.GET.get('invoice_number')
+        status = self.request.GET.get('status')
+        if (client_name or invoice_number) and status in (None, '', 'Paid'):
+            archived = ArchivedInvoice.objects.order_by('-date_created')
+            if client_name:
+                archived = archived.filter(client_name__icontains=client_name)
+            if invoice_number:
+                archived = archived.filter(invoice_number__icontains=invoice_number)
+            context['archived_invoices'] = archived[:50]
+        return context
     
 @csrf_exempt
 def create_receipt_view(request, invoice_id):
@@ -207,4 +286,21 @@ def list_receipts_view(request, invoice_id):
         }
         for receipt in receipts
     ]
-    return JsonResponse({'receipts': receipt_data})
\ No newline at end of file
+    return JsonResponse({'receipts': receipt_data})
+
+
+@query_budget(1)
+@require_GET
+def catalog_autocomplete(request):
+    """Catalog suggestions for the quotation item description field (``?q=<prefix>``)."""
+    suggestions = catalog.suggest(request.GET.get('q', ''))
+    return JsonResponse({'results': [
+        {'id': entry.id, 'name': entry.name, 'unit_price': entry.unit_price} for entry in suggestions
+    ]})
+
+
+@query_budget(5)
+@staff_member_required
+def db_connection_metrics_view(request):
+    """Expose database connection/pool statistics for the metrics scraper."""
+    return JsonResponse(connection_stats())